@@ -0,0 +1,57 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response
+from typing import List
+from app.models.user import User
+from app.schemas.profile import ProfileSummary, ProfileDetail
+from app.schemas.job import JobAccepted
+from app.core.deps import get_admin_user
+from app.core.profiling import profile_store
+from app.services.job_service import job_service
+
+router = APIRouter()
+
+@router.get("/profiles", response_model=List[ProfileSummary])
+async def list_profiles(current_user: User = Depends(get_admin_user)):
+    return [profile.summary() for profile in profile_store.list()]
+
+@router.get("/profiles/{profile_id}", response_model=ProfileDetail)
+async def get_profile(
+    profile_id: str,
+    current_user: User = Depends(get_admin_user)
+):
+    profile = profile_store.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return {**profile.summary(), "calls": profile.call_timeline()}
+
+@router.get("/profiles/{profile_id}/flamegraph")
+async def get_profile_flamegraph(
+    profile_id: str,
+    format: str = Query("speedscope", pattern="^(speedscope|html|text)$"),
+    current_user: User = Depends(get_admin_user)
+):
+    profile = profile_store.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if profile.session is None:
+        raise HTTPException(status_code=404, detail="No stack samples recorded for this profile")
+
+    from pyinstrument.renderers import ConsoleRenderer, HTMLRenderer, SpeedscopeRenderer
+    if format == "html":
+        return HTMLResponse(HTMLRenderer().render(profile.session))
+    if format == "text":
+        return PlainTextResponse(ConsoleRenderer(unicode=True, color=False).render(profile.session))
+    return Response(
+        content=SpeedscopeRenderer().render(profile.session),
+        media_type="application/json",
+        headers={"Content-Disposition": f"attachment; filename=profile-{profile.id}.speedscope.json"}
+    )
+
+@router.post("/migrations/s3-keys", response_model=JobAccepted, status_code=202)
+async def migrate_s3_keys(current_user: User = Depends(get_admin_user)):
+    """Moves stored objects to the configured S3_KEY_LAYOUT in the background."""
+    job = await job_service.enqueue("s3_key_migration", user_id=str(current_user.id))
+    return JSONResponse(
+        status_code=202,
+        content=JobAccepted(job_id=job["id"], status=job["status"]).model_dump()
+    )
@@ -0,0 +1,17 @@
+from fastapi import APIRouter, Depends, HTTPException
+from app.models.user import User
+from app.schemas.job import JobResponse
+from app.core.deps import get_current_user
+from app.services.job_service import job_service
+
+router = APIRouter()
+
+@router.get("/{job_id}", response_model=JobResponse)
+async def get_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    job = await job_service.get(job_id)
+    if not job or job.get("user_id") != str(current_user.id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
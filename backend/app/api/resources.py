@@ -1,18 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Request
-from typing import List
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from typing import List, Optional
 from beanie import PydanticObjectId
 from app.models.user import User
 from app.models.resource import Resource, ResourceType, Permission
 from app.schemas.resource import (
     ResourceResponse, FolderCreate, FolderContents, 
     FileUploadInit, FileUploadResponse, FileUploadConfirm, BulkFileUploadInit,
-    BulkDeleteRequest, TreeDelta, BulkInitResponse, ResourceMoveRequest
+    BulkDeleteRequest, TreeDelta, BulkInitResponse, ResourceMoveRequest,
+    BulkFileUploadConfirm, BulkConfirmResponse, ContentPatch, SearchResults,
+    BulkDownloadRequest, BulkDownloadLinks
 )
-from app.core.deps import get_current_user
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from app.core.responses import FastJSONResponse, etag_matches, make_etag
+from app.schemas.job import JobAccepted
+from app.core.deps import admission, get_admin_user, get_current_user
 from app.services.metadata_service import metadata_service
 from app.services.upload_service import upload_service
 from app.services.download_service import download_service
 from app.services.cleanup_service import cleanup_service
+from app.services.job_service import job_service
+from app.services.search_service import search_service
+from app.services.tree_cache_service import tree_cache_service
+from app.services.admission_service import admission_service
+from app.services import serializers
+import mimetypes
 import os
 
 router = APIRouter()
@@ -24,18 +36,61 @@ async def create_folder(
 ):
     return await metadata_service.create_folder(folder_in, current_user)
 
+def _revalidation_headers(etag: Optional[str]) -> dict:
+    if not etag:
+        return {}
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
 @router.get("/folders/{folder_id}", response_model=FolderContents)
 async def get_folder_contents(
     folder_id: PydanticObjectId,
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user)
 ):
-    return await metadata_service.get_folder_contents(folder_id, current_user)
+    # Access is checked before anything is revealed, even a 304.
+    folder = await metadata_service.get_readable_folder(folder_id, current_user)
+    # The version is read before the listing, so a concurrent change can
+    # only make the ETag older than the body, never newer.
+    etag = make_etag("folder", await tree_cache_service.folder_version(folder_id))
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=_revalidation_headers(etag))
+    contents = await metadata_service.get_folder_contents(folder, current_user)
+    return FastJSONResponse(contents, headers=_revalidation_headers(etag))
 
 @router.get("/tree")
-async def get_tree(current_user: User = Depends(get_current_user)):    
-    return await metadata_service.get_tree(current_user)
+async def get_tree(
+    root_id: Optional[PydanticObjectId] = None,
+    depth: Optional[int] = Query(None, ge=0),
+    stream: bool = False,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    if root_id or depth is not None or stream:
+        # Walked level by level instead of served from the whole-drive cache,
+        # so it is admitted like a rebuild.
+        lease = await admission_service.acquire("tree", current_user.id)
+        try:
+            nodes = await metadata_service.get_subtree(root_id or current_user.root_id, current_user, depth)
+            if stream:
+                response = StreamingResponse(
+                    metadata_service.iter_ndjson(nodes),
+                    media_type="application/x-ndjson",
+                    background=BackgroundTask(admission_service.release, "tree", current_user.id, lease)
+                )
+                lease = None  # released once the body has been sent
+                return response
+            return FastJSONResponse({"tree": [node async for _, node in nodes]})
+        finally:
+            await admission_service.release("tree", current_user.id, lease)
 
-@router.post("/upload/init", response_model=dict)
+    if if_none_match:
+        etag = make_etag("tree", await tree_cache_service.tree_version(current_user.id))
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=_revalidation_headers(etag))
+    payload, version = await metadata_service.get_tree(current_user)
+    return Response(content=payload, media_type="application/json", headers=_revalidation_headers(make_etag("tree", version)))
+
+@router.post("/upload/init", response_model=FileUploadResponse)
 async def init_upload(
     upload_in: FileUploadInit,
     current_user: User = Depends(get_current_user)
@@ -47,7 +102,8 @@ async def init_upload_bulk(
     bulk_in: BulkFileUploadInit,
     current_user: User = Depends(get_current_user)
 ):
-    return await upload_service.init_upload_bulk(bulk_in, current_user)
+    result = await upload_service.init_upload_bulk(bulk_in, current_user)
+    return FastJSONResponse({"files": result["files"], "delta": serializers.tree_delta(result["delta"])})
 
 @router.post("/upload/confirm", response_model=ResourceResponse)
 async def confirm_upload(
@@ -56,6 +112,22 @@ async def confirm_upload(
 ):
     return await upload_service.confirm_upload(confirm_in, current_user)
 
+@router.post("/upload/confirm/bulk", response_model=BulkConfirmResponse)
+async def confirm_upload_bulk(
+    bulk_in: BulkFileUploadConfirm,
+    current_user: User = Depends(get_current_user)
+):
+    result = await upload_service.confirm_upload_bulk(bulk_in, current_user)
+    return FastJSONResponse({"results": [
+        {
+            "resource_id": str(item["resource_id"]),
+            "success": item["success"],
+            "error": item.get("error"),
+            "resource": serializers.resource_model(item["resource"]) if item.get("resource") else None
+        }
+        for item in result["results"]
+    ]})
+
 @router.post("/resources/{resource_id}/share", response_model=ResourceResponse)
 async def share_resource(
     resource_id: PydanticObjectId,
@@ -85,21 +157,31 @@ async def unshare_resource(
 async def get_shared_resources(
     current_user: User = Depends(get_current_user)
 ):    
-    return await metadata_service.get_shared_resources(current_user)
+    return FastJSONResponse(await metadata_service.get_shared_resources(current_user))
+
+@router.get("/search", response_model=SearchResults)
+async def search_resources(
+    q: str = Query(..., min_length=1, max_length=255),
+    prefix: bool = False,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    return FastJSONResponse(await search_service.search(q, current_user, prefix=prefix, limit=limit, cursor=cursor))
 
 @router.delete("/resources/bulk-delete", response_model=TreeDelta)
 async def delete_resources_bulk(
     bulk_in: BulkDeleteRequest,
     current_user: User = Depends(get_current_user)
 ):
-    return await metadata_service.delete_resources_bulk(bulk_in.resource_ids, current_user)
+    return FastJSONResponse(serializers.tree_delta(await metadata_service.delete_resources_bulk(bulk_in.resource_ids, current_user)))
 
 @router.delete("/resources/{resource_id}", response_model=TreeDelta)
 async def delete_resource(
     resource_id: PydanticObjectId,
     current_user: User = Depends(get_current_user)
 ):
-    return await metadata_service.delete_resource(resource_id, current_user)
+    return FastJSONResponse(serializers.tree_delta(await metadata_service.delete_resource(resource_id, current_user)))
 
 @router.get("/download/{resource_id}")
 async def get_download_link(
@@ -116,38 +198,137 @@ async def get_download_link(
     base_url = str(request.base_url).rstrip("/")
     return await download_service.get_download_link(resource_id, disposition, current_user, token, base_url)
 
+@router.post("/download/links", response_model=BulkDownloadLinks)
+async def get_download_links(
+    bulk_in: BulkDownloadRequest,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    auth_header = request.headers.get("Authorization")
+    token = None
+    if auth_header and auth_header.startswith("Bearer "):
+        token = auth_header.split(" ")[1]
+
+    base_url = str(request.base_url).rstrip("/")
+    links = await download_service.get_download_links(bulk_in.resource_ids, bulk_in.disposition, current_user, token, base_url)
+    return FastJSONResponse({"links": [
+        {"resource_id": str(link["resource_id"]), "url": link["url"], "error": link["error"]}
+        for link in links
+    ]})
+
+@router.get("/resources/{resource_id}/content")
+async def get_resource_content(
+    resource_id: PydanticObjectId,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    """Content of a small file, for the editor. Larger files are downloaded."""
+    resource = await metadata_service.get_content_resource(resource_id, current_user)
+    # The same version tag the content endpoints take in If-Match.
+    etag = f'"{resource.content_version}"'
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=_revalidation_headers(etag))
+    content, version = await metadata_service.read_content(resource)
+    if version != resource.content_version:
+        etag = f'"{version}"' if version is not None else None
+    media_type = mimetypes.guess_type(resource.name)[0] or "application/octet-stream"
+    return Response(content=content, media_type=media_type, headers=_revalidation_headers(etag))
+
 @router.put("/resources/{resource_id}/content")
 async def update_resource_content(
     resource_id: PydanticObjectId,
     content: Request, 
     current_user: User = Depends(get_current_user)
 ):
-    body = await content.body()
-    return await metadata_service.update_resource_content(resource_id, body, current_user)
+    content_length = content.headers.get("content-length")
+    return await metadata_service.update_resource_content(
+        resource_id,
+        content.stream(),
+        current_user,
+        content_length=int(content_length) if content_length and content_length.isdigit() else None,
+        base_version=_parse_version_etag(content.headers.get("if-match"))
+    )
+
+@router.patch("/resources/{resource_id}/content")
+async def patch_resource_content(
+    resource_id: PydanticObjectId,
+    patch_in: ContentPatch,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    return await metadata_service.patch_resource_content(
+        resource_id,
+        patch_in,
+        current_user,
+        base_version=_parse_version_etag(if_match)
+    )
+
+def _parse_version_etag(etag: Optional[str]) -> Optional[int]:
+    if not etag:
+        return None
+    value = etag.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    value = value.strip('"')
+    if not value.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid If-Match header")
+    return int(value)
 
-@router.get("/download/zip/{resource_id}")
+async def get_token_user(token: str = Query(...)) -> User:
+    # ZIP links are opened by the browser directly, so the token rides in the URL.
+    return await download_service.get_user_from_token(token)
+
+@router.get("/download/zip/{resource_id}", dependencies=[Depends(admission("zip", get_token_user))])
 async def download_folder_zip(
     resource_id: PydanticObjectId,
-    token: str = Query(...)
+    current_user: User = Depends(get_token_user)
 ):
-    return await download_service.stream_folder_zip(resource_id, token)
+    return await download_service.stream_folder_zip(resource_id, current_user)
 
 @router.post("/resources/move", response_model=TreeDelta)
 async def move_resources(
     move_in: ResourceMoveRequest,
     current_user: User = Depends(get_current_user)
 ):
-    return await metadata_service.move_resources(move_in.resource_ids, move_in.target_parent_id, current_user)
+    return FastJSONResponse(serializers.tree_delta(await metadata_service.move_resources(move_in.resource_ids, move_in.target_parent_id, current_user)))
 
 @router.post("/resources/copy", response_model=TreeDelta)
 async def copy_resources(
     copy_in: ResourceMoveRequest,
+    background: bool = Query(False),
     current_user: User = Depends(get_current_user)
 ):
-    return await metadata_service.copy_resources(copy_in.resource_ids, copy_in.target_parent_id, current_user)
+    lease = await admission_service.acquire("copy", current_user.id)
+    try:
+        if background:
+            job = await job_service.enqueue(
+                "copy",
+                {
+                    "resource_ids": [str(rid) for rid in copy_in.resource_ids],
+                    "target_parent_id": str(copy_in.target_parent_id),
+                    # The job holds the in-flight slot until it finishes.
+                    "admission_lease": lease
+                },
+                user_id=str(current_user.id)
+            )
+            lease = None
+            return _job_accepted(job)
+        return FastJSONResponse(serializers.tree_delta(await metadata_service.copy_resources(copy_in.resource_ids, copy_in.target_parent_id, current_user)))
+    finally:
+        await admission_service.release("copy", current_user.id, lease)
 
-@router.post("/cleanup", response_model=dict)
+@router.post("/cleanup", response_model=dict, dependencies=[Depends(admission("cleanup", get_admin_user))])
 async def trigger_cleanup(
-    current_user: User = Depends(get_current_user)
+    background: bool = Query(False),
+    current_user: User = Depends(get_admin_user)
 ):
+    if background:
+        job = await job_service.enqueue("cleanup", user_id=str(current_user.id))
+        return _job_accepted(job)
     return await cleanup_service.cleanup_deleted_resources()
+
+def _job_accepted(job: dict) -> JSONResponse:
+    return JSONResponse(
+        status_code=202,
+        content=JobAccepted(job_id=job["id"], status=job["status"]).model_dump()
+    )
@@ -5,7 +5,15 @@ from app.api import resources
 api_router = APIRouter()
 
 from app.api import users
+from app.api import jobs
+from app.api import admin
+from app.api import storage_events
+from app.api import storage
 
 api_router.include_router(auth.router, prefix="/auth", tags=["auth"])
 api_router.include_router(users.router, prefix="/users", tags=["users"])
+api_router.include_router(jobs.router, prefix="/jobs", tags=["jobs"])
+api_router.include_router(admin.router, prefix="/admin", tags=["admin"])
+api_router.include_router(storage_events.router, prefix="/storage", tags=["storage"])
+api_router.include_router(storage.router, prefix="/storage", tags=["storage"])
 api_router.include_router(resources.router, tags=["resources"]) 
@@ -0,0 +1,56 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response
+from app.services.storage_service import storage_service
+from app.services.filesystem_storage import FilesystemStorage
+import os
+
+router = APIRouter()
+
+def _filesystem_storage() -> FilesystemStorage:
+    if not isinstance(storage_service, FilesystemStorage):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return storage_service
+
+def _object_path(storage: FilesystemStorage, key: str) -> str:
+    try:
+        return storage.path(key)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid key")
+
+@router.put("/objects/{key:path}")
+async def put_object(
+    key: str,
+    request: Request,
+    expires: int = Query(...),
+    signature: str = Query(...)
+):
+    """Target of the signed upload URLs handed out by the filesystem backend."""
+    storage = _filesystem_storage()
+    if not storage.verify_signature("PUT", key, expires, signature):
+        raise HTTPException(status_code=403, detail="Invalid or expired signature")
+    _object_path(storage, key)
+    etag = await storage.write_stream(key, request.stream())
+    return Response(status_code=200, headers={"ETag": etag})
+
+@router.get("/objects/{key:path}")
+async def get_object(
+    key: str,
+    expires: int = Query(...),
+    signature: str = Query(...),
+    disposition: str = Query("attachment", pattern="^(attachment|inline)$")
+):
+    """Serves signed download URLs. Range requests are answered from the
+    file, and servers supporting the ASGI pathsend extension send it with
+    sendfile."""
+    storage = _filesystem_storage()
+    if not storage.verify_signature("GET", key, expires, signature, disposition):
+        raise HTTPException(status_code=403, detail="Invalid or expired signature")
+    path = _object_path(storage, key)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return FileResponse(
+        path,
+        filename=key.rsplit("/", 1)[-1],
+        content_disposition_type=disposition,
+        headers={"Cache-Control": "private, max-age=3600"}
+    )
@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Header, HTTPException
+from typing import Optional
+from app.core.config import get_settings
+from app.schemas.storage_event import StorageEventBatch, StorageEventResult
+from app.services.upload_service import upload_service
+import hmac
+
+router = APIRouter()
+
+@router.post("/events", response_model=StorageEventResult)
+async def ingest_storage_events(
+    batch: StorageEventBatch,
+    x_drive_event_secret: Optional[str] = Header(None)
+):
+    """S3 event notifications, forwarded as-is (e.g. by a Lambda or SQS consumer)."""
+    secret = get_settings().storage_event_secret
+    if not secret:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_drive_event_secret or not hmac.compare_digest(x_drive_event_secret, secret):
+        raise HTTPException(status_code=401, detail="Invalid event secret")
+    return await upload_service.confirm_from_events(batch)
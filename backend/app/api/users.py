@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends, Query
 from typing import List
 from app.models.user import User
 from app.core.deps import get_current_user
+from app.core.database import read_collection
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -15,8 +16,10 @@ async def search_users(
     q: str = Query(..., min_length=1),
     current_user: User = Depends(get_current_user)
 ):
-    users = await User.find(
-        {"username": {"$regex": f"^{q}", "$options": "i"}}
-    ).limit(5).to_list()
+    cursor = read_collection(User).find(
+        {"username": {"$regex": f"^{q}", "$options": "i"}},
+        {"username": 1}
+    ).limit(5)
+    users = await cursor.to_list(length=5)
     
-    return [UserSearchResponse(username=u.username, id=str(u.id)) for u in users]
+    return [UserSearchResponse(username=u["username"], id=str(u["_id"])) for u in users]
@@ -1,14 +1,36 @@
+from pydantic import field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from functools import lru_cache
 
 class Settings(BaseSettings):
-    aws_access_key_id: str
-    aws_secret_access_key: str
-    aws_region: str
-    s3_bucket_name: str
+    storage_backend: str = "s3"  # or "filesystem"
+    # Without keys boto3 falls back to its usual credential chain.
+    aws_access_key_id: str | None = None
+    aws_secret_access_key: str | None = None
+    aws_region: str = "us-east-1"
+    s3_bucket_name: str | None = None
+    s3_endpoint_url: str | None = None  # defaults to the regional AWS endpoint
+    # Filesystem backend: objects live under storage_root and are uploaded
+    # and downloaded through signed URLs served by the app. The public URL
+    # must be reachable by browsers; set it to an absolute URL when the API
+    # is on another origin than the frontend.
+    storage_root: str = "./storage"
+    storage_public_url: str = "/api/v1/storage/objects"
+    storage_signing_key: str | None = None  # defaults to secret_key
     
     database_url: str 
     database_name: str = "drive"
+    database_sync_indexes: bool = True
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 0
+    mongo_max_idle_time_ms: int | None = None
+    mongo_wait_queue_timeout_ms: int | None = None
+    mongo_connect_timeout_ms: int = 20000
+    mongo_server_selection_timeout_ms: int = 30000
+    mongo_socket_timeout_ms: int | None = None
+    mongo_compressors: str | None = None  # e.g. "zstd,snappy,zlib"
+    mongo_secondary_reads: bool = False
+    mongo_max_staleness_seconds: int = 90
     secret_key: str
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 1440
@@ -17,9 +39,93 @@ class Settings(BaseSettings):
     redis_host: str = "localhost"
     redis_port: int = 6379
     redis_password: str | None = None
+    redis_ssl: bool = True
+
+    s3_key_layout: str = "hashed"  # or "flat"; see storage_backend.build_s3_key
+    s3_key_shard_chars: int = 4
+
+    upload_reservation_ttl_seconds: int = 6 * 3600
+    max_content_body_size: int = 512 * 1024 * 1024
+    download_links_max_batch: int = 2000
+    content_upload_part_size: int = 8 * 1024 * 1024
+    # Lease on a file's content while a save writes it, renewed as the
+    # body streams in.
+    content_lock_seconds: int = 60
+
+    # Shared secret expected in X-Drive-Event-Secret on storage event
+    # deliveries; the endpoint is disabled while unset.
+    storage_event_secret: str | None = None
+    # Bearer token a Prometheus scraper can use for /metrics instead of an
+    # admin login; only admins can read it while unset.
+    metrics_token: str | None = None
+
+    preview_processes: int = 2
+    preview_queue_size: int = 10000
+    preview_max_source_size: int = 50 * 1024 * 1024
+
+    job_backend: str = "redis"
+    job_workers: int = 2
+    job_max_attempts: int = 3
+    job_retry_base_seconds: float = 5.0
+    job_leader_lease_seconds: int = 30
+    # Jobs held by a node that has not renewed its lease for this long are
+    # put back on the queue.
+    job_node_lease_seconds: int = 30
+    cleanup_interval_seconds: int = 3600
+
+    tree_refresh_enabled: bool = True
+    tree_refresh_delay_seconds: float = 1.0
+    tree_refresh_max_delay_seconds: float = 5.0
+    tree_refresh_concurrency: int = 2
+    tree_stale_max_seconds: int = 30  # 0 always rebuilds on the request path
+    tree_prewarm_on_login: bool = True
+
+    # Files up to this size are served from GET /resources/{id}/content out
+    # of an in-process LRU of content_cache_memory_bytes, backed by Redis.
+    content_cache_max_file_size: int = 256 * 1024
+    content_cache_memory_bytes: int = 64 * 1024 * 1024
+    content_cache_ttl_seconds: int = 24 * 3600
+
+    # Per user and endpoint class (zip, copy, tree, cleanup): a token bucket
+    # refilled at `rate` per second up to `burst`, and a cap on requests in
+    # flight. 0 turns the respective limit off.
+    admission_enabled: bool = True
+    admission_zip_rate: float = 0.2
+    admission_zip_burst: int = 3
+    admission_zip_concurrency: int = 2
+    admission_copy_rate: float = 0.5
+    admission_copy_burst: int = 5
+    admission_copy_concurrency: int = 2
+    admission_tree_rate: float = 2.0
+    admission_tree_burst: int = 10
+    admission_tree_concurrency: int = 2
+    admission_cleanup_rate: float = 1 / 60
+    admission_cleanup_burst: int = 1
+    admission_cleanup_concurrency: int = 1
+    # In-flight slots held longer than this (a crashed worker, a very long
+    # ZIP) are given back.
+    admission_lease_seconds: int = 900
+    # While the event loop lags by more than this, expensive endpoints are
+    # refused for everyone; 0 disables shedding.
+    load_shed_event_loop_lag_seconds: float = 0.5
+
+    profiling_header: str = "X-Drive-Profile"
+    profiling_sample_rate: float = 0.0
+    profiling_buffer_size: int = 50
+    profiling_interval_seconds: float = 0.001
+    profiling_max_concurrent: int = 1
 
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
+    @field_validator("content_upload_part_size")
+    @classmethod
+    def _check_part_size(cls, value: int) -> int:
+        # S3 rejects multipart uploads whose parts (all but the last) are
+        # smaller than this.
+        if value < 5 * 1024 * 1024:
+            raise ValueError("content_upload_part_size must be at least 5 MiB")
+        return value
+
 @lru_cache
 def get_settings():
     return Settings()
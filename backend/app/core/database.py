@@ -1,17 +1,53 @@
+from typing import Optional
 from motor.motor_asyncio import AsyncIOMotorClient
 from beanie import init_beanie
+from pymongo.read_preferences import SecondaryPreferred
 from app.core.config import get_settings
+from app.core.metrics import MongoCommandMetrics
 from app.models.user import User
 from app.models.resource import Resource
+from app.models.upload import UploadReservation
 
 settings = get_settings()
 
-import dns.resolver
+DOCUMENT_MODELS = [User, Resource, UploadReservation]
 
-async def init_db():
-    dns.resolver.default_resolver = dns.resolver.Resolver(configure=False)
-    dns.resolver.default_resolver.nameservers = ['8.8.8.8']
-    
-    client = AsyncIOMotorClient(settings.database_url)
+def client_options() -> dict:
+    options = {
+        "maxPoolSize": settings.mongo_max_pool_size,
+        "minPoolSize": settings.mongo_min_pool_size,
+        "connectTimeoutMS": settings.mongo_connect_timeout_ms,
+        "serverSelectionTimeoutMS": settings.mongo_server_selection_timeout_ms,
+    }
+    optional = {
+        "maxIdleTimeMS": settings.mongo_max_idle_time_ms,
+        "waitQueueTimeoutMS": settings.mongo_wait_queue_timeout_ms,
+        "socketTimeoutMS": settings.mongo_socket_timeout_ms,
+        "compressors": settings.mongo_compressors,
+    }
+    options.update({k: v for k, v in optional.items() if v is not None})
+    return options
+
+async def init_db(sync_indexes: Optional[bool] = None):
+    # Index creation is a round trip per index on every boot. Deployments
+    # that run `python -m app.core.migrate` can switch it off.
+    if sync_indexes is None:
+        sync_indexes = settings.database_sync_indexes
+
+    client = AsyncIOMotorClient(settings.database_url, event_listeners=[MongoCommandMetrics()], **client_options())
     db = client[settings.database_name]
-    await init_beanie(database=db, document_models=[User, Resource])
+    await init_beanie(database=db, document_models=DOCUMENT_MODELS, skip_indexes=not sync_indexes)
+
+def read_collection(document_model, allow_secondary: bool = True):
+    """Collection handle for reads that tolerate bounded replication lag.
+
+    With MONGO_SECONDARY_READS on, reads go to a secondary no more than
+    MONGO_MAX_STALENESS_SECONDS behind. Callers pass allow_secondary=False
+    when the user has just written and must see their own change.
+    """
+    collection = document_model.get_pymongo_collection()
+    if not (allow_secondary and settings.mongo_secondary_reads):
+        return collection
+    return collection.with_options(
+        read_preference=SecondaryPreferred(max_staleness=settings.mongo_max_staleness_seconds)
+    )
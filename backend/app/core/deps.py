@@ -1,8 +1,11 @@
 from fastapi import Depends, HTTPException, status
+from typing import Callable
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from app.core.config import get_settings
 from app.models.user import User
+from app.services.admission_service import admission_service
+import hmac
 
 settings = get_settings()
 
@@ -26,3 +29,25 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     if user is None:
         raise credentials_exception
     return user
+
+async def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
+    if not current_user.is_admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
+
+async def verify_metrics_reader(token: str = Depends(oauth2_scheme)):
+    """Admins, or a scraper sending METRICS_TOKEN as its bearer token."""
+    if settings.metrics_token and hmac.compare_digest(token, settings.metrics_token):
+        return
+    await get_admin_user(await get_current_user(token))
+
+def admission(endpoint_class: str, user_dependency: Callable = get_current_user) -> Callable:
+    """Dependency admitting the request under `endpoint_class` limits.
+
+    The in-flight slot is held until the response, streamed or not, has
+    been sent.
+    """
+    async def admit(current_user: User = Depends(user_dependency)):
+        async with admission_service.admit(endpoint_class, current_user.id):
+            yield
+    return admit
@@ -0,0 +1,200 @@
+from typing import Callable
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+from pymongo import monitoring
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core.profiling import record_call
+import redis.asyncio as redis
+import asyncio
+import functools
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REQUEST_LATENCY = Histogram(
+    "drive_http_request_duration_seconds",
+    "HTTP request latency by route, until the last body byte is sent",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+DEPENDENCY_LATENCY = Histogram(
+    "drive_dependency_call_duration_seconds",
+    "Latency of calls to Mongo, S3 and Redis",
+    ["dependency", "operation"],
+    buckets=LATENCY_BUCKETS
+)
+DEPENDENCY_CALLS = Counter(
+    "drive_dependency_calls_total",
+    "Calls to Mongo, S3 and Redis",
+    ["dependency", "operation", "outcome"]
+)
+TREE_CACHE = Counter(
+    "drive_tree_cache_requests_total",
+    "Tree cache lookups",
+    ["result"]
+)
+CONTENT_CACHE = Counter(
+    "drive_content_cache_requests_total",
+    "File content cache lookups",
+    ["result"]
+)
+ZIP_BYTES = Counter(
+    "drive_zip_bytes_streamed_total",
+    "Bytes streamed by folder ZIP downloads"
+)
+EVENT_LOOP_LAG = Gauge(
+    "drive_event_loop_lag_seconds",
+    "Most recent event loop scheduling delay"
+)
+EVENT_LOOP_LAG_HISTOGRAM = Histogram(
+    "drive_event_loop_lag_distribution_seconds",
+    "Event loop scheduling delay",
+    buckets=LATENCY_BUCKETS
+)
+
+ADMISSION_REJECTED = Counter(
+    "drive_admission_rejected_total",
+    "Requests to expensive endpoints turned away",
+    ["endpoint_class", "reason"]
+)
+
+EVENT_LOOP_PROBE_INTERVAL = 0.5
+
+_event_loop_lag = 0.0
+
+
+def observe_dependency(dependency: str, operation: str, duration: float, ok: bool = True):
+    DEPENDENCY_LATENCY.labels(dependency, operation).observe(duration)
+    DEPENDENCY_CALLS.labels(dependency, operation, "ok" if ok else "error").inc()
+    record_call(dependency, operation, duration, ok)
+
+
+def timed_dependency(dependency: str) -> Callable:
+    """Decorator recording latency and outcome of a sync or async call."""
+    def decorator(func):
+        operation = func.__name__
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                ok = False
+                try:
+                    result = await func(*args, **kwargs)
+                    ok = True
+                    return result
+                finally:
+                    observe_dependency(dependency, operation, time.perf_counter() - start, ok)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            ok = False
+            try:
+                result = func(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                observe_dependency(dependency, operation, time.perf_counter() - start, ok)
+        return wrapper
+    return decorator
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        observe_dependency("mongo", event.command_name, event.duration_micros / 1e6, True)
+
+    def failed(self, event):
+        observe_dependency("mongo", event.command_name, event.duration_micros / 1e6, False)
+
+
+class InstrumentedRedis(redis.Redis):
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = await super().execute_command(*args, **options)
+            ok = True
+            return result
+        finally:
+            operation = str(args[0]).lower() if args else "unknown"
+            observe_dependency("redis", operation, time.perf_counter() - start, ok)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> "InstrumentedPipeline":
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    """Queued commands are sent in one round trip, timed as a single call."""
+
+    async def execute(self, raise_on_error: bool = True):
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = await super().execute(raise_on_error)
+            ok = True
+            return result
+        finally:
+            observe_dependency("redis", "pipeline", time.perf_counter() - start, ok)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware so streamed bodies (ZIPs) are timed to completion."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            REQUEST_LATENCY.labels(scope["method"], route_path, str(status["code"])).observe(time.perf_counter() - start)
+
+
+async def monitor_event_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + EVENT_LOOP_PROBE_INTERVAL
+        await asyncio.sleep(EVENT_LOOP_PROBE_INTERVAL)
+        lag = max(0.0, loop.time() - expected)
+        global _event_loop_lag
+        _event_loop_lag = lag
+        EVENT_LOOP_LAG.set(lag)
+        EVENT_LOOP_LAG_HISTOGRAM.observe(lag)
+
+
+def event_loop_lag() -> float:
+    """Lag measured by the most recent probe in this process."""
+    return _event_loop_lag
+
+
+def render_metrics() -> tuple:
+    # With several uvicorn workers, set PROMETHEUS_MULTIPROC_DIR so every
+    # worker's samples are aggregated into one scrape.
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,40 @@
+"""One-off schema tasks, run once per deploy before the workers start:
+
+    python -m app.core.migrate
+"""
+from pymongo import UpdateOne
+from app.core.database import init_db
+from app.models.resource import Resource, name_ngrams
+import asyncio
+import logging
+import time
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+async def migrate():
+    start_time = time.time()
+    await init_db(sync_indexes=True)
+    logger.info(f"Indexes synced in {time.time() - start_time:.2f}s")
+    await backfill_name_ngrams()
+
+async def backfill_name_ngrams(batch_size: int = 1000):
+    """Fills the search index for resources created before it existed."""
+    start_time = time.time()
+    collection = Resource.get_pymongo_collection()
+    cursor = collection.find({"name_ngrams": {"$exists": False}}, {"name": 1})
+    updated = 0
+    ops = []
+    async for doc in cursor:
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"name_ngrams": name_ngrams(doc["name"])}}))
+        if len(ops) >= batch_size:
+            await collection.bulk_write(ops, ordered=False)
+            updated += len(ops)
+            ops = []
+    if ops:
+        await collection.bulk_write(ops, ordered=False)
+        updated += len(ops)
+    logger.info(f"Backfilled name_ngrams on {updated} resources in {time.time() - start_time:.2f}s")
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
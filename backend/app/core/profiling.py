@@ -0,0 +1,218 @@
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import List, Optional
+from urllib.parse import parse_qsl, urlencode
+from jose import jwt, JWTError
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core.config import get_settings
+import logging
+import random
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("drive_request_profile", default=None)
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, query: str, trigger: str, username: Optional[str]):
+        self.id = uuid.uuid4().hex
+        self.created_at = datetime.now(timezone.utc)
+        self.method = method
+        self.path = path
+        self.query = query
+        self.trigger = trigger
+        self.username = username
+        self.status = None
+        self.duration = None
+        self.session = None
+        self.calls = []
+        self._start = time.perf_counter()
+
+    def record(self, dependency: str, operation: str, duration: float, ok: bool):
+        # Called from worker threads too (motor, to_thread); list.append is atomic.
+        offset = time.perf_counter() - self._start - duration
+        self.calls.append((dependency, operation, offset, duration, ok))
+
+    def finish(self, status: int, session):
+        self.status = status
+        self.duration = time.perf_counter() - self._start
+        self.session = session
+
+    def call_totals(self) -> dict:
+        totals = {}
+        for dependency, _, _, duration, _ in self.calls:
+            entry = totals.setdefault(dependency, {"count": 0, "total_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] += duration * 1000
+        for entry in totals.values():
+            entry["total_ms"] = round(entry["total_ms"], 3)
+        return totals
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "created_at": self.created_at,
+            "method": self.method,
+            "path": self.path,
+            "query": self.query,
+            "trigger": self.trigger,
+            "username": self.username,
+            "status": self.status,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "has_stack_samples": self.session is not None,
+            "dependencies": self.call_totals()
+        }
+
+    def call_timeline(self) -> List[dict]:
+        return [
+            {
+                "dependency": dependency,
+                "operation": operation,
+                "start_ms": round(offset * 1000, 3),
+                "duration_ms": round(duration * 1000, 3),
+                "ok": ok
+            }
+            for dependency, operation, offset, duration, ok in sorted(self.calls, key=lambda c: c[2])
+        ]
+
+
+def record_call(dependency: str, operation: str, duration: float, ok: bool):
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.record(dependency, operation, duration, ok)
+
+
+class ProfileStore:
+    def __init__(self):
+        self._profiles = deque(maxlen=get_settings().profiling_buffer_size)
+        self._lock = threading.Lock()
+
+    def add(self, profile: RequestProfile):
+        with self._lock:
+            self._profiles.append(profile)
+
+    def list(self) -> List[RequestProfile]:
+        with self._lock:
+            return list(reversed(self._profiles))
+
+    def get(self, profile_id: str) -> Optional[RequestProfile]:
+        with self._lock:
+            for profile in self._profiles:
+                if profile.id == profile_id:
+                    return profile
+        return None
+
+
+profile_store = ProfileStore()
+
+
+def _redact_query(query_string: bytes) -> str:
+    params = parse_qsl(query_string.decode("latin-1"), keep_blank_values=True)
+    return urlencode([(k, "***" if k == "token" else v) for k, v in params])
+
+
+class ProfilingMiddleware:
+    """Profiles requests sent by admins with the profiling header, plus a
+    random sample of all requests when a sample rate is configured.
+
+    Unselected requests only pay for a header lookup and, with sampling on,
+    one random draw.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.settings = get_settings()
+        self.header = self.settings.profiling_header.lower().encode("latin-1")
+        self._slots = threading.BoundedSemaphore(self.settings.profiling_max_concurrent)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trigger = None
+        username = None
+        if any(name == self.header for name, _ in scope["headers"]):
+            username = await self._admin_username(scope)
+            if username:
+                trigger = "header"
+        elif self.settings.profiling_sample_rate > 0 and random.random() < self.settings.profiling_sample_rate:
+            trigger = "sample"
+
+        if trigger is None or not self._slots.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self._profile(scope, receive, send, trigger, username)
+        finally:
+            self._slots.release()
+
+    async def _profile(self, scope: Scope, receive: Receive, send: Send, trigger: str, username: Optional[str]):
+        profile = RequestProfile(scope["method"], scope["path"], _redact_query(scope.get("query_string", b"")), trigger, username)
+        status = {"code": 500}
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        profiler = self._start_sampler()
+        token = _current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_profile.reset(token)
+            session = None
+            if profiler is not None:
+                try:
+                    session = profiler.stop()
+                except Exception as e:
+                    logger.warning(f"Profiler stop failed: {e}")
+            profile.finish(status["code"], session)
+            profile_store.add(profile)
+
+    def _start_sampler(self):
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            return None
+        try:
+            profiler = Profiler(interval=self.settings.profiling_interval_seconds, async_mode="enabled")
+            profiler.start()
+            return profiler
+        except RuntimeError as e:
+            logger.warning(f"Profiler start failed: {e}")
+            return None
+
+    async def _admin_username(self, scope: Scope) -> Optional[str]:
+        token = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                value = value.decode("latin-1")
+                if value.startswith("Bearer "):
+                    token = value[7:]
+                break
+        if token is None:
+            # ZIP downloads carry the token in the query string.
+            token = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1"))).get("token")
+        if not token:
+            return None
+
+        try:
+            payload = jwt.decode(token, self.settings.secret_key, algorithms=[self.settings.algorithm])
+        except JWTError:
+            return None
+        username = payload.get("sub")
+        if not username:
+            return None
+
+        from app.models.user import User
+        user = await User.find_one(User.username == username)
+        if not user or not user.is_admin:
+            return None
+        return username
@@ -0,0 +1,27 @@
+import redis.asyncio as redis
+from functools import lru_cache
+from app.core.config import get_settings
+from app.core.metrics import InstrumentedRedis
+
+@lru_cache
+def get_redis() -> redis.Redis:
+    settings = get_settings()
+    return InstrumentedRedis(
+        host=settings.redis_host,
+        port=settings.redis_port,
+        password=settings.redis_password,
+        decode_responses=True,
+        ssl=settings.redis_ssl
+    )
+
+@lru_cache
+def get_binary_redis() -> redis.Redis:
+    """Client for values stored as raw bytes, such as cached file content."""
+    settings = get_settings()
+    return InstrumentedRedis(
+        host=settings.redis_host,
+        port=settings.redis_port,
+        password=settings.redis_password,
+        decode_responses=False,
+        ssl=settings.redis_ssl
+    )
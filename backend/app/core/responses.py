@@ -0,0 +1,42 @@
+from typing import Any, Optional
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+import orjson
+import time
+
+# Listings embed presigned preview URLs that expire after an hour, so ETags
+# also roll over every half hour and clients refetch before URLs go stale.
+ETAG_WINDOW_SECONDS = 1800
+
+def _default(value: Any):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+class FastJSONResponse(JSONResponse):
+    """orjson-encoded response for payloads already in response shape.
+
+    Returning it from a route skips response_model validation, so only use
+    it with content built from trusted data (see services/serializers.py).
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+def make_etag(scope: str, version: Optional[int]) -> Optional[str]:
+    if version is None:
+        return None
+    return f'"{scope}-{version}-{int(time.time() // ETAG_WINDOW_SECONDS)}"'
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Weak comparison, as If-None-Match requires (RFC 9110, 13.1.2)."""
+    if not if_none_match or not etag:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
@@ -1,38 +1,40 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 import logging
 from app.core.config import get_settings
 from app.core.database import init_db
+from app.core.metrics import MetricsMiddleware, monitor_event_loop_lag, render_metrics
+from app.core.profiling import ProfilingMiddleware
 from app.api.router import api_router
-from app.services.cleanup_service import cleanup_service
-import asyncio
+from app.core.deps import verify_metrics_reader
+from app.services.preview_service import preview_service
+from app.services.job_service import job_service
+from app.services.job_handlers import register_job_handlers
+from app.services.metadata_service import metadata_service
+from app.services.tree_refresh_service import tree_refresh_service
 
 logging.basicConfig(level=logging.INFO,format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",)
 
 settings = get_settings()
 
-async def run_cleanup_periodically():
-    while True:
-        try:
-            await asyncio.sleep(3600)
-            await cleanup_service.cleanup_deleted_resources()
-        except asyncio.CancelledError:
-            break
-        except Exception as e:
-            print(f"Error in cleanup task: {e}")
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_db()
-    
-    cleanup_task = asyncio.create_task(run_cleanup_periodically())
-    yield    
-    cleanup_task.cancel()
-    try:
-        await cleanup_task
-    except asyncio.CancelledError:
-        pass
+    preview_service.start()
+
+    # Periodic cleanup runs through the job queue; only the node holding the
+    # leader lease schedules it, whatever the number of workers.
+    register_job_handlers()
+    job_service.start()
+    tree_refresh_service.start(metadata_service.refresh_tree)
+    lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+    yield
+    lag_monitor.cancel()
+    await tree_refresh_service.stop()
+    await job_service.stop()
+    await preview_service.stop()
 
 app = FastAPI(
     title="Drive Backend",
@@ -47,8 +49,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(api_router, prefix="/api/v1")
 
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(verify_metrics_reader)])
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Enterprise Drive API"}
@@ -1,8 +1,33 @@
 from typing import Optional, List
-from pydantic import BaseModel
-from beanie import Document, PydanticObjectId
+from pydantic import BaseModel, model_validator
+from beanie import Document, PydanticObjectId, before_event, Insert, Replace, Save, SaveChanges
 from enum import Enum
 from datetime import datetime
+import unicodedata
+
+NGRAM_SIZE = 3
+
+def normalize_name(name: str) -> str:
+    return unicodedata.normalize("NFKC", name).casefold()
+
+def name_ngrams(name: str) -> List[str]:
+    """Every substring of up to NGRAM_SIZE characters of the normalized name.
+
+    A query of up to NGRAM_SIZE characters is looked up directly; longer
+    queries must contain all of their NGRAM_SIZE-grams.
+    """
+    text = normalize_name(name)
+    grams = set()
+    for n in range(1, NGRAM_SIZE + 1):
+        for i in range(len(text) - n + 1):
+            grams.add(text[i:i + n])
+    return sorted(grams)
+
+def query_ngrams(query: str) -> List[str]:
+    text = normalize_name(query)
+    if len(text) <= NGRAM_SIZE:
+        return [text]
+    return sorted({text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)})
 
 class ResourceType(str, Enum):
     FILE = "file"
@@ -25,6 +50,25 @@ class Resource(Document):
     shared_with: List[Permission] = []
     is_deleted: bool = False
     deleted_at: Optional[datetime] = None
+    content_version: int = 0
+    # Held by a content save (or key migration) from before it writes the
+    # object until the version is bumped; see MetadataService._claim_content.
+    content_lock: Optional[str] = None
+    content_lock_expires_at: Optional[datetime] = None
+    preview_s3_key: Optional[str] = None
+    preview_type: Optional[str] = None
+    # Search index over `name`, kept in sync on construction and on save.
+    name_ngrams: List[str] = []
+
+    @model_validator(mode="after")
+    def _fill_name_ngrams(self):
+        if not self.name_ngrams:
+            self.name_ngrams = name_ngrams(self.name)
+        return self
+
+    @before_event(Insert, Replace, Save, SaveChanges)
+    def _refresh_name_ngrams(self):
+        self.name_ngrams = name_ngrams(self.name)
     
     class Settings:
         name = "resources"
@@ -38,5 +82,10 @@ class Resource(Document):
                 ("type", 1),
                 ("is_deleted", 1)
             ],
-            "shared_with.user_id"
+            "shared_with.user_id",
+            "s3_key",
+            [
+                ("owner_id", 1),
+                ("name_ngrams", 1)
+            ]
         ]
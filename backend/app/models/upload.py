@@ -0,0 +1,23 @@
+from typing import Optional
+from beanie import Document, Indexed, PydanticObjectId
+from datetime import datetime
+
+class UploadReservation(Document):
+    user_id: PydanticObjectId
+    resource_id: Indexed(PydanticObjectId, unique=True)
+    parent_id: Optional[PydanticObjectId] = None
+    name: str
+    s3_key: str
+    size: int = 0
+    expires_at: datetime
+    claim_token: Optional[str] = None
+    claimed_at: Optional[datetime] = None
+
+    class Settings:
+        name = "upload_reservations"
+        indexes = [
+            "user_id",
+            "expires_at",
+            "claim_token",
+            "s3_key"
+        ]
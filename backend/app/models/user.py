@@ -14,7 +14,9 @@ class User(Document):
     
     plan: UserPlan = UserPlan.NORMAL
     storage_used: int = 0
-    
+    storage_reserved: int = 0
+    is_admin: bool = False
+
     @property
     def storage_limit(self) -> int:
         if self.plan == UserPlan.PRO:
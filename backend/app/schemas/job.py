@@ -0,0 +1,21 @@
+from pydantic import BaseModel
+from typing import Any, Optional
+
+class JobProgress(BaseModel):
+    done: int
+    total: Optional[int] = None
+
+class JobResponse(BaseModel):
+    id: str
+    name: str
+    status: str
+    attempts: int = 0
+    progress: Optional[JobProgress] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+
+class JobAccepted(BaseModel):
+    job_id: str
+    status: str
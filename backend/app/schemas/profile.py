@@ -0,0 +1,30 @@
+from pydantic import BaseModel
+from typing import Dict, List, Optional
+from datetime import datetime
+
+class DependencyTotals(BaseModel):
+    count: int
+    total_ms: float
+
+class DependencyCall(BaseModel):
+    dependency: str
+    operation: str
+    start_ms: float
+    duration_ms: float
+    ok: bool
+
+class ProfileSummary(BaseModel):
+    id: str
+    created_at: datetime
+    method: str
+    path: str
+    query: str
+    trigger: str
+    username: Optional[str] = None
+    status: Optional[int] = None
+    duration_ms: Optional[float] = None
+    has_stack_samples: bool
+    dependencies: Dict[str, DependencyTotals]
+
+class ProfileDetail(ProfileSummary):
+    calls: List[DependencyCall]
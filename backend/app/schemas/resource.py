@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from beanie import PydanticObjectId
 from datetime import datetime
@@ -25,6 +25,9 @@ class ResourceResponse(ResourceBase):
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
     shared_with: List[PermissionSchema] = []
+    content_version: int = 0
+    preview_type: Optional[str] = None
+    preview_url: Optional[str] = None
 
     class Config:
         arbitrary_types_allowed = True
@@ -65,9 +68,42 @@ class FileUploadConfirm(BaseModel):
     size: int
     s3_key: str
 
+class BulkFileUploadConfirm(BaseModel):
+    files: List[FileUploadConfirm]
+
+class BulkConfirmItem(BaseModel):
+    resource_id: PydanticObjectId
+    success: bool
+    error: Optional[str] = None
+    resource: Optional[ResourceResponse] = None
+
+class BulkConfirmResponse(BaseModel):
+    results: List[BulkConfirmItem]
+
+class ContentEdit(BaseModel):
+    start: int
+    end: int
+    text: str = ""
+
+class ContentPatch(BaseModel):
+    base_version: Optional[int] = None
+    edits: List[ContentEdit]
+
 class BulkDeleteRequest(BaseModel):
     resource_ids: List[PydanticObjectId]
 
+class BulkDownloadRequest(BaseModel):
+    resource_ids: List[PydanticObjectId]
+    disposition: str = Field("attachment", pattern="^(attachment|inline)$")
+
+class DownloadLink(BaseModel):
+    resource_id: PydanticObjectId
+    url: Optional[str] = None
+    error: Optional[str] = None
+
+class BulkDownloadLinks(BaseModel):
+    links: List[DownloadLink]
+
 class TreeDelta(BaseModel):
     added: List[ResourceResponse] = []
     updated: List[ResourceResponse] = []
@@ -80,3 +116,14 @@ class BulkInitResponse(BaseModel):
 class ResourceMoveRequest(BaseModel):
     resource_ids: List[PydanticObjectId]
     target_parent_id: PydanticObjectId
+
+class Breadcrumb(BaseModel):
+    id: PydanticObjectId
+    name: str
+
+class SearchResult(ResourceResponse):
+    path: List[Breadcrumb] = []
+
+class SearchResults(BaseModel):
+    results: List[SearchResult]
+    next_cursor: Optional[str] = None
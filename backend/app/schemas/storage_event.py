@@ -0,0 +1,28 @@
+from pydantic import BaseModel, Field
+from typing import List
+
+# The subset of the S3 event notification format
+# (https://docs.aws.amazon.com/AmazonS3/latest/userguide/notification-content-structure.html)
+# needed to confirm uploads.
+
+class S3Bucket(BaseModel):
+    name: str
+
+class S3Object(BaseModel):
+    key: str
+    size: int = 0
+
+class S3Entity(BaseModel):
+    bucket: S3Bucket
+    object: S3Object
+
+class StorageEventRecord(BaseModel):
+    event_name: str = Field(alias="eventName")
+    s3: S3Entity
+
+class StorageEventBatch(BaseModel):
+    records: List[StorageEventRecord] = Field(default=[], alias="Records")
+
+class StorageEventResult(BaseModel):
+    received: int
+    confirmed: int
@@ -0,0 +1,134 @@
+from fastapi import HTTPException
+from typing import Optional
+from contextlib import asynccontextmanager
+from app.core.config import get_settings
+from app.core.redis import get_redis
+from app.core.metrics import ADMISSION_REJECTED, event_loop_lag
+import logging
+import math
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Slots free up as requests finish, which nothing predicts; clients come
+# back after this long.
+BUSY_RETRY_AFTER_SECONDS = 1
+SHED_RETRY_AFTER_SECONDS = 5
+
+# KEYS: token bucket hash, in-flight sorted set (lease token -> expiry).
+# ARGV: now, rate, burst, concurrency, lease expiry, lease token.
+# Returns {1, 0} when admitted, {0, retry after in ms} when rate limited
+# and {0, -1} when at the concurrency cap. A token is only spent when the
+# request is admitted.
+ADMIT = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local concurrency = tonumber(ARGV[4])
+if concurrency > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+    if redis.call('ZCARD', KEYS[2]) >= concurrency then
+        return {0, -1}
+    end
+end
+if rate > 0 then
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    if tokens < 1 then
+        return {0, math.ceil((1 - tokens) / rate * 1000)}
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens - 1, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+end
+if concurrency > 0 then
+    redis.call('ZADD', KEYS[2], ARGV[5], ARGV[6])
+    redis.call('EXPIRE', KEYS[2], math.ceil(ARGV[5] - now) + 1)
+end
+return {1, 0}
+"""
+
+class AdmissionService:
+    """Rate and concurrency limits on expensive endpoints, shared through Redis.
+
+    Each user gets a token bucket and a number of in-flight slots per
+    endpoint class, checked in one script call; over the limit the request
+    fails fast with 429 and Retry-After. While this worker's event loop is
+    lagging, every expensive request is refused with 503 so the cheap ones
+    keep flowing. Without Redis requests are let through.
+    """
+
+    def __init__(self):
+        self.settings = get_settings()
+
+    @property
+    def redis_client(self):
+        return get_redis()
+
+    def _bucket_key(self, endpoint_class: str, user_id) -> str:
+        return f"drive:rate:{endpoint_class}:{user_id}"
+
+    def _inflight_key(self, endpoint_class: str, user_id) -> str:
+        return f"drive:inflight:{endpoint_class}:{user_id}"
+
+    def _reject(self, endpoint_class: str, reason: str, status_code: int, retry_after: int):
+        ADMISSION_REJECTED.labels(endpoint_class, reason).inc()
+        raise HTTPException(
+            status_code=status_code,
+            detail="Server is busy, try again shortly" if reason == "shed" else "Too many requests, try again shortly",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    async def acquire(self, endpoint_class: str, user_id) -> Optional[str]:
+        """Admits a request or raises; returns the lease to hand to `release`."""
+        if not self.settings.admission_enabled:
+            return None
+        shed_lag = self.settings.load_shed_event_loop_lag_seconds
+        if shed_lag and event_loop_lag() > shed_lag:
+            self._reject(endpoint_class, "shed", 503, SHED_RETRY_AFTER_SECONDS)
+
+        rate = getattr(self.settings, f"admission_{endpoint_class}_rate")
+        burst = getattr(self.settings, f"admission_{endpoint_class}_burst")
+        concurrency = getattr(self.settings, f"admission_{endpoint_class}_concurrency")
+        if rate <= 0 and concurrency <= 0:
+            return None
+
+        now = time.time()
+        lease = uuid.uuid4().hex
+        try:
+            admitted, retry_after_ms = await self.redis_client.eval(
+                ADMIT, 2,
+                self._bucket_key(endpoint_class, user_id),
+                self._inflight_key(endpoint_class, user_id),
+                now, rate, max(burst, 1), concurrency,
+                now + self.settings.admission_lease_seconds, lease
+            )
+        except Exception as e:
+            logger.error(f"Redis admission error: {e}")
+            return None
+
+        if admitted:
+            return lease if concurrency > 0 else None
+        if retry_after_ms < 0:
+            self._reject(endpoint_class, "concurrency", 429, BUSY_RETRY_AFTER_SECONDS)
+        self._reject(endpoint_class, "rate", 429, max(1, math.ceil(retry_after_ms / 1000)))
+
+    async def release(self, endpoint_class: str, user_id, lease: Optional[str]):
+        if lease is None:
+            return
+        try:
+            await self.redis_client.zrem(self._inflight_key(endpoint_class, user_id), lease)
+        except Exception as e:
+            logger.error(f"Redis admission error: {e}")
+
+    @asynccontextmanager
+    async def admit(self, endpoint_class: str, user_id):
+        lease = await self.acquire(endpoint_class, user_id)
+        try:
+            yield
+        finally:
+            await self.release(endpoint_class, user_id, lease)
+
+admission_service = AdmissionService()
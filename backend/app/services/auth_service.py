@@ -3,6 +3,8 @@ from app.schemas.user import UserCreate
 from app.models.user import User
 from app.models.resource import Resource, ResourceType
 from app.core.security import get_password_hash, verify_password, create_access_token
+from app.core.config import get_settings
+from app.services.tree_refresh_service import tree_refresh_service
 from beanie import PydanticObjectId
 
 class AuthService:
@@ -37,6 +39,9 @@ class AuthService:
             raise HTTPException(status_code=401, detail="Invalid credentials")
         
         token = create_access_token(subject=user.username)
+        if get_settings().tree_prewarm_on_login:
+            # The first thing a client loads after login is the tree.
+            tree_refresh_service.schedule(user.id, delay=0)
         return {"access_token": token, "token_type": "bearer"}
 
 auth_service = AuthService()
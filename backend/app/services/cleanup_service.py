@@ -1,6 +1,11 @@
 from app.models.resource import Resource, ResourceType
-from app.models.user import User
-from app.services.s3_service import s3_service
+from app.models.upload import UploadReservation
+from app.services.storage_service import storage_service
+from app.services.quota_service import quota_service
+from app.services.storage_backend import current_s3_key
+from app.services.preview_service import PREVIEW_PREFIX, preview_key
+from app.services.job_service import job_service
+from app.services.key_migration_service import REWRITE_MARKER, RETIRED_KEY_GRACE_SECONDS
 import asyncio
 import datetime
 from datetime import timezone
@@ -10,30 +15,61 @@ import time
 
 logger = logging.getLogger(__name__)
 
+# Keys are read through a cursor rather than distinct(), whose single reply
+# is capped at 16 MB.
+KEY_SCAN_BATCH_SIZE = 10000
+
 class CleanupService:
+    async def _unreferenced(self, keys: list, deleted_ids: list) -> list:
+        if not keys:
+            return keys
+        referenced = set()
+        cursor = Resource.get_pymongo_collection().find(
+            {
+                "_id": {"$nin": deleted_ids},
+                "$or": [{"s3_key": {"$in": keys}}, {"preview_s3_key": {"$in": keys}}]
+            },
+            {"s3_key": 1, "preview_s3_key": 1, "_id": 0}
+        )
+        async for doc in cursor:
+            referenced.update(key for key in (doc.get("s3_key"), doc.get("preview_s3_key")) if key)
+        return [key for key in keys if key not in referenced]
+
+    async def _collect_keys(self, keys: set, collection, field: str, query: dict):
+        cursor = collection.find(query, {field: 1, "_id": 0}).batch_size(KEY_SCAN_BATCH_SIZE)
+        async for doc in cursor:
+            if doc.get(field):
+                keys.add(doc[field])
+
     async def cleanup_orphan_s3_files(self) -> dict:
         logger.info("Starting orphan file cleanup...")
         
-        s3_objects = s3_service.list_objects()
+        s3_objects = storage_service.list_objects()
         if not s3_objects:
             return {"message": "No S3 objects found"}
             
         logger.info(f"Found {len(s3_objects)} S3 objects. Checking for orphans...")
         
-        all_resources = await Resource.find(
-            Resource.type == ResourceType.FILE,
-            Resource.s3_key != None
-        ).project(Resource.s3_key).to_list()
-        
-        known_keys = set(r.s3_key for r in all_resources if r.s3_key)
+        known_keys = set()
+        resources = Resource.get_pymongo_collection()
+        await self._collect_keys(known_keys, resources, "s3_key", {"type": ResourceType.FILE.value, "s3_key": {"$ne": None}})
+        # Uploads that are still pending confirmation are not orphans yet.
+        await self._collect_keys(known_keys, UploadReservation.get_pymongo_collection(), "s3_key", {})
+        await self._collect_keys(known_keys, resources, "preview_s3_key", {"preview_s3_key": {"$ne": None}})
         
         orphans = []
         
         cutoff = datetime.datetime.now(timezone.utc) - datetime.timedelta(hours=1)
+        # Objects a key migration has just moved away from may still be read
+        # through presigned URLs handed out before the move.
+        last_rewrite = await job_service.backend.get_marker(REWRITE_MARKER)
+        keep_retired = last_rewrite is not None and time.time() - last_rewrite < RETIRED_KEY_GRACE_SECONDS
         
         for obj in s3_objects:
             if obj['Key'] not in known_keys:
                 if obj['LastModified'] < cutoff:
+                    if keep_retired and self._moved_key(obj['Key']) in known_keys:
+                        continue
                     orphans.append(obj['Key'])
         
         if not orphans:
@@ -42,14 +78,21 @@ class CleanupService:
             
         logger.info(f"Found {len(orphans)} orphan files. Deleting...")
         for key in orphans:
-            s3_service.delete_file(key)
+            storage_service.delete_file(key)
             
         return {"message": f"Deleted {len(orphans)} orphan files", "orphans": orphans}
 
+    def _moved_key(self, key: str) -> str:
+        """Where the key migration puts this object."""
+        if key.startswith(PREVIEW_PREFIX):
+            return preview_key(current_s3_key(key[len(PREVIEW_PREFIX):]))
+        return current_s3_key(key)
+
     async def cleanup_deleted_resources(self) -> dict:
         res = await self._cleanup_db_deleted()
         orphan_res = await self.cleanup_orphan_s3_files()
-        return {**res, "orphan_cleanup": orphan_res}
+        reservation_res = await quota_service.release_expired()
+        return {**res, "orphan_cleanup": orphan_res, "reservation_cleanup": reservation_res}
 
     async def _cleanup_db_deleted(self) -> dict:
         start_time = time.time()
@@ -81,15 +124,20 @@ class CleanupService:
                     ids_to_delete.append(curr_id)
                     if curr.type == ResourceType.FILE and curr.s3_key:
                         keys_to_delete.append(curr.s3_key)
+                    if curr.preview_s3_key:
+                        keys_to_delete.append(curr.preview_s3_key)
                     
                     children = await Resource.find(Resource.parent_id == curr_id).to_list()
                     for child in children:
                         q.append(child.id)
             
+            # Copies share their source's object and preview; those stay
+            # while a surviving resource still points at them.
+            keys_to_delete = await self._unreferenced(keys_to_delete, ids_to_delete)
             if keys_to_delete:
                 logger.info(f"Deleting {len(keys_to_delete)} files from S3 for resource {resource.id}")
                 for key in keys_to_delete:
-                    s3_service.delete_file(key)
+                    storage_service.delete_file(key)
                 total_s3_deleted += len(keys_to_delete)
             
             resources_to_delete = await Resource.find({"_id": {"$in": ids_to_delete}}).to_list()
@@ -101,11 +149,7 @@ class CleanupService:
                     usage_reduction[oid] = usage_reduction.get(oid, 0) + r.size
             
             for oid, size in usage_reduction.items():
-                if size > 0:
-                    user = await User.get(oid)
-                    if user:
-                        user.storage_used = max(0, user.storage_used - size)
-                        await user.save()
+                await quota_service.release_usage(oid, size)
 
             if ids_to_delete:
                 await Resource.find({"_id": {"$in": ids_to_delete}}).delete()
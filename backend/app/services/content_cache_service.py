@@ -0,0 +1,155 @@
+from typing import Optional, Tuple
+from collections import OrderedDict
+from datetime import datetime
+from app.core.config import get_settings
+from app.core.redis import get_binary_redis
+from app.core.metrics import CONTENT_CACHE
+from app.models.resource import Resource
+from app.services.storage_service import storage_service
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Reads that race a save are retried this many times before the content
+# is served uncached.
+READ_ATTEMPTS = 3
+
+class ContentTooLarge(Exception):
+    """The stored object is larger than the content endpoint serves, whatever
+    the resource's recorded size says."""
+
+class ContentCacheService:
+    """Content of small files, cached per resource and content version.
+
+    An entry is only ever filled with the bytes of exactly that version:
+    saves fill it with what they wrote, and reads only fill it when no save
+    held or changed the content while they fetched the object. Saves do
+    not rewrite an object another resource (a copy) shares, and bump the
+    version of a copy made while they wrote (see
+    MetadataService._content_target_key), so a resource's bytes cannot
+    change without its version. Entries therefore never go stale and other
+    workers' LRUs need no invalidation. Each worker keeps the most recently
+    read files in an LRU bounded by CONTENT_CACHE_MEMORY_BYTES; Redis shares
+    them between workers and survives restarts. Without Redis the LRU
+    still works on its own.
+    """
+
+    def __init__(self):
+        self.settings = get_settings()
+        self._entries: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._size = 0
+
+    @property
+    def redis_client(self):
+        return get_binary_redis()
+
+    def _redis_key(self, resource_id, version: int) -> str:
+        return f"drive:content:{resource_id}:{version}"
+
+    def cacheable(self, size: int) -> bool:
+        return size <= self.settings.content_cache_max_file_size
+
+    def _remember(self, entry: tuple, data: bytes):
+        limit = self.settings.content_cache_memory_bytes
+        if len(data) > limit:
+            return
+        previous = self._entries.pop(entry, None)
+        if previous is not None:
+            self._size -= len(previous)
+        self._entries[entry] = data
+        self._size += len(data)
+        while self._size > limit:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    async def get(self, resource_id, version: int) -> Optional[bytes]:
+        entry = (resource_id, version)
+        data = self._entries.get(entry)
+        if data is not None:
+            self._entries.move_to_end(entry)
+            CONTENT_CACHE.labels("memory").inc()
+            return data
+        try:
+            data = await self.redis_client.get(self._redis_key(resource_id, version))
+        except Exception as e:
+            logger.error(f"Redis content cache error: {e}")
+            data = None
+        if data is None:
+            CONTENT_CACHE.labels("miss").inc()
+            return None
+        self._remember(entry, data)
+        CONTENT_CACHE.labels("redis").inc()
+        return data
+
+    async def put(self, resource_id, version: int, data: bytes):
+        if not self.cacheable(len(data)):
+            return
+        self._remember((resource_id, version), data)
+        try:
+            await self.redis_client.set(self._redis_key(resource_id, version), data, ex=self.settings.content_cache_ttl_seconds)
+        except Exception as e:
+            logger.error(f"Redis content cache error: {e}")
+
+    async def discard(self, resource_id, version: int):
+        data = self._entries.pop((resource_id, version), None)
+        if data is not None:
+            self._size -= len(data)
+        try:
+            await self.redis_client.delete(self._redis_key(resource_id, version))
+        except Exception as e:
+            logger.error(f"Redis content cache error: {e}")
+
+    def _unlocked(self, doc: dict) -> bool:
+        expires_at = doc.get("content_lock_expires_at")
+        return doc.get("content_lock") is None or (expires_at is not None and expires_at < datetime.now())
+
+    def _read_capped(self, key: str) -> bytes:
+        """The object's bytes, reading at most one byte past the cacheable
+        size so a file recorded smaller than it is never loads whole."""
+        limit = self.settings.content_cache_max_file_size
+        stream = storage_service.get_object_stream(key)
+        try:
+            data = stream.read(limit + 1)
+        finally:
+            stream.close()
+        if len(data) > limit:
+            raise ContentTooLarge(key)
+        return data
+
+    async def read(self, resource: Resource) -> Tuple[bytes, Optional[int]]:
+        """Content of a file and the version it is, from storage on a miss.
+
+        The version is None if saves kept racing the read; the bytes are
+        then whatever storage returned, and are not cached.
+        """
+        data = await self.get(resource.id, resource.content_version)
+        if data is not None:
+            return data, resource.content_version
+
+        collection = Resource.get_pymongo_collection()
+        projection = {"s3_key": 1, "content_version": 1, "content_lock": 1, "content_lock_expires_at": 1}
+        doc = {
+            "s3_key": resource.s3_key,
+            "content_version": resource.content_version,
+            "content_lock": resource.content_lock,
+            "content_lock_expires_at": resource.content_lock_expires_at
+        }
+        for _ in range(READ_ATTEMPTS):
+            data = await asyncio.to_thread(self._read_capped, doc["s3_key"])
+            current = await collection.find_one({"_id": resource.id}, projection)
+            if current is None:
+                break
+            # Unchanged and unlocked before and after the fetch: no save
+            # wrote the object in between.
+            if (
+                self._unlocked(doc) and self._unlocked(current)
+                and current.get("content_version", 0) == doc["content_version"]
+                and current.get("s3_key") == doc["s3_key"]
+            ):
+                await self.put(resource.id, doc["content_version"], data)
+                return data, doc["content_version"]
+            doc = current
+        return data, None
+
+content_cache_service = ContentCacheService()
@@ -1,15 +1,19 @@
 from fastapi import HTTPException
 from fastapi.responses import StreamingResponse
-from typing import List
+from typing import Iterator, List
 from beanie import PydanticObjectId
 from app.models.user import User
 from app.models.resource import Resource, ResourceType
-from app.services.s3_service import s3_service
+from app.services.storage_service import storage_service
 from app.services.permission_service import permission_service
 from jose import jwt, JWTError
 from app.core.config import get_settings
+from app.core.metrics import ZIP_BYTES
+import asyncio
 import zipstream
 
+ZIP_READ_CHUNK_SIZE = 64 * 1024
+
 class DownloadService:
     def __init__(self):
         self.settings = get_settings()
@@ -39,8 +43,7 @@ class DownloadService:
             if not auth_token:
                  raise HTTPException(status_code=401, detail="Unauthorized")
             
-            download_url = f"{base_url}/api/v1/download/zip/{resource.id}?token={auth_token}"
-            return {"url": download_url}
+            return {"url": self._zip_url(resource.id, auth_token, base_url)}
             
         if resource.type != ResourceType.FILE and resource.type != ResourceType.FOLDER:
             raise HTTPException(status_code=400, detail="Invalid resource type")
@@ -48,9 +51,56 @@ class DownloadService:
         if not resource.s3_key:
             raise HTTPException(status_code=404, detail="File content not found")
     
-        url = s3_service.generate_presigned_download_url(resource.s3_key, disposition)
+        url = storage_service.generate_presigned_download_url(resource.s3_key, disposition)
         return {"url": url}
 
+    def _zip_url(self, resource_id: PydanticObjectId, auth_token: str, base_url: str) -> str:
+        return f"{base_url}/api/v1/download/zip/{resource_id}?token={auth_token}"
+
+    async def get_download_links(self, resource_ids: List[PydanticObjectId], disposition: str, current_user: User, auth_token: str = None, base_url: str = None) -> List[dict]:
+        """Batch variant of get_download_link.
+
+        The resources are loaded with one query and access is decided once
+        per distinct parent. A resource that cannot be downloaded gets an
+        error instead of a URL rather than failing the whole batch.
+        """
+        if len(resource_ids) > self.settings.download_links_max_batch:
+            raise HTTPException(status_code=400, detail=f"At most {self.settings.download_links_max_batch} resources per request")
+
+        resource_ids = list(dict.fromkeys(resource_ids))
+        candidates = await Resource.find(
+            {"_id": {"$in": resource_ids}},
+            Resource.is_deleted != True
+        ).to_list()
+        found_ids = {res.id for res in candidates}
+        accessible = {res.id: res for res in await permission_service.filter_accessible(candidates, current_user)}
+
+        links = []
+        to_sign = []
+        for resource_id in resource_ids:
+            link = {"resource_id": resource_id, "url": None, "error": None}
+            links.append(link)
+            resource = accessible.get(resource_id)
+            if resource is None:
+                link["error"] = "Access denied" if resource_id in found_ids else "File not found"
+            elif resource.type == ResourceType.FOLDER:
+                if auth_token:
+                    link["url"] = self._zip_url(resource.id, auth_token, base_url)
+                else:
+                    link["error"] = "Unauthorized"
+            elif not resource.s3_key:
+                link["error"] = "File content not found"
+            else:
+                to_sign.append((link, resource.s3_key))
+
+        # Signing is CPU work; a few thousand of them stay off the event loop.
+        urls = await asyncio.to_thread(
+            lambda: [storage_service.generate_presigned_download_url(key, disposition) for _, key in to_sign]
+        )
+        for (link, _), url in zip(to_sign, urls):
+            link["url"] = url
+        return links
+
     async def _collect_files_for_zip(self, resource_id: PydanticObjectId) -> List[tuple]:
         files_to_zip = []
         q = [(resource_id, "")]
@@ -68,8 +118,20 @@ class DownloadService:
                     q.append((child.id, child_rel_path))
         return files_to_zip
 
-    async def stream_folder_zip(self, resource_id: PydanticObjectId, token: str) -> StreamingResponse:
-        current_user = await self.get_user_from_token(token)
+    def _member_chunks(self, s3_key: str) -> Iterator[bytes]:
+        """A ZIP member's bytes. The object is only opened once the ZIP gets
+        to it and closed right after, so one stream is open at a time."""
+        stream = storage_service.get_object_stream(s3_key)
+        try:
+            while True:
+                chunk = stream.read(ZIP_READ_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            stream.close()
+
+    async def stream_folder_zip(self, resource_id: PydanticObjectId, current_user: User) -> StreamingResponse:
         resource = await Resource.get(resource_id)
         
         if not resource:
@@ -91,9 +153,10 @@ class DownloadService:
             zs = zipstream.ZipStream(compress_type=zipstream.ZIP_DEFLATED)
             
             for s3_key, rel_path in files_to_zip:
-                file_stream = s3_service.get_object_stream(s3_key)
-                zs.add(file_stream, arcname=rel_path)
-            yield from zs
+                zs.add(self._member_chunks(s3_key), arcname=rel_path)
+            for chunk in zs:
+                ZIP_BYTES.inc(len(chunk))
+                yield chunk
 
         return StreamingResponse(
             iter_zip(), 
@@ -0,0 +1,311 @@
+from typing import AsyncIterator, BinaryIO, List, Optional
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+from urllib.parse import quote, unquote, urlencode
+from app.core.config import get_settings
+from app.core.metrics import timed_dependency
+from app.services.storage_backend import StorageBackend, ObjectNotFound, PreconditionFailed
+import asyncio
+import fcntl
+import hashlib
+import hmac
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+settings = get_settings()
+
+# Working directories under the root, on the same filesystem as the objects
+# so finished files are moved into place with a rename. Listings skip them.
+TMP_DIR = ".tmp"
+UPLOADS_DIR = ".uploads"
+LOCKS_DIR = ".locks"
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+def _etag(st: os.stat_result) -> str:
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def _not_found_errors(func):
+    @wraps(func)
+    def wrapper(self, key, *args, **kwargs):
+        try:
+            return func(self, key, *args, **kwargs)
+        except FileNotFoundError as e:
+            raise ObjectNotFound(key) from e
+    return wrapper
+
+
+def _copy_fd(source_fd: int, target_fd: int, size: int):
+    # sendfile copies between files inside the kernel.
+    offset = 0
+    try:
+        while offset < size:
+            sent = os.sendfile(target_fd, source_fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    except (AttributeError, OSError):
+        os.lseek(source_fd, offset, os.SEEK_SET)
+        with os.fdopen(os.dup(source_fd), "rb") as source, os.fdopen(os.dup(target_fd), "ab") as target:
+            shutil.copyfileobj(source, target)
+
+
+class FilesystemStorage(StorageBackend):
+    """Objects stored as files under STORAGE_ROOT.
+
+    Browsers upload and download through URLs signed with an HMAC and
+    served by the app (app/api/storage.py), the same way they would use
+    presigned S3 URLs. Every write lands in a temporary file first and is
+    renamed into place, so readers never see a partial object. Key
+    segments are percent-encoded, so no key can point outside the root.
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = os.path.abspath(root or settings.storage_root)
+        self.signing_key = (settings.storage_signing_key or settings.secret_key).encode()
+
+    def _workdir(self, name: str) -> str:
+        path = os.path.join(self.root, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def path(self, key: str) -> str:
+        segments = key.split("/")
+        if any(not segment for segment in segments):
+            raise ValueError(f"Invalid storage key: {key!r}")
+        encoded = []
+        for segment in segments:
+            segment = quote(segment, safe="")
+            if segment.strip(".") == "":
+                segment = segment.replace(".", "%2E")
+            encoded.append(segment)
+        return os.path.join(self.root, *encoded)
+
+    def _key(self, path: str) -> str:
+        return "/".join(unquote(segment) for segment in os.path.relpath(path, self.root).split(os.sep))
+
+    @contextmanager
+    def _lock(self, key: str):
+        """Serializes conditional writes to a key across processes."""
+        name = hashlib.md5(key.encode()).hexdigest()
+        with open(os.path.join(self._workdir(LOCKS_DIR), name), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _open_tmp(self) -> BinaryIO:
+        return tempfile.NamedTemporaryFile(dir=self._workdir(TMP_DIR), delete=False)
+
+    def _commit(self, tmp: BinaryIO, key: str) -> str:
+        tmp.flush()
+        os.fsync(tmp.fileno())
+        tmp.close()
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp.name, path)
+        except FileNotFoundError:
+            # A delete pruned the directory in between.
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp.name, path)
+        return _etag(os.stat(path))
+
+    def _discard(self, tmp: BinaryIO):
+        tmp.close()
+        try:
+            os.remove(tmp.name)
+        except FileNotFoundError:
+            pass
+
+    def _current_etag(self, key: str) -> Optional[str]:
+        try:
+            return _etag(os.stat(self.path(key)))
+        except FileNotFoundError:
+            return None
+
+    # Signed URLs
+
+    def _signature(self, method: str, key: str, expires: int, disposition: str = "") -> str:
+        message = f"{method}\n{key}\n{expires}\n{disposition}".encode()
+        return hmac.new(self.signing_key, message, hashlib.sha256).hexdigest()
+
+    def _signed_url(self, method: str, key: str, expiration: int, disposition: str = "") -> str:
+        expires = int(time.time()) + expiration
+        query = {"expires": expires}
+        if disposition:
+            query["disposition"] = disposition
+        query["signature"] = self._signature(method, key, expires, disposition)
+        return f"{settings.storage_public_url}/{quote(key)}?{urlencode(query)}"
+
+    def verify_signature(self, method: str, key: str, expires: int, signature: str, disposition: str = "") -> bool:
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self._signature(method, key, expires, disposition), signature)
+
+    def generate_presigned_url(self, key: str, file_type: str, expiration=3600) -> str:
+        self.path(key)
+        return self._signed_url("PUT", key, expiration)
+
+    def generate_presigned_download_url(self, key: str, disposition: str = "attachment", expiration=3600) -> str:
+        return self._signed_url("GET", key, expiration, disposition)
+
+    async def write_stream(self, key: str, chunks: AsyncIterator[bytes]) -> str:
+        """Writes an upload body into place once it has been fully received."""
+        self.path(key)
+        tmp = await asyncio.to_thread(self._open_tmp)
+        try:
+            buffer = bytearray()
+            async for chunk in chunks:
+                buffer.extend(chunk)
+                if len(buffer) >= WRITE_BUFFER_SIZE:
+                    await asyncio.to_thread(tmp.write, bytes(buffer))
+                    buffer.clear()
+            if buffer:
+                await asyncio.to_thread(tmp.write, bytes(buffer))
+            return await asyncio.to_thread(self._commit, tmp, key)
+        except BaseException:
+            await asyncio.to_thread(self._discard, tmp)
+            raise
+
+    # StorageBackend
+
+    @timed_dependency("filesystem")
+    def delete_file(self, key: str):
+        if not key:
+            return
+        path = self.path(key)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        # Drop the directories the key left empty.
+        directory = os.path.dirname(path)
+        while directory != self.root:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+    @timed_dependency("filesystem")
+    def upload_bytes(self, key: str, data: bytes, if_match: str = None, content_type: str = None):
+        tmp = self._open_tmp()
+        try:
+            tmp.write(data)
+            if if_match is None:
+                self._commit(tmp, key)
+                return
+            with self._lock(key):
+                if self._current_etag(key) != if_match:
+                    raise PreconditionFailed(key)
+                self._commit(tmp, key)
+        except BaseException:
+            self._discard(tmp)
+            raise
+
+    @timed_dependency("filesystem")
+    @_not_found_errors
+    def get_object_bytes(self, key: str) -> tuple:
+        with open(self.path(key), "rb") as f:
+            return f.read(), _etag(os.fstat(f.fileno()))
+
+    @timed_dependency("filesystem")
+    def copy_object(self, source_key: str, key: str, if_match: str = None) -> str:
+        try:
+            source = open(self.path(source_key), "rb")
+        except FileNotFoundError as e:
+            raise ObjectNotFound(source_key) from e
+        with source:
+            # Objects are only ever replaced by rename, so the open file
+            # stays the version checked here.
+            st = os.fstat(source.fileno())
+            if if_match is not None and _etag(st) != if_match:
+                raise PreconditionFailed(source_key)
+            tmp = self._open_tmp()
+            try:
+                _copy_fd(source.fileno(), tmp.fileno(), st.st_size)
+                return self._commit(tmp, key)
+            except BaseException:
+                self._discard(tmp)
+                raise
+
+    @timed_dependency("filesystem")
+    def create_multipart_upload(self, key: str) -> str:
+        self.path(key)
+        upload_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self._workdir(UPLOADS_DIR), upload_id))
+        return upload_id
+
+    @timed_dependency("filesystem")
+    def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> dict:
+        part_path = os.path.join(self.root, UPLOADS_DIR, upload_id, f"{part_number:05d}")
+        with open(part_path, "wb") as f:
+            f.write(data)
+        return {"ETag": _etag(os.stat(part_path)), "PartNumber": part_number}
+
+    @timed_dependency("filesystem")
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: list):
+        upload_dir = os.path.join(self.root, UPLOADS_DIR, upload_id)
+        tmp = self._open_tmp()
+        try:
+            for part in sorted(parts, key=lambda p: p["PartNumber"]):
+                with open(os.path.join(upload_dir, f"{part['PartNumber']:05d}"), "rb") as f:
+                    _copy_fd(f.fileno(), tmp.fileno(), os.fstat(f.fileno()).st_size)
+            self._commit(tmp, key)
+        except BaseException:
+            self._discard(tmp)
+            raise
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+    @timed_dependency("filesystem")
+    def abort_multipart_upload(self, key: str, upload_id: str):
+        shutil.rmtree(os.path.join(self.root, UPLOADS_DIR, upload_id), ignore_errors=True)
+
+    @timed_dependency("filesystem")
+    @_not_found_errors
+    def download_file(self, key: str, destination_path: str):
+        shutil.copyfile(self.path(key), destination_path)
+
+    @timed_dependency("filesystem")
+    @_not_found_errors
+    def get_object_stream(self, key: str) -> BinaryIO:
+        return open(self.path(key), "rb")
+
+    @timed_dependency("filesystem")
+    @_not_found_errors
+    def head_object(self, key: str) -> dict:
+        st = os.stat(self.path(key))
+        return {
+            "ContentLength": st.st_size,
+            "ETag": _etag(st),
+            "LastModified": datetime.fromtimestamp(st.st_mtime, timezone.utc)
+        }
+
+    @timed_dependency("filesystem")
+    def list_objects(self, prefix: str = "") -> List[dict]:
+        objects = []
+        for directory, subdirs, files in os.walk(self.root):
+            if directory == self.root:
+                subdirs[:] = [d for d in subdirs if not d.startswith(".")]
+            for name in files:
+                path = os.path.join(directory, name)
+                key = self._key(path)
+                if not key.startswith(prefix):
+                    continue
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                objects.append({
+                    "Key": key,
+                    "LastModified": datetime.fromtimestamp(st.st_mtime, timezone.utc),
+                    "Size": st.st_size
+                })
+        return objects
@@ -0,0 +1,53 @@
+from beanie import PydanticObjectId
+from fastapi import HTTPException
+from app.models.user import User
+from app.core.config import get_settings
+from app.services.job_service import job_service, JobContext
+from app.services.admission_service import admission_service
+from app.services.metadata_service import metadata_service
+from app.services.cleanup_service import cleanup_service
+from app.services.key_migration_service import key_migration_service
+
+
+async def _load_user(ctx: JobContext) -> User:
+    user = await User.get(PydanticObjectId(ctx.user_id))
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+
+async def run_copy(ctx: JobContext) -> dict:
+    try:
+        user = await _load_user(ctx)
+        delta = await metadata_service.copy_resources(
+            [PydanticObjectId(rid) for rid in ctx.payload["resource_ids"]],
+            PydanticObjectId(ctx.payload["target_parent_id"]),
+            user,
+            on_progress=ctx.set_progress
+        )
+    finally:
+        # Admitted at enqueue time; a job that never runs gives the slot
+        # back when the lease expires.
+        await admission_service.release("copy", ctx.user_id, ctx.payload.get("admission_lease"))
+    added = delta["added"]
+    return {
+        "added_count": len(added),
+        "root_ids": [str(r.id) for r in added if str(r.parent_id) == ctx.payload["target_parent_id"]]
+    }
+
+
+async def run_cleanup(ctx: JobContext) -> dict:
+    return await cleanup_service.cleanup_deleted_resources()
+
+
+async def run_key_migration(ctx: JobContext) -> dict:
+    return await key_migration_service.migrate_keys(on_progress=ctx.set_progress)
+
+
+def register_job_handlers():
+    settings = get_settings()
+    # Copies are not idempotent, a failed attempt must not run again.
+    job_service.register("copy", run_copy, max_attempts=1)
+    # Safe to retry: it resumes with whatever keys are still in the old layout.
+    job_service.register("s3_key_migration", run_key_migration)
+    job_service.register_periodic("cleanup", settings.cleanup_interval_seconds, run_cleanup)
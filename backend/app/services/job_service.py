@@ -0,0 +1,447 @@
+from typing import Awaitable, Callable, Dict, List, Optional
+from abc import ABC, abstractmethod
+from fastapi import HTTPException
+from app.core.config import get_settings
+from app.core.redis import get_redis
+from datetime import datetime
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+JOB_TTL_SECONDS = 7 * 24 * 3600
+SCHEDULER_TICK_SECONDS = 1.0
+
+
+class JobBackend(ABC):
+    """Storage and coordination primitives used by JobService.
+
+    A popped job stays assigned to the node that popped it until `ack`.
+    Jobs assigned to a node whose lease (`heartbeat`) has lapsed are put
+    back on the queue by `requeue_abandoned`.
+    """
+
+    @abstractmethod
+    async def save(self, job: dict):
+        ...
+
+    @abstractmethod
+    async def load(self, job_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def push(self, job_id: str):
+        ...
+
+    @abstractmethod
+    async def pop(self, node_id: str, timeout: float) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def ack(self, node_id: str, job_id: str):
+        """The node is done with the job, whatever the outcome."""
+
+    @abstractmethod
+    async def heartbeat(self, node_id: str, ttl: int):
+        ...
+
+    @abstractmethod
+    async def requeue_abandoned(self) -> List[str]:
+        ...
+
+    @abstractmethod
+    async def schedule(self, job_id: str, run_at: float):
+        ...
+
+    @abstractmethod
+    async def pop_due(self, now: float) -> List[str]:
+        """Moves jobs due by `now` onto the queue and returns them."""
+
+    @abstractmethod
+    async def acquire_lease(self, name: str, owner: str, ttl: int) -> bool:
+        """Takes the lease, or extends it when `owner` already holds it."""
+
+    @abstractmethod
+    async def release_lease(self, name: str, owner: str):
+        ...
+
+    @abstractmethod
+    async def get_marker(self, name: str) -> Optional[float]:
+        ...
+
+    @abstractmethod
+    async def set_marker(self, name: str, value: float):
+        ...
+
+
+class RedisJobBackend(JobBackend):
+    prefix = "drive:jobs"
+
+    ACQUIRE_LEASE = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    end
+    if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+        return 1
+    end
+    return 0
+    """
+
+    RELEASE_LEASE = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    # KEYS: delayed set, queue. ARGV: now.
+    MOVE_DUE = """
+    local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+    for _, job_id in ipairs(due) do
+        redis.call('ZREM', KEYS[1], job_id)
+        redis.call('LPUSH', KEYS[2], job_id)
+    end
+    return due
+    """
+
+    @property
+    def client(self):
+        return get_redis()
+
+    async def save(self, job: dict):
+        await self.client.set(f"{self.prefix}:job:{job['id']}", json.dumps(job), ex=JOB_TTL_SECONDS)
+
+    async def load(self, job_id: str) -> Optional[dict]:
+        raw = await self.client.get(f"{self.prefix}:job:{job_id}")
+        return json.loads(raw) if raw else None
+
+    def _processing_key(self, node_id: str) -> str:
+        return f"{self.prefix}:processing:{node_id}"
+
+    def _node_key(self, node_id: str) -> str:
+        return f"{self.prefix}:node:{node_id}"
+
+    async def push(self, job_id: str):
+        await self.client.lpush(f"{self.prefix}:queue", job_id)
+
+    async def pop(self, node_id: str, timeout: float) -> Optional[str]:
+        # Moved atomically onto the node's processing list, so a job is
+        # never only in this process's memory.
+        return await self.client.blmove(f"{self.prefix}:queue", self._processing_key(node_id), timeout, "RIGHT", "LEFT")
+
+    async def ack(self, node_id: str, job_id: str):
+        await self.client.lrem(self._processing_key(node_id), 0, job_id)
+
+    async def heartbeat(self, node_id: str, ttl: int):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.set(self._node_key(node_id), 1, ex=ttl)
+        pipe.sadd(f"{self.prefix}:nodes", node_id)
+        await pipe.execute()
+
+    async def requeue_abandoned(self) -> List[str]:
+        requeued = []
+        for node_id in await self.client.smembers(f"{self.prefix}:nodes"):
+            if await self.client.exists(self._node_key(node_id)):
+                continue
+            while True:
+                job_id = await self.client.lmove(self._processing_key(node_id), f"{self.prefix}:queue", "RIGHT", "LEFT")
+                if job_id is None:
+                    break
+                requeued.append(job_id)
+            await self.client.srem(f"{self.prefix}:nodes", node_id)
+        return requeued
+
+    async def schedule(self, job_id: str, run_at: float):
+        await self.client.zadd(f"{self.prefix}:delayed", {job_id: run_at})
+
+    async def pop_due(self, now: float) -> List[str]:
+        return await self.client.eval(self.MOVE_DUE, 2, f"{self.prefix}:delayed", f"{self.prefix}:queue", now)
+
+    async def acquire_lease(self, name: str, owner: str, ttl: int) -> bool:
+        result = await self.client.eval(self.ACQUIRE_LEASE, 1, f"{self.prefix}:lease:{name}", owner, ttl * 1000)
+        return bool(result)
+
+    async def release_lease(self, name: str, owner: str):
+        await self.client.eval(self.RELEASE_LEASE, 1, f"{self.prefix}:lease:{name}", owner)
+
+    async def get_marker(self, name: str) -> Optional[float]:
+        raw = await self.client.get(f"{self.prefix}:periodic:{name}")
+        return float(raw) if raw else None
+
+    async def set_marker(self, name: str, value: float):
+        await self.client.set(f"{self.prefix}:periodic:{name}", value)
+
+
+class LocalJobBackend(JobBackend):
+    """In-process backend for tests and single-process deployments."""
+
+    def __init__(self):
+        self.jobs: Dict[str, dict] = {}
+        self.delayed: Dict[str, float] = {}
+        self.leases: Dict[str, tuple] = {}
+        self.markers: Dict[str, float] = {}
+        self._queue: Optional[asyncio.Queue] = None
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    async def save(self, job: dict):
+        self.jobs[job["id"]] = json.loads(json.dumps(job))
+
+    async def load(self, job_id: str) -> Optional[dict]:
+        job = self.jobs.get(job_id)
+        return json.loads(json.dumps(job)) if job else None
+
+    async def push(self, job_id: str):
+        self.queue.put_nowait(job_id)
+
+    async def pop(self, node_id: str, timeout: float) -> Optional[str]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def ack(self, node_id: str, job_id: str):
+        pass
+
+    async def heartbeat(self, node_id: str, ttl: int):
+        pass
+
+    async def requeue_abandoned(self) -> List[str]:
+        # Jobs only live as long as the process running them.
+        return []
+
+    async def schedule(self, job_id: str, run_at: float):
+        self.delayed[job_id] = run_at
+
+    async def pop_due(self, now: float) -> List[str]:
+        due = [job_id for job_id, run_at in self.delayed.items() if run_at <= now]
+        for job_id in due:
+            del self.delayed[job_id]
+            self.queue.put_nowait(job_id)
+        return due
+
+    async def acquire_lease(self, name: str, owner: str, ttl: int) -> bool:
+        holder = self.leases.get(name)
+        now = time.monotonic()
+        if holder and holder[0] != owner and holder[1] > now:
+            return False
+        self.leases[name] = (owner, now + ttl)
+        return True
+
+    async def release_lease(self, name: str, owner: str):
+        holder = self.leases.get(name)
+        if holder and holder[0] == owner:
+            del self.leases[name]
+
+    async def get_marker(self, name: str) -> Optional[float]:
+        return self.markers.get(name)
+
+    async def set_marker(self, name: str, value: float):
+        self.markers[name] = value
+
+
+class JobContext:
+    def __init__(self, service: "JobService", job: dict):
+        self.service = service
+        self.job = job
+
+    @property
+    def payload(self) -> dict:
+        return self.job.get("payload") or {}
+
+    @property
+    def user_id(self) -> Optional[str]:
+        return self.job.get("user_id")
+
+    async def set_progress(self, done: int, total: Optional[int] = None):
+        self.job["progress"] = {"done": done, "total": total}
+        self.job["updated_at"] = datetime.now().isoformat()
+        await self.service.backend.save(self.job)
+
+
+JobHandler = Callable[[JobContext], Awaitable[Optional[dict]]]
+
+
+class JobService:
+    """Runs background jobs on a shared queue.
+
+    Handlers are registered by name. Failed jobs are retried with exponential
+    backoff. Periodic jobs are enqueued only by the node holding the leader
+    lease, so N workers and replicas still run each one once per interval.
+    Jobs of a node that dies mid-run are requeued by the leader once the
+    node's lease lapses, and count as an attempt.
+    """
+
+    def __init__(self):
+        self.settings = get_settings()
+        if self.settings.job_backend == "local":
+            self.backend: JobBackend = LocalJobBackend()
+        else:
+            self.backend = RedisJobBackend()
+        self.handlers: Dict[str, tuple] = {}
+        self.periodic: Dict[str, int] = {}
+        self.node_id = uuid.uuid4().hex
+        self.tasks = []
+
+    def register(self, name: str, handler: JobHandler, max_attempts: Optional[int] = None):
+        self.handlers[name] = (handler, max_attempts or self.settings.job_max_attempts)
+
+    def register_periodic(self, name: str, interval: int, handler: JobHandler, max_attempts: Optional[int] = None):
+        self.register(name, handler, max_attempts)
+        self.periodic[name] = interval
+
+    async def enqueue(self, name: str, payload: Optional[dict] = None, user_id: Optional[str] = None) -> dict:
+        if name not in self.handlers:
+            raise ValueError(f"Unknown job: {name}")
+        now = datetime.now().isoformat()
+        job = {
+            "id": uuid.uuid4().hex,
+            "name": name,
+            "payload": payload or {},
+            "user_id": user_id,
+            "status": "queued",
+            "attempts": 0,
+            "progress": None,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now
+        }
+        await self.backend.save(job)
+        await self.backend.push(job["id"])
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self.backend.load(job_id)
+
+    def start(self):
+        if self.tasks:
+            return
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.settings.job_workers)]
+        self.tasks.append(asyncio.create_task(self._scheduler()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        for task in self.tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.tasks = []
+        try:
+            await self.backend.release_lease("leader", self.node_id)
+        except Exception as e:
+            logger.error(f"Failed to release job leader lease: {e}")
+
+    async def _worker(self):
+        # Register the node before taking jobs, so the leader can find them
+        # even if this node dies before its scheduler first runs.
+        try:
+            await self.backend.heartbeat(self.node_id, self.settings.job_node_lease_seconds)
+        except Exception as e:
+            logger.error(f"Job worker error: {e}")
+        while True:
+            try:
+                job_id = await self.backend.pop(self.node_id, SCHEDULER_TICK_SECONDS)
+                if job_id:
+                    try:
+                        await self._run(job_id)
+                    finally:
+                        await self.backend.ack(self.node_id, job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker error: {e}")
+                await asyncio.sleep(SCHEDULER_TICK_SECONDS)
+
+    async def _run(self, job_id: str):
+        job = await self.backend.load(job_id)
+        if not job or job["status"] in ("succeeded", "failed"):
+            return
+
+        handler, max_attempts = self.handlers.get(job["name"], (None, 0))
+        if handler is None:
+            logger.error(f"No handler registered for job {job['name']}")
+            return
+
+        if job["status"] == "running" and job["attempts"] >= max_attempts:
+            # Requeued from a node that died while running its last attempt.
+            job["status"] = "failed"
+            job["error"] = job.get("error") or "Worker stopped while running the job"
+            job["updated_at"] = datetime.now().isoformat()
+            await self.backend.save(job)
+            logger.error(f"Job {job['name']} ({job_id}) failed after {job['attempts']} attempts: worker stopped")
+            return
+
+        job["status"] = "running"
+        job["attempts"] += 1
+        job["updated_at"] = datetime.now().isoformat()
+        await self.backend.save(job)
+
+        start_time = time.time()
+        try:
+            job["result"] = await handler(JobContext(self, job))
+            job["status"] = "succeeded"
+            job["error"] = None
+        except asyncio.CancelledError:
+            # Shutting down: hand the job back so another worker picks it up.
+            job["status"] = "queued"
+            job["attempts"] -= 1
+            await self.backend.save(job)
+            await self.backend.push(job_id)
+            raise
+        except HTTPException as e:
+            job["status"] = "failed"
+            job["error"] = e.detail
+        except Exception as e:
+            job["error"] = str(e)
+            if job["attempts"] < max_attempts:
+                delay = self.settings.job_retry_base_seconds * (2 ** (job["attempts"] - 1))
+                job["status"] = "retrying"
+                await self.backend.schedule(job_id, time.time() + delay)
+                logger.warning(f"Job {job['name']} ({job_id}) failed, retrying in {delay:.0f}s: {e}")
+            else:
+                job["status"] = "failed"
+                logger.error(f"Job {job['name']} ({job_id}) failed after {job['attempts']} attempts: {e}")
+
+        job["updated_at"] = datetime.now().isoformat()
+        await self.backend.save(job)
+        logger.info(f"Job {job['name']} ({job_id}) {job['status']} in {time.time() - start_time:.2f}s")
+
+    async def _scheduler(self):
+        while True:
+            try:
+                await self.backend.heartbeat(self.node_id, self.settings.job_node_lease_seconds)
+                await self.backend.pop_due(time.time())
+
+                if await self.backend.acquire_lease("leader", self.node_id, self.settings.job_leader_lease_seconds):
+                    for job_id in await self.backend.requeue_abandoned():
+                        logger.warning(f"Requeued job {job_id} from a stopped worker")
+                    if self.periodic:
+                        await self._enqueue_periodic()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job scheduler error: {e}")
+            await asyncio.sleep(SCHEDULER_TICK_SECONDS)
+
+    async def _enqueue_periodic(self):
+        now = time.time()
+        for name, interval in self.periodic.items():
+            last = await self.backend.get_marker(name)
+            if last is None:
+                # First boot: start the clock instead of running immediately.
+                await self.backend.set_marker(name, now)
+            elif now - last >= interval:
+                await self.backend.set_marker(name, now)
+                await self.enqueue(name)
+
+job_service = JobService()
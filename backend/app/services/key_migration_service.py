@@ -0,0 +1,153 @@
+from typing import Awaitable, Callable, Optional
+from datetime import datetime, timedelta
+from app.core.config import get_settings
+from app.models.resource import Resource, ResourceType
+from app.services.storage_service import storage_service
+from app.services.storage_backend import ObjectNotFound, PreconditionFailed, current_s3_key, current_layout_pattern
+from app.services.preview_service import preview_key
+from app.services.job_service import job_service
+import asyncio
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Job marker holding when keys were last rewritten; orphan cleanup keeps the
+# objects they were moved away from until the grace period has passed.
+REWRITE_MARKER = "s3_key_migration"
+# Presigned URLs live for an hour, ZIPs already streaming read the old key.
+RETIRED_KEY_GRACE_SECONDS = 2 * 3600
+MIGRATION_BATCH_SIZE = 500
+# S3 refuses to CopyObject anything larger; such objects keep their key.
+MAX_COPY_SIZE = 5 * 1024 ** 3
+
+class KeyMigrationService:
+    """Moves stored objects to the configured key layout while serving.
+
+    Each object is copied server-side to its new key, then every resource
+    pointing at the old key is rewritten. Until the rewrite, readers use
+    the old key, which still exists; after it, the new one. The old object
+    is left for orphan cleanup once RETIRED_KEY_GRACE_SECONDS have passed.
+    The job can be stopped and run again at any point.
+
+    The resources hold the content lock saves claim (see
+    MetadataService._claim_content) from before the copy until the
+    rewrite, so no save can write the old key in between. Keys with a save
+    in progress are left for the next run.
+    """
+
+    def __init__(self):
+        self.settings = get_settings()
+
+    async def _copy(self, source_key: str, key: str) -> Optional[str]:
+        """Copies the object, returning the source ETag copied, None if it is gone."""
+        try:
+            etag = (await asyncio.to_thread(storage_service.head_object, source_key))["ETag"]
+            await asyncio.to_thread(storage_service.copy_object, source_key, key, etag)
+            return etag
+        except (ObjectNotFound, PreconditionFailed):
+            return None
+
+    async def _lock(self, old_key: str, token: str) -> bool:
+        """Claims the content lock of every resource on `old_key`; False,
+        holding none of them, if a save holds one."""
+        now = datetime.now()
+        collection = Resource.get_pymongo_collection()
+        await collection.update_many(
+            {"s3_key": old_key, "$or": [{"content_lock": None}, {"content_lock_expires_at": {"$lt": now}}]},
+            {"$set": {
+                "content_lock": token,
+                "content_lock_expires_at": now + timedelta(seconds=self.settings.content_lock_seconds)
+            }}
+        )
+        if await collection.count_documents({"s3_key": old_key, "content_lock": {"$ne": token}}):
+            await self._unlock(token)
+            return False
+        return True
+
+    async def _unlock(self, token: str):
+        await Resource.get_pymongo_collection().update_many(
+            {"content_lock": token},
+            {"$set": {"content_lock": None, "content_lock_expires_at": None}}
+        )
+
+    async def _renew_lock(self, token: str):
+        lease = self.settings.content_lock_seconds
+        while True:
+            await asyncio.sleep(lease / 3)
+            try:
+                await Resource.get_pymongo_collection().update_many(
+                    {"content_lock": token},
+                    {"$set": {"content_lock_expires_at": datetime.now() + timedelta(seconds=lease)}}
+                )
+            except Exception as e:
+                logger.error(f"Failed to renew key migration lock: {e}")
+
+    async def migrate_key(self, old_key: str) -> bool:
+        new_key = current_s3_key(old_key)
+        # Copies share their source's key, so it may have been moved already.
+        if new_key == old_key or not await Resource.find({"s3_key": old_key}).count():
+            return False
+        try:
+            size = (await asyncio.to_thread(storage_service.head_object, old_key))["ContentLength"]
+        except ObjectNotFound:
+            logger.warning(f"Key migration skipped {old_key}: object missing")
+            return False
+        if size > MAX_COPY_SIZE:
+            logger.warning(f"Key migration skipped {old_key}: {size} bytes is too large to copy")
+            return False
+
+        token = uuid.uuid4().hex
+        if not await self._lock(old_key, token):
+            logger.info(f"Key migration skipped {old_key}: a save is in progress")
+            return False
+        renewal = asyncio.ensure_future(self._renew_lock(token))
+        try:
+            etag = await self._copy(old_key, new_key)
+            if etag is None:
+                logger.warning(f"Key migration skipped {old_key}: object missing or changing")
+                return False
+            old_preview, new_preview = preview_key(old_key), preview_key(new_key)
+            has_preview = await Resource.find({"s3_key": old_key, "preview_s3_key": old_preview}).count() > 0
+            if has_preview and await self._copy(old_preview, new_preview) is None:
+                has_preview = False
+
+            await job_service.backend.set_marker(REWRITE_MARKER, time.time())
+            collection = Resource.get_pymongo_collection()
+            # A resource whose lock lapsed may have been saved to the old key
+            # since the copy; only the ones still held move.
+            unlock = {"content_lock": None, "content_lock_expires_at": None}
+            if has_preview:
+                await collection.update_many(
+                    {"s3_key": old_key, "preview_s3_key": old_preview, "content_lock": token},
+                    {"$set": {"s3_key": new_key, "preview_s3_key": new_preview, **unlock}}
+                )
+            await collection.update_many(
+                {"s3_key": old_key, "content_lock": token},
+                {"$set": {"s3_key": new_key, **unlock}}
+            )
+            return True
+        finally:
+            renewal.cancel()
+            await self._unlock(token)
+
+    async def migrate_keys(self, on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None) -> dict:
+        start_time = time.time()
+        collection = Resource.get_pymongo_collection()
+        query = {"type": ResourceType.FILE.value, "s3_key": {"$ne": None, "$not": current_layout_pattern()}}
+        total = await collection.count_documents(query)
+        scanned = migrated = 0
+        cursor = collection.find(query, {"s3_key": 1}).sort("_id", 1).batch_size(MIGRATION_BATCH_SIZE)
+        async for doc in cursor:
+            scanned += 1
+            if await self.migrate_key(doc["s3_key"]):
+                migrated += 1
+            if on_progress and scanned % MIGRATION_BATCH_SIZE == 0:
+                await on_progress(scanned, total)
+        if on_progress:
+            await on_progress(scanned, total)
+        logger.info(f"Key migration moved {migrated} objects, scanned {scanned} resources in {time.time() - start_time:.2f}s")
+        return {"scanned": scanned, "migrated": migrated}
+
+key_migration_service = KeyMigrationService()
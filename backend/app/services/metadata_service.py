@@ -1,37 +1,54 @@
 from fastapi import HTTPException
-from typing import List
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
 from beanie import PydanticObjectId
 from app.models.user import User
 from app.models.resource import Resource, ResourceType, Permission
-from app.schemas.resource import FolderCreate
-from app.services.s3_service import s3_service
+from app.schemas.resource import FolderCreate, ContentPatch, ContentEdit
+from app.services.storage_service import storage_service
+from app.services.storage_backend import ObjectNotFound, PreconditionFailed, build_s3_key
 from app.services.permission_service import permission_service
-from datetime import datetime
+from app.services.quota_service import quota_service
+from app.services.preview_service import preview_service
+from app.services.content_cache_service import ContentTooLarge, content_cache_service
+from app.services.tree_cache_service import tree_cache_service
+from app.services.tree_refresh_service import tree_refresh_service
+from app.services.admission_service import admission_service
+from app.services import serializers
+from app.core.responses import dumps
+from app.core.config import get_settings
+from app.core.metrics import TREE_CACHE
+from app.core.database import read_collection
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+import asyncio
 import logging
 import time
-import os
-import redis.asyncio as redis
-import json
+import uuid
 from beanie.operators import In
 
 logger = logging.getLogger(__name__)
 
+COPY_BATCH_SIZE = 1000
+EMPTY_TREE = '{"tree":[]}'
+# Parent ids per `$in` query when walking a subtree level by level.
+TREE_LEVEL_BATCH_SIZE = 1000
+# Streamed tree chunks are flushed at each level and whenever they grow
+# past this size.
+TREE_STREAM_FLUSH_BYTES = 64 * 1024
+TREE_NODE_PROJECTION = {"name_ngrams": 0}
 
 class MetadataService:
     def __init__(self):
-        self.redis_client = redis.Redis(
-            host=os.getenv("REDIS_HOST", "localhost"),
-            port=int(os.getenv("REDIS_PORT", 6379)),
-            password=os.getenv("REDIS_PASSWORD", None),
-            decode_responses=True,
-            ssl=True
-        )
+        self.settings = get_settings()
+        # Tree rebuilds in flight in this worker, keyed by (user id, version).
+        self._tree_builds: Dict[tuple, asyncio.Future] = {}
 
-    async def _invalidate_tree_cache(self, user_id):
-        try:
-            await self.redis_client.delete(f"drive:tree:{user_id}")
-        except Exception as e:
-            logger.error(f"Redis invalidation error: {e}")
+    async def _invalidate_tree_cache(self, user_id, folder_ids: Iterable = ()):
+        folder_ids = {fid for fid in folder_ids if fid}
+        await tree_cache_service.invalidate(user_id, folder_ids)
+        # A change inside someone else's shared folder changes their tree too.
+        for owner_id in await permission_service.drive_owners(folder_ids) - {user_id}:
+            await tree_cache_service.invalidate(owner_id)
 
     async def create_folder(self, folder_in: FolderCreate, current_user: User) -> Resource:
         parent = await Resource.get(folder_in.parent_id)
@@ -45,37 +62,102 @@ class MetadataService:
             owner_id=current_user.id
         )
         await new_folder.create()
-        await self._invalidate_tree_cache(current_user.id)
+        await self._invalidate_tree_cache(current_user.id, [folder_in.parent_id])
         return new_folder
 
-    async def get_folder_contents(self, folder_id: PydanticObjectId, current_user: User) -> dict:
+    async def get_readable_folder(self, folder_id: PydanticObjectId, current_user: User) -> Resource:
         folder = await Resource.get(folder_id)
         if not folder or folder.is_deleted:
             raise HTTPException(status_code=404, detail="Folder not found")
             
         await permission_service.verify_has_access(folder, current_user)
+        return folder
 
-        children = await Resource.find(
-            Resource.parent_id == folder_id,
-            Resource.is_deleted != True
-        ).to_list()
-        return {"children": children}
+    async def get_folder_contents(self, folder: Resource, current_user: User) -> dict:
+        folder_id = folder.id
+        recent_write = await tree_cache_service.recently_written(current_user.id)
+        cursor = read_collection(Resource, allow_secondary=not recent_write).find(
+            {"parent_id": folder_id, "is_deleted": {"$ne": True}},
+            serializers.RESOURCE_RESPONSE_PROJECTION
+        )
+        return {"children": [serializers.resource_doc(doc) for doc in await cursor.to_list(length=None)]}
 
-    async def get_tree(self, current_user: User) -> dict:
-        start_time = time.time()
-        
-        cache_key = f"drive:tree:{current_user.id}"
-        try:
-            cached_tree = await self.redis_client.get(cache_key)
-            if cached_tree:
-                logger.info("Serving tree from Redis cache")
-                return json.loads(cached_tree)
-        except Exception as e:
-            logger.error(f"Redis get error: {e}")
+    async def get_tree(self, current_user: User) -> Tuple[str, Optional[int]]:
+        """Returns the tree as a JSON string, straight from the cache on a hit,
+        and the tree version it reflects (None if Redis is unavailable).
+
+        Shortly after a mutation the previous tree may be returned, under its
+        own version, while the background refresh rebuilds it.
+        """
+        cached = await tree_cache_service.get(current_user.id)
+        if cached.fresh:
+            TREE_CACHE.labels("hit").inc()
+            logger.info("Serving tree from Redis cache")
+            return cached.payload, cached.version
+
+        stale_for = cached.stale_for(time.time())
+        if stale_for is not None and stale_for < self.settings.tree_stale_max_seconds:
+            TREE_CACHE.labels("stale").inc()
+            tree_refresh_service.ensure_scheduled(current_user.id)
+            return cached.payload, cached.payload_version
             
         if not current_user.root_id:
-            return {"tree": []}
-            
+            TREE_CACHE.labels("miss").inc()
+            return EMPTY_TREE, cached.version
+
+        return await self._coalesced_rebuild(current_user, cached.version, cached.recent_write, admit=True), cached.version
+
+    async def refresh_tree(self, user_id):
+        """Background rebuild run by tree_refresh_service."""
+        cached = await tree_cache_service.get(user_id)
+        if cached.fresh or cached.version is None:
+            return
+        user = await User.get(user_id)
+        if not user or not user.root_id:
+            return
+        TREE_CACHE.labels("refresh").inc()
+        await self._coalesced_rebuild(user, cached.version, cached.recent_write)
+
+    async def _coalesced_rebuild(self, current_user: User, version: Optional[int], recent_write: bool, admit: bool = False) -> str:
+        # Concurrent misses in this worker share one rebuild. It is shielded
+        # so a client disconnecting does not cancel it for the others.
+        # With `admit`, the rebuild counts against the user's tree limits;
+        # requests joining it do not, and share its 429 if it is refused.
+        key = (current_user.id, version)
+        build = self._tree_builds.get(key)
+        if build is None:
+            TREE_CACHE.labels("miss").inc()
+            rebuild = self._admitted_rebuild if admit else self._rebuild_tree
+            build = asyncio.ensure_future(rebuild(current_user, version, recent_write))
+            self._tree_builds[key] = build
+            build.add_done_callback(lambda done: self._tree_builds.pop(key, None) if self._tree_builds.get(key) is done else None)
+        else:
+            TREE_CACHE.labels("coalesced").inc()
+        return await asyncio.shield(build)
+
+    async def _admitted_rebuild(self, current_user: User, version: Optional[int], recent_write: bool) -> str:
+        async with admission_service.admit("tree", current_user.id):
+            return await self._rebuild_tree(current_user, version, recent_write)
+
+    async def _rebuild_tree(self, current_user: User, version: Optional[int], recent_write: bool) -> str:
+        """Across workers, only the holder of the rebuild lock runs the
+        aggregation; the others wait for its result to land in the cache.
+        """
+        token = None
+        if version is not None:
+            token = await tree_cache_service.acquire_rebuild_lock(current_user.id)
+            if token is None:
+                payload = await tree_cache_service.wait_for_rebuild(current_user.id, version)
+                if payload is not None:
+                    TREE_CACHE.labels("waited").inc()
+                    return payload
+        if token is None:
+            return await self._build_tree(current_user, version, recent_write)
+        async with tree_cache_service.holding_rebuild_lock(current_user.id, token):
+            return await self._build_tree(current_user, version, recent_write)
+
+    async def _build_tree(self, current_user: User, version: Optional[int], recent_write: bool) -> str:
+        start_time = time.time()
         pipeline = [
             {"$match": {"_id": current_user.root_id}},
             {
@@ -87,21 +169,22 @@ class MetadataService:
                     "as": "descendants",
                     "restrictSearchWithMatch": {"is_deleted": {"$ne": True}}
                 }
-            }
+            },
+            {"$project": {"name_ngrams": 0, "descendants.name_ngrams": 0}}
         ]
         
-        collection = Resource.get_pymongo_collection()
+        collection = read_collection(Resource, allow_secondary=not recent_write)
         cursor = collection.aggregate(pipeline)
         results = await cursor.to_list(length=None)
         
         if not results:
-            return {"tree": []}
+            return EMPTY_TREE
             
         root = results[0]
-        descendants = root.get("descendants", [])
+        descendants = root.pop("descendants", [])
         
         if root.get("is_deleted") is True:
-            return {"tree": []}
+            return EMPTY_TREE
 
         tree_nodes = [root] + descendants
         
@@ -110,38 +193,87 @@ class MetadataService:
             if node.get("is_deleted") is True:
                 continue
 
-            node["id"] = str(node["_id"])
-            if "_id" in node: del node["_id"] 
-            
-            node["parent_id"] = str(node["parent_id"]) if node.get("parent_id") else None
-            node["owner_id"] = str(node["owner_id"])        
-            if "shared_with" in node and isinstance(node["shared_with"], list):
-                for i, perm in enumerate(node["shared_with"]):
-                    if isinstance(perm, dict) and "user_id" in perm:
-                       node["shared_with"][i]["user_id"] = str(perm["user_id"])
-    
-            if "descendants" in node: del node["descendants"]
-
-            if node.get("created_at") and isinstance(node["created_at"], datetime):
-                node["created_at"] = node["created_at"].isoformat()
-            if node.get("updated_at") and isinstance(node["updated_at"], datetime):
-                node["updated_at"] = node["updated_at"].isoformat()
-            if node.get("deleted_at") and isinstance(node["deleted_at"], datetime):
-                node["deleted_at"] = node["deleted_at"].isoformat()
-                
-            clean_nodes.append(node)
+            clean_nodes.append(self._tree_node(node))
 
         duration = time.time() - start_time
         logger.info(f"Tree fetch completed in {duration:.4f}s. Nodes: {len(clean_nodes)}")
         
         result = {"tree": clean_nodes}
         
-        try:
-             await self.redis_client.setex(cache_key, 300, json.dumps(result))
-        except Exception as e:
-             logger.error(f"Redis set error: {e}")
+        payload = dumps(result).decode()
+        await tree_cache_service.set(current_user.id, payload, version)
              
-        return result
+        return payload
+
+    def _tree_node(self, node: dict) -> dict:
+        # ObjectIds and datetimes are encoded by dumps().
+        node["id"] = node.pop("_id")
+        node["preview_url"] = preview_service.preview_url(node.get("preview_s3_key"))
+        return node
+
+    async def get_subtree(self, root_id: Optional[PydanticObjectId], current_user: User, depth: Optional[int] = None) -> AsyncIterator[Tuple[int, dict]]:
+        """(level, node) pairs under `root_id`, breadth first, down to `depth` levels.
+
+        Access is checked before returning, so errors surface as normal
+        responses even when the nodes are then streamed. Each level is read
+        with one cursor per TREE_LEVEL_BATCH_SIZE parents instead of a
+        single `$graphLookup`, so only the folder ids of the current level
+        are held in memory. A None `root_id` (a user without a root folder
+        yet) yields nothing, like the empty tree get_tree returns.
+        """
+        if root_id is None:
+            return self._no_nodes()
+
+        chains = await permission_service.get_ancestor_chains([root_id])
+        chain = chains.get(root_id)
+        if not chain:
+            raise HTTPException(status_code=404, detail="Folder not found")
+        if not permission_service.check_chain_access(chain, current_user):
+            raise HTTPException(status_code=403, detail="Access denied")
+
+        recent_write = await tree_cache_service.recently_written(current_user.id)
+        collection = read_collection(Resource, allow_secondary=not recent_write)
+        root = await collection.find_one({"_id": root_id, "is_deleted": {"$ne": True}}, TREE_NODE_PROJECTION)
+        if not root:
+            raise HTTPException(status_code=404, detail="Folder not found")
+
+        async def walk():
+            yield 0, self._tree_node(root)
+            level = [root["id"]] if root["type"] == ResourceType.FOLDER else []
+            level_depth = 0
+            while level and (depth is None or level_depth < depth):
+                level_depth += 1
+                next_level = []
+                for i in range(0, len(level), TREE_LEVEL_BATCH_SIZE):
+                    cursor = collection.find(
+                        {"parent_id": {"$in": level[i:i + TREE_LEVEL_BATCH_SIZE]}, "is_deleted": {"$ne": True}},
+                        TREE_NODE_PROJECTION
+                    )
+                    async for node in cursor:
+                        if node["type"] == ResourceType.FOLDER:
+                            next_level.append(node["_id"])
+                        yield level_depth, self._tree_node(node)
+                level = next_level
+
+        return walk()
+
+    async def _no_nodes(self) -> AsyncIterator[Tuple[int, dict]]:
+        return
+        yield
+
+    async def iter_ndjson(self, nodes: AsyncIterator[Tuple[int, dict]]) -> AsyncIterator[bytes]:
+        """One JSON node per line, flushed per level so clients can render early."""
+        buffer = bytearray()
+        current_level = 0
+        async for level, node in nodes:
+            if buffer and (level != current_level or len(buffer) >= TREE_STREAM_FLUSH_BYTES):
+                yield bytes(buffer)
+                buffer.clear()
+            current_level = level
+            buffer += dumps(node)
+            buffer += b"\n"
+        if buffer:
+            yield bytes(buffer)
 
     async def share_resource(self, resource_id: PydanticObjectId, username: str, current_user: User, permission_type: str = "read") -> dict:
         resource = await Resource.get(resource_id)
@@ -170,7 +302,12 @@ class MetadataService:
                 type=permission_type
             ))
             
-        await resource.save()
+        # Only the shares are written; a full save could undo a concurrent
+        # content save or drop its lock.
+        await Resource.find({"_id": resource.id}).update(
+            {"$set": {"shared_with": [p.model_dump() for p in resource.shared_with]}}
+        )
+        await self._invalidate_tree_cache(current_user.id, [resource.parent_id])
         return resource
 
     async def unshare_resource(self, resource_id: PydanticObjectId, username: str, current_user: User) -> dict:
@@ -191,16 +328,18 @@ class MetadataService:
                  {"$pull": {"shared_with": {"username": username}}}
              )
         
+        await self._invalidate_tree_cache(current_user.id, [resource.parent_id])
         updated_resource = await Resource.get(resource_id)
         return updated_resource
 
-    async def get_shared_resources(self, current_user: User) -> List[Resource]:
-        shared = await Resource.find(
-            {"shared_with.user_id": current_user.id},
-            Resource.is_deleted != True
-        ).to_list()
-        
-        return shared
+    async def get_shared_resources(self, current_user: User) -> List[dict]:
+        # Shares are granted by other users, so there is no own write to
+        # wait for; bounded staleness is fine here.
+        cursor = read_collection(Resource).find(
+            {"shared_with.user_id": current_user.id, "is_deleted": {"$ne": True}},
+            serializers.RESOURCE_RESPONSE_PROJECTION
+        )
+        return [serializers.resource_doc(doc) for doc in await cursor.to_list(length=None)]
 
     async def delete_resource(self, resource_id: PydanticObjectId, current_user: User) -> dict:
         resource = await Resource.get(resource_id)
@@ -211,9 +350,11 @@ class MetadataService:
         
         resource.is_deleted = True
         resource.deleted_at = datetime.now()
-        await resource.save()
+        await Resource.find({"_id": resource.id}).update(
+            {"$set": {"is_deleted": True, "deleted_at": resource.deleted_at}}
+        )
         
-        await self._invalidate_tree_cache(current_user.id)
+        await self._invalidate_tree_cache(current_user.id, [resource.parent_id, resource.id])
         
         return {
             "deleted": [resource_id],
@@ -228,10 +369,12 @@ class MetadataService:
         ).to_list()
         
         real_ids = []
+        touched_folder_ids = set()
         for res in to_delete_candidates:
             try:
                 if await permission_service.check_write_access(res, current_user):
                     real_ids.append(res.id)
+                    touched_folder_ids.update((res.parent_id, res.id))
             except:
                 pass
         
@@ -244,7 +387,7 @@ class MetadataService:
             {"$set": {"is_deleted": True, "deleted_at": datetime.now()}}
         )
         
-        await self._invalidate_tree_cache(current_user.id)
+        await self._invalidate_tree_cache(current_user.id, touched_folder_ids)
         
         return {
             "deleted": real_ids,
@@ -252,80 +395,355 @@ class MetadataService:
             "updated": []
         }
 
-    async def update_resource_content(self, resource_id: PydanticObjectId, content_body: bytes, current_user: User) -> dict:
+    async def get_content_resource(self, resource_id: PydanticObjectId, current_user: User) -> Resource:
+        """The file behind GET /resources/{id}/content, if small enough to be served there."""
         resource = await Resource.get(resource_id)
         if not resource:
-            raise HTTPException(status_code=404, detail="File not found")    
-        
+            raise HTTPException(status_code=404, detail="File not found")
+
+        await permission_service.verify_has_access(resource, current_user)
+
+        if resource.type != ResourceType.FILE or not resource.s3_key:
+            raise HTTPException(status_code=400, detail="Not a file")
+
+        if not content_cache_service.cacheable(resource.size):
+            raise HTTPException(status_code=413, detail="Content too large, use the download link")
+        return resource
+
+    async def read_content(self, resource: Resource) -> Tuple[bytes, Optional[int]]:
+        try:
+            return await content_cache_service.read(resource)
+        except ObjectNotFound:
+            raise HTTPException(status_code=404, detail="File content not found")
+        except ContentTooLarge:
+            raise HTTPException(status_code=413, detail="Content too large, use the download link")
+
+    async def update_resource_content(self, resource_id: PydanticObjectId, body: AsyncIterator[bytes], current_user: User, content_length: Optional[int] = None, base_version: Optional[int] = None) -> dict:
+        max_size = self.settings.max_content_body_size
+        if content_length is not None and content_length > max_size:
+            raise HTTPException(status_code=413, detail="Content too large")
+
+        resource = await Resource.get(resource_id)
+        if not resource:
+            raise HTTPException(status_code=404, detail="File not found")
+
         await permission_service.verify_write_access(resource, current_user)
-            
+
         if resource.type != ResourceType.FILE or not resource.s3_key:
             raise HTTPException(status_code=400, detail="Not a file")
-    
-        await s3_service.upload_bytes(resource.s3_key, content_body)
-        
-        resource.size = len(content_body)
-        resource.updated_at = datetime.now()
-        await resource.save()
-        
-        return {"message": "Saved"}
+
+        owner = current_user if resource.owner_id == current_user.id else await User.get(resource.owner_id)
+        if not owner:
+            raise HTTPException(status_code=404, detail="Owner not found")
+
+        claim = await self._claim_content(resource, base_version)
+        key = await self._content_target_key(resource, claim)
+        part_size = self.settings.content_upload_part_size
+        upload_id = None
+        parts = []
+        buffer = bytearray()
+        size = 0
+        completed = False
+        saved = False
+
+        # The body is forwarded to S3 one part at a time, so at most one part
+        # is held in memory no matter how large the file is. Small files that
+        # fit in a single part skip the multipart round trips entirely.
+        try:
+            async for chunk in body:
+                size += len(chunk)
+                if size > max_size:
+                    raise HTTPException(status_code=413, detail="Content too large")
+                buffer.extend(chunk)
+                await self._renew_content_claim(resource, claim)
+
+                while len(buffer) >= part_size:
+                    if upload_id is None:
+                        upload_id = await asyncio.to_thread(storage_service.create_multipart_upload, key)
+                    part = bytes(buffer[:part_size])
+                    del buffer[:part_size]
+                    parts.append(await asyncio.to_thread(storage_service.upload_part, key, upload_id, len(parts) + 1, part))
+
+            # Against the size this save replaces, not the one read before
+            # the claim.
+            delta = size - claim.get("size", 0)
+            await quota_service.consume(owner, delta)
+
+            try:
+                if upload_id is None:
+                    await asyncio.to_thread(storage_service.upload_bytes, key, bytes(buffer))
+                else:
+                    if buffer:
+                        parts.append(await asyncio.to_thread(storage_service.upload_part, key, upload_id, len(parts) + 1, bytes(buffer)))
+                    await asyncio.to_thread(storage_service.complete_multipart_upload, key, upload_id, parts)
+                completed = True
+            except Exception:
+                await quota_service.refund(owner, delta)
+                raise
+
+            await quota_service.refund(owner, -delta)
+            # Small files went up in one piece and are still in the buffer.
+            content_version = await self._bump_content_version(resource, claim, key, size, bytes(buffer) if upload_id is None else None)
+            saved = True
+        finally:
+            if upload_id is not None and not completed:
+                try:
+                    await asyncio.to_thread(storage_service.abort_multipart_upload, key, upload_id)
+                except Exception as e:
+                    logger.error(f"Failed to abort multipart upload {upload_id}: {e}")
+            if not saved:
+                await self._release_content(resource, claim)
+
+        return {"message": "Saved", "content_version": content_version, "size": size}
+
+    async def patch_resource_content(self, resource_id: PydanticObjectId, patch: ContentPatch, current_user: User, base_version: Optional[int] = None) -> dict:
+        """Applies character-range edits to the stored text of a file.
+
+        Offsets are Unicode code points into the content at `base_version`.
+        The content is claimed at that version before it is read, so no
+        other save can land between the read and the write; one that got
+        there first surfaces as a 409.
+        """
+        if patch.base_version is not None:
+            base_version = patch.base_version
+        if base_version is None:
+            raise HTTPException(status_code=428, detail="A base version is required")
+
+        resource = await Resource.get(resource_id)
+        if not resource:
+            raise HTTPException(status_code=404, detail="File not found")
+
+        await permission_service.verify_write_access(resource, current_user)
+
+        if resource.type != ResourceType.FILE or not resource.s3_key:
+            raise HTTPException(status_code=400, detail="Not a file")
+
+        if resource.content_version != base_version:
+            raise HTTPException(status_code=409, detail="Content has changed since the base version")
+
+        max_size = self.settings.max_content_body_size
+        if resource.size > max_size:
+            raise HTTPException(status_code=413, detail="Content too large")
+
+        owner = current_user if resource.owner_id == current_user.id else await User.get(resource.owner_id)
+        if not owner:
+            raise HTTPException(status_code=404, detail="Owner not found")
+
+        claim = await self._claim_content(resource, base_version)
+        try:
+            key = await self._content_target_key(resource, claim)
+            data, etag = await asyncio.to_thread(storage_service.get_object_bytes, claim["s3_key"])
+            try:
+                text = data.decode("utf-8")
+            except UnicodeDecodeError:
+                raise HTTPException(status_code=400, detail="Patches are only supported for UTF-8 text files")
+
+            new_data = self._apply_edits(text, patch.edits).encode("utf-8")
+            if len(new_data) > max_size:
+                raise HTTPException(status_code=413, detail="Content too large")
+
+            delta = len(new_data) - len(data)
+            await quota_service.consume(owner, delta)
+            try:
+                # Still conditional, in case the claim expired under us.
+                if_match = etag if key == claim["s3_key"] else None
+                await asyncio.to_thread(storage_service.upload_bytes, key, new_data, if_match)
+            except PreconditionFailed:
+                await quota_service.refund(owner, delta)
+                raise HTTPException(status_code=409, detail="Content has changed since the base version")
+            except Exception:
+                await quota_service.refund(owner, delta)
+                raise
+            await quota_service.refund(owner, -delta)
+        except BaseException:
+            await self._release_content(resource, claim)
+            raise
+
+        content_version = await self._bump_content_version(resource, claim, key, len(new_data), new_data)
+        return {"message": "Saved", "content_version": content_version, "size": len(new_data)}
+
+    def _apply_edits(self, text: str, edits: List[ContentEdit]) -> str:
+        ordered = sorted(edits, key=lambda e: (e.start, e.end))
+        prev_end = 0
+        for edit in ordered:
+            if edit.start < prev_end or edit.start > edit.end or edit.end > len(text):
+                raise HTTPException(status_code=422, detail="Invalid or overlapping edit range")
+            prev_end = edit.end
+
+        parts = []
+        cursor = 0
+        for edit in ordered:
+            parts.append(text[cursor:edit.start])
+            parts.append(edit.text)
+            cursor = edit.end
+        parts.append(text[cursor:])
+        return "".join(parts)
+
+    async def _claim_content(self, resource: Resource, base_version: Optional[int]) -> dict:
+        """Locks a file's content for one save, at `base_version` if given.
+
+        A save checks the version, writes the object and then bumps the
+        version. Without the claim another save could write in between, and
+        ours would overwrite it or, for a patch, apply edits meant for
+        older content. Returns the claimed document (content_version, size
+        and s3_key as they are now) with the lock token.
+        """
+        now = datetime.now()
+        token = uuid.uuid4().hex
+        query = {
+            "_id": resource.id,
+            "$or": [{"content_lock": None}, {"content_lock_expires_at": {"$lt": now}}]
+        }
+        if base_version is not None:
+            query["content_version"] = base_version
+        collection = Resource.get_pymongo_collection()
+        claimed = await collection.find_one_and_update(
+            query,
+            {"$set": {
+                "content_lock": token,
+                "content_lock_expires_at": now + timedelta(seconds=self.settings.content_lock_seconds)
+            }},
+            projection={"content_version": 1, "size": 1, "s3_key": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if not claimed:
+            current = await collection.find_one({"_id": resource.id}, {"content_version": 1})
+            if not current:
+                raise HTTPException(status_code=404, detail="File not found")
+            if base_version is not None and current.get("content_version", 0) != base_version:
+                raise HTTPException(status_code=409, detail="Content has changed since the base version")
+            raise HTTPException(status_code=409, detail="Another save of this file is in progress")
+        claimed["token"] = token
+        claimed["renewed_at"] = time.monotonic()
+        return claimed
+
+    async def _content_target_key(self, resource: Resource, claim: dict) -> str:
+        """Key a save writes to. Copies share their source's object, so a
+        save to any of them goes to a fresh key and leaves the others'
+        content alone."""
+        key = claim["s3_key"]
+        if await Resource.find({"s3_key": key, "_id": {"$ne": resource.id}}).count():
+            return build_s3_key(resource.owner_id, PydanticObjectId(), resource.name)
+        return key
+
+    async def _renew_content_claim(self, resource: Resource, claim: dict):
+        """Extends the claim while a long body streams in."""
+        lease = self.settings.content_lock_seconds
+        if time.monotonic() - claim["renewed_at"] < lease / 3:
+            return
+        result = await Resource.get_pymongo_collection().update_one(
+            {"_id": resource.id, "content_lock": claim["token"]},
+            {"$set": {"content_lock_expires_at": datetime.now() + timedelta(seconds=lease)}}
+        )
+        if not result.matched_count:
+            raise HTTPException(status_code=409, detail="Content has changed since the base version")
+        claim["renewed_at"] = time.monotonic()
+
+    async def _release_content(self, resource: Resource, claim: dict):
+        try:
+            await Resource.get_pymongo_collection().update_one(
+                {"_id": resource.id, "content_lock": claim["token"]},
+                {"$set": {"content_lock": None, "content_lock_expires_at": None}}
+            )
+        except Exception as e:
+            logger.error(f"Failed to release content lock on {resource.id}: {e}")
+
+    async def _bump_content_version(self, resource: Resource, claim: dict, key: str, size: int, content: Optional[bytes] = None) -> int:
+        """Records a save to `key` and releases its claim; `content` is what
+        was written, if it is at hand."""
+        collection = Resource.get_pymongo_collection()
+        update = {
+            "$set": {"s3_key": key, "size": size, "updated_at": datetime.now(), "content_lock": None, "content_lock_expires_at": None},
+            "$inc": {"content_version": 1}
+        }
+        updated = await collection.find_one_and_update(
+            {"_id": resource.id, "content_lock": claim["token"]},
+            update,
+            projection={"content_version": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if not updated:
+            # The claim expired while we wrote. The object holds our bytes
+            # now, so the version has to move on regardless.
+            logger.warning(f"Content lock on {resource.id} expired during a save")
+            update["$set"].pop("content_lock")
+            update["$set"].pop("content_lock_expires_at")
+            updated = await collection.find_one_and_update(
+                {"_id": resource.id},
+                update,
+                projection={"content_version": 1},
+                return_document=ReturnDocument.AFTER
+            )
+        if key == claim["s3_key"]:
+            # A copy made while we wrote in place shares the object and now
+            # has our bytes; its version moves with them.
+            await collection.update_many(
+                {"s3_key": key, "_id": {"$ne": resource.id}},
+                {"$inc": {"content_version": 1}}
+            )
+        resource.size = size
+        resource.s3_key = key
+        previous_version = claim.get("content_version", 0)
+        content_version = updated["content_version"] if updated else previous_version + 1
+        resource.content_version = content_version
+        # The editor reopens the file right after saving.
+        if content is not None:
+            await content_cache_service.put(resource.id, content_version, content)
+        await content_cache_service.discard(resource.id, previous_version)
+        await self._invalidate_tree_cache(resource.owner_id, [resource.parent_id])
+        preview_service.enqueue(resource)
+        return content_version
 
     async def move_resources(self, resource_ids: List[PydanticObjectId], target_parent_id: PydanticObjectId, current_user: User) -> dict:
-        target_folder = await Resource.get(target_parent_id)
-        if not target_folder:
+        # Target and its whole ancestry in one round trip; used both for the
+        # write-permission check and for cycle detection.
+        chains = await permission_service.get_ancestor_chains([target_parent_id])
+        target_chain = chains.get(target_parent_id)
+        if not target_chain:
             raise HTTPException(status_code=404, detail="Target folder not found")
-        
-        if target_folder.type != ResourceType.FOLDER:
+
+        if target_chain[0].get("type") != ResourceType.FOLDER:
             raise HTTPException(status_code=400, detail="Target must be a folder")
-            
-        await permission_service.verify_write_access(target_folder, current_user)
-        
+
+        if not permission_service.check_chain_access(target_chain, current_user, write=True):
+            raise HTTPException(status_code=403, detail="Write access denied")
+
+        ancestry_ids = {node["_id"] for node in target_chain}
+        if ancestry_ids.intersection(resource_ids):
+            raise HTTPException(status_code=400, detail="Cannot move a folder into itself")
+
         resources_candidates = await Resource.find(
             {"_id": {"$in": resource_ids}},
             Resource.is_deleted != True
         ).to_list()
-        
-        resources = []
-        for res in resources_candidates:
-            if await permission_service.check_write_access(res, current_user):
-                resources.append(res)
-        
-        if not resources:
+
+        resources = await permission_service.filter_accessible(resources_candidates, current_user, write=True)
+        to_move = [res for res in resources if res.parent_id != target_parent_id]
+
+        if not to_move:
             return {"added": [], "updated": [], "deleted": []}
-            
-        curr = target_folder
-        while curr.parent_id:
-            if curr.id in resource_ids: 
-                raise HTTPException(status_code=400, detail="Cannot move a folder into itself")
-            
-            if curr.id == current_user.root_id:
-                break
-            
-            parent = await Resource.get(curr.parent_id)
-            if not parent: 
-                break
-            curr = parent
-            
-        updated_resources = []
-        for res in resources:
-            if res.id == target_parent_id:
-                 raise HTTPException(status_code=400, detail="Cannot move a folder into itself")
-            
-            if res.parent_id != target_parent_id:
-                res.parent_id = target_parent_id
-                res.updated_at = datetime.now()
-                await res.save()
-                updated_resources.append(res)
-        
-        await self._invalidate_tree_cache(current_user.id)
-                
+
+        now = datetime.now()
+        touched_folder_ids = {res.parent_id for res in to_move} | {target_parent_id}
+        await Resource.find(
+            {"_id": {"$in": [res.id for res in to_move]}}
+        ).update(
+            {"$set": {"parent_id": target_parent_id, "updated_at": now}}
+        )
+
+        for res in to_move:
+            res.parent_id = target_parent_id
+            res.updated_at = now
+
+        await self._invalidate_tree_cache(current_user.id, touched_folder_ids)
+
         return {
             "added": [],
-            "updated": updated_resources,
+            "updated": to_move,
             "deleted": []
         }
 
-    async def copy_resources(self, resource_ids: List[PydanticObjectId], target_parent_id: PydanticObjectId, current_user: User) -> dict:
+    async def copy_resources(self, resource_ids: List[PydanticObjectId], target_parent_id: PydanticObjectId, current_user: User, on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None) -> dict:
         target_folder = await Resource.get(target_parent_id)
         if not target_folder or target_folder.type != ResourceType.FOLDER:
              raise HTTPException(status_code=404, detail="Target folder not found")
@@ -335,66 +753,94 @@ class MetadataService:
             Resource.is_deleted != True
         ).to_list()
         
-        sources = []
-        for res in candidates:
-             if await permission_service.check_resource_access(res, current_user): # Copy only needs read access on source!
-                 sources.append(res)
-        
-        added_resources = []
-        
+        # Copy only needs read access on source!
+        sources = await permission_service.filter_accessible(candidates, current_user)
+        if not sources:
+            return {"added": [], "updated": [], "deleted": []}
+
+        pipeline = [
+            {"$match": {"_id": {"$in": [src.id for src in sources]}}},
+            {
+                "$graphLookup": {
+                    "from": "resources",
+                    "startWith": "$_id",
+                    "connectFromField": "_id",
+                    "connectToField": "parent_id",
+                    "as": "descendants",
+                    "depthField": "depth",
+                    "restrictSearchWithMatch": {"is_deleted": {"$ne": True}}
+                }
+            }
+        ]
+        collection = Resource.get_pymongo_collection()
+        cursor = collection.aggregate(pipeline)
+        subtrees = await cursor.to_list(length=None)
+        # A source inside another selected folder is copied with that folder;
+        # copying it again would map its nodes to two copies.
+        nested = {node["_id"] for src in subtrees for node in src["descendants"]}
+        subtrees = [src for src in subtrees if src["_id"] not in nested]
+
+        # Group every node by its depth below the copy target so parents are
+        # always written before their children.
+        levels: Dict[int, List[dict]] = {}
         total_copy_size = 0
-        
-        async def calculate_size(res: Resource):
-            size = 0
-            if res.type == ResourceType.FILE:
-                size += res.size
-            elif res.type == ResourceType.FOLDER:
-                 children = await Resource.find(
-                    Resource.parent_id == res.id,
-                    Resource.is_deleted != True
-                 ).to_list()
-                 for child in children:
-                     size += await calculate_size(child)
-            return size
-
-        for src in sources:
-            total_copy_size += await calculate_size(src)
-
-        if current_user.storage_used + total_copy_size > current_user.storage_limit:
-             raise HTTPException(status_code=403, detail="Storage quota exceeded. Upgrade your plan.")
-        
-        async def recursive_copy(original: Resource, new_parent_id: PydanticObjectId):
-            new_node = Resource(
-                name=original.name, 
-                type=original.type,
-                parent_id=new_parent_id,
-                owner_id=current_user.id,
-                size=original.size,
-                s3_key=original.s3_key if original.type == ResourceType.FILE else None,
-                created_at=datetime.now(),
-                updated_at=datetime.now()
-            )
-            await new_node.create()
-            added_resources.append(new_node)
-            
-            if original.type == ResourceType.FOLDER:
-                children = await Resource.find(
-                    Resource.parent_id == original.id,
-                    Resource.is_deleted != True
-                ).to_list()
-                
-                for child in children:
-                    await recursive_copy(child, new_node.id)
-
-        for src in sources:
-            await recursive_copy(src, target_parent_id)
-            
-        if total_copy_size > 0:
-            current_user.storage_used += total_copy_size
-            await current_user.save()
-            
-        await self._invalidate_tree_cache(current_user.id)
-            
+        total_nodes = 0
+        for src in subtrees:
+            descendants = src.pop("descendants", [])
+            src["depth"] = -1
+            total_nodes += 1 + len(descendants)
+            for node in [src] + descendants:
+                levels.setdefault(node["depth"] + 1, []).append(node)
+                if node["type"] == ResourceType.FILE:
+                    total_copy_size += node.get("size", 0)
+
+        await quota_service.consume(current_user, total_copy_size)
+
+        now = datetime.now()
+        id_map = {}
+        added_resources = []
+
+        try:
+            for depth in sorted(levels.keys()):
+                level_nodes = []
+                for node in levels[depth]:
+                    new_parent_id = target_parent_id if depth == 0 else id_map.get(node["parent_id"])
+                    if new_parent_id is None:
+                        # Parent was skipped (e.g. concurrently deleted), drop the branch.
+                        continue
+
+                    new_id = PydanticObjectId()
+                    id_map[node["_id"]] = new_id
+                    level_nodes.append(Resource(
+                        id=new_id,
+                        name=node["name"],
+                        type=node["type"],
+                        parent_id=new_parent_id,
+                        owner_id=current_user.id,
+                        size=node.get("size", 0),
+                        s3_key=node.get("s3_key") if node["type"] == ResourceType.FILE else None,
+                        content_version=node.get("content_version", 0),
+                        preview_s3_key=node.get("preview_s3_key"),
+                        preview_type=node.get("preview_type"),
+                        created_at=now,
+                        updated_at=now
+                    ))
+
+                for i in range(0, len(level_nodes), COPY_BATCH_SIZE):
+                    await Resource.insert_many(level_nodes[i:i + COPY_BATCH_SIZE])
+                added_resources.extend(level_nodes)
+                if on_progress:
+                    await on_progress(len(added_resources), total_nodes)
+        except BaseException:
+            # Nothing of a failed copy is kept, so none of its usage either.
+            # Includes a batch insert_many may have written part of.
+            if id_map:
+                await Resource.find({"_id": {"$in": list(id_map.values())}}).delete()
+            await quota_service.refund(current_user, total_copy_size)
+            raise
+
+        await self._invalidate_tree_cache(current_user.id, [target_parent_id])
+
         return {
             "added": added_resources,
             "updated": [],
@@ -1,4 +1,6 @@
 from fastapi import HTTPException
+from typing import Dict, Iterable, List, Set
+from beanie import PydanticObjectId
 from app.models.user import User
 from app.models.resource import Resource
 
@@ -43,4 +45,100 @@ class PermissionService:
         if resource.owner_id != user.id:
             raise HTTPException(status_code=403, detail="Only owner can perform this action")
 
+    async def get_ancestor_chains(self, resource_ids: List[PydanticObjectId]) -> Dict[PydanticObjectId, List[dict]]:
+        """Loads the ancestry of every resource in one aggregation.
+
+        Each chain starts at the resource itself and walks up to the root.
+        """
+        if not resource_ids:
+            return {}
+
+        pipeline = [
+            {"$match": {"_id": {"$in": list(resource_ids)}}},
+            {
+                "$graphLookup": {
+                    "from": "resources",
+                    "startWith": "$parent_id",
+                    "connectFromField": "parent_id",
+                    "connectToField": "_id",
+                    "as": "ancestors",
+                    "depthField": "depth"
+                }
+            },
+            {
+                "$project": {
+                    "name": 1,
+                    "type": 1,
+                    "parent_id": 1,
+                    "owner_id": 1,
+                    "shared_with": 1,
+                    "is_deleted": 1,
+                    "ancestors._id": 1,
+                    "ancestors.name": 1,
+                    "ancestors.owner_id": 1,
+                    "ancestors.shared_with": 1,
+                    "ancestors.is_deleted": 1,
+                    "ancestors.depth": 1
+                }
+            }
+        ]
+
+        collection = Resource.get_pymongo_collection()
+        cursor = collection.aggregate(pipeline)
+        results = await cursor.to_list(length=None)
+
+        chains = {}
+        for doc in results:
+            ancestors = sorted(doc.get("ancestors", []), key=lambda a: a["depth"])
+            chains[doc["_id"]] = [doc] + ancestors
+        return chains
+
+    async def drive_owners(self, folder_ids: Iterable[PydanticObjectId]) -> Set[PydanticObjectId]:
+        """Owners of the drives the folders are in, i.e. of their root folders.
+
+        A folder shared with someone else and changed by them still shows
+        up in its owner's tree.
+        """
+        chains = await self.get_ancestor_chains([fid for fid in folder_ids if fid])
+        return {chain[-1]["owner_id"] for chain in chains.values() if chain[-1].get("owner_id")}
+
+    def check_chain_access(self, chain: List[dict], user: User, write: bool = False) -> bool:
+        for node in chain:
+            if node.get("owner_id") == user.id:
+                return True
+            for perm in node.get("shared_with") or []:
+                if perm.get("user_id") == user.id:
+                    return perm.get("type") == 'editor' if write else True
+        return False
+
+    async def filter_accessible(self, resources: List[Resource], user: User, write: bool = False) -> List[Resource]:
+        """Batch variant of check_resource_access/check_write_access.
+
+        Owned and directly shared resources are decided without a query.
+        The rest inherit access from their parent, so the ancestry of each
+        distinct parent is fetched with a single aggregation and checked
+        once, however many siblings are in the batch.
+        """
+        allowed_ids = set()
+        pending = {}
+        for res in resources:
+            if res.owner_id == user.id:
+                allowed_ids.add(res.id)
+                continue
+            direct = next((p for p in res.shared_with if p.user_id == user.id), None)
+            if direct:
+                if not write or direct.type == 'editor':
+                    allowed_ids.add(res.id)
+                continue
+            if res.parent_id:
+                pending.setdefault(res.parent_id, []).append(res.id)
+
+        if pending:
+            chains = await self.get_ancestor_chains(list(pending))
+            for parent_id, chain in chains.items():
+                if self.check_chain_access(chain, user, write=write):
+                    allowed_ids.update(pending[parent_id])
+
+        return [res for res in resources if res.id in allowed_ids]
+
 permission_service = PermissionService()
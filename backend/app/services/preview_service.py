@@ -0,0 +1,153 @@
+from typing import Optional
+from beanie import PydanticObjectId
+from concurrent.futures import ProcessPoolExecutor
+from app.models.resource import Resource
+from app.services.storage_service import storage_service
+from app.services.tree_cache_service import tree_cache_service
+from app.core.config import get_settings
+import asyncio
+import io
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp", ".tiff"}
+TEXT_EXTENSIONS = {
+    ".txt", ".md", ".csv", ".log", ".json", ".yaml", ".yml", ".xml", ".html", ".css",
+    ".js", ".ts", ".tsx", ".jsx", ".py", ".java", ".c", ".cpp", ".h", ".go", ".rs", ".sh", ".sql"
+}
+
+THUMBNAIL_SIZE = (256, 256)
+TEXT_PREVIEW_CHARS = 4096
+PREVIEW_PREFIX = "previews/"
+
+
+def preview_kind(name: str) -> Optional[str]:
+    ext = os.path.splitext(name)[1].lower()
+    if ext in IMAGE_EXTENSIONS:
+        return "image"
+    if ext in TEXT_EXTENSIONS:
+        return "text"
+    return None
+
+
+def preview_key(s3_key: str) -> str:
+    return f"{PREVIEW_PREFIX}{s3_key}"
+
+
+def render_image_thumbnail(data: bytes) -> bytes:
+    # Runs in a worker process; imported here so the web workers never load Pillow.
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        img.thumbnail(THUMBNAIL_SIZE)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=80)
+        return out.getvalue()
+
+
+def render_text_preview(data: bytes) -> bytes:
+    text = data[:TEXT_PREVIEW_CHARS * 4].decode("utf-8", errors="replace")
+    return text[:TEXT_PREVIEW_CHARS].encode("utf-8")
+
+
+class PreviewService:
+    """Generates thumbnails and text previews in the background.
+
+    Jobs are queued in-process and picked up by a few asyncio workers; the
+    CPU-bound rendering is handed to a process pool so it never blocks the
+    event loop.
+    """
+
+    def __init__(self):
+        self.settings = get_settings()
+        self.queue: asyncio.Queue = None
+        self.pool: ProcessPoolExecutor = None
+        self.workers = []
+
+    def start(self):
+        if self.workers:
+            return
+        self.queue = asyncio.Queue(maxsize=self.settings.preview_queue_size)
+        self.pool = ProcessPoolExecutor(max_workers=self.settings.preview_processes)
+        self.workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.settings.preview_processes)
+        ]
+
+    async def stop(self):
+        for task in self.workers:
+            task.cancel()
+        for task in self.workers:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.workers = []
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def enqueue(self, resource: Resource):
+        if not self.workers or not resource.s3_key or not preview_kind(resource.name):
+            return
+        if resource.size > self.settings.preview_max_source_size:
+            return
+        try:
+            self.queue.put_nowait((resource.id, resource.s3_key, resource.name))
+        except asyncio.QueueFull:
+            logger.warning(f"Preview queue full, skipping {resource.id}")
+
+    def preview_url(self, preview_s3_key: Optional[str]) -> Optional[str]:
+        if not preview_s3_key:
+            return None
+        return storage_service.generate_presigned_download_url(preview_s3_key, "inline")
+
+    async def _worker(self):
+        while True:
+            resource_id, s3_key, name = await self.queue.get()
+            try:
+                await self.generate(resource_id, s3_key, name)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Preview generation failed for {resource_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def generate(self, resource_id: PydanticObjectId, s3_key: str, name: str):
+        kind = preview_kind(name)
+        if not kind:
+            return
+
+        data, _ = await asyncio.to_thread(storage_service.get_object_bytes, s3_key)
+
+        loop = asyncio.get_running_loop()
+        if kind == "image":
+            rendered = await loop.run_in_executor(self.pool, render_image_thumbnail, data)
+            content_type = "image/jpeg"
+        else:
+            rendered = await loop.run_in_executor(self.pool, render_text_preview, data)
+            content_type = "text/plain; charset=utf-8"
+
+        key = preview_key(s3_key)
+        await asyncio.to_thread(storage_service.upload_bytes, key, rendered, None, content_type)
+
+        # Every resource sharing this object (copies keep the original key)
+        # gets the same preview.
+        await Resource.find(Resource.s3_key == s3_key).update(
+            {"$set": {"preview_s3_key": key, "preview_type": kind}}
+        )
+
+        affected = await Resource.get_pymongo_collection().find(
+            {"s3_key": s3_key}, {"owner_id": 1, "parent_id": 1}
+        ).to_list(length=None)
+        folders_by_owner = {}
+        for doc in affected:
+            folders_by_owner.setdefault(doc["owner_id"], set()).add(doc.get("parent_id"))
+        for owner_id, folder_ids in folders_by_owner.items():
+            await tree_cache_service.invalidate(owner_id, folder_ids, keep_stale=True)
+
+preview_service = PreviewService()
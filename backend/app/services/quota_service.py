@@ -0,0 +1,168 @@
+from typing import Dict, List, Optional, Tuple
+from beanie import PydanticObjectId
+from fastapi import HTTPException
+from app.models.user import User
+from app.models.upload import UploadReservation
+from app.core.config import get_settings
+from datetime import datetime, timedelta
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# A claimant that has not finished within this window is assumed dead and its
+# reservations are handed back to the sweeper.
+STALE_CLAIM_SECONDS = 900
+
+
+class QuotaService:
+    """Tracks storage usage with atomic, limit-guarded counters.
+
+    Uploads reserve their bytes at init time (`storage_reserved`) and the
+    reservation is turned into committed usage (`storage_used`) on confirm.
+    Every check is a single conditional `$inc` on the user document, so
+    concurrent upload streams never overwrite each other's counters.
+    """
+
+    def __init__(self):
+        self.settings = get_settings()
+
+    def _quota_guard(self, user: User, extra: int) -> dict:
+        return {
+            "$expr": {
+                "$lte": [
+                    {"$add": [
+                        {"$ifNull": ["$storage_used", 0]},
+                        {"$ifNull": ["$storage_reserved", 0]},
+                        extra
+                    ]},
+                    user.storage_limit
+                ]
+            }
+        }
+
+    async def _inc(self, user: User, inc: Dict[str, int], guard_extra: int = 0) -> bool:
+        query = {"_id": user.id}
+        if guard_extra > 0:
+            query.update(self._quota_guard(user, guard_extra))
+        result = await User.get_pymongo_collection().update_one(query, {"$inc": inc})
+        return result.matched_count > 0
+
+    async def reserve(self, user: User, uploads: List[dict]) -> List[UploadReservation]:
+        """Reserves quota for pending uploads and records them.
+
+        Each item carries `resource_id`, `parent_id`, `name`, `s3_key` and `size`.
+        """
+        total = sum(u["size"] for u in uploads)
+        if total > 0 and not await self._inc(user, {"storage_reserved": total}, guard_extra=total):
+            raise HTTPException(status_code=403, detail="Storage quota exceeded. Upgrade your plan.")
+
+        expires_at = datetime.now() + timedelta(seconds=self.settings.upload_reservation_ttl_seconds)
+        reservations = [
+            UploadReservation(user_id=user.id, expires_at=expires_at, **upload)
+            for upload in uploads
+        ]
+
+        try:
+            if reservations:
+                await UploadReservation.insert_many(reservations)
+        except Exception:
+            await self._inc(user, {"storage_reserved": -total})
+            raise
+        user.storage_reserved += total
+        return reservations
+
+    async def consume(self, user: User, size: int):
+        """Adds usage that was never reserved, e.g. server-side copies."""
+        if size <= 0:
+            return
+        if not await self._inc(user, {"storage_used": size}, guard_extra=size):
+            raise HTTPException(status_code=403, detail="Storage quota exceeded. Upgrade your plan.")
+        user.storage_used += size
+
+    async def release_usage(self, user_id: PydanticObjectId, size: int):
+        """Takes `size` bytes off committed usage, never below zero.
+
+        Usage recorded before sizes were tracked exactly can be smaller than
+        what is deleted or refunded against it.
+        """
+        if size <= 0:
+            return
+        await User.get_pymongo_collection().update_one(
+            {"_id": user_id},
+            [{"$set": {"storage_used": {"$max": [0, {"$subtract": [{"$ifNull": ["$storage_used", 0]}, size]}]}}}]
+        )
+
+    async def refund(self, user: User, size: int):
+        if size <= 0:
+            return
+        await self.release_usage(user.id, size)
+        user.storage_used = max(0, user.storage_used - size)
+
+    async def claim(self, user: User, resource_ids: List[PydanticObjectId]) -> Tuple[str, Dict[PydanticObjectId, UploadReservation]]:
+        """Takes exclusive ownership of the pending reservations for `resource_ids`."""
+        token = uuid.uuid4().hex
+        await UploadReservation.find(
+            {"resource_id": {"$in": resource_ids}, "user_id": user.id, "claim_token": None}
+        ).update(
+            {"$set": {"claim_token": token, "claimed_at": datetime.now()}}
+        )
+        claimed = await UploadReservation.find(UploadReservation.claim_token == token).to_list()
+        return token, {r.resource_id: r for r in claimed}
+
+    async def commit(self, user: User, size: int, reserved: int, token: Optional[str] = None) -> bool:
+        """Turns `reserved` bytes into `size` bytes of committed usage.
+
+        Only the part of `size` that exceeds the reservation is checked
+        against the limit. On failure claimed reservations are put back.
+        """
+        inc = {"storage_used": size}
+        if reserved:
+            inc["storage_reserved"] = -reserved
+
+        if not await self._inc(user, inc, guard_extra=size - reserved):
+            if token:
+                await UploadReservation.find(UploadReservation.claim_token == token).update(
+                    {"$set": {"claim_token": None, "claimed_at": None}}
+                )
+            return False
+
+        if token:
+            await UploadReservation.find(UploadReservation.claim_token == token).delete()
+        user.storage_used += size
+        user.storage_reserved -= reserved
+        return True
+
+    async def release_expired(self) -> dict:
+        now = datetime.now()
+        token = uuid.uuid4().hex
+        await UploadReservation.find(
+            {"$or": [
+                {"expires_at": {"$lt": now}, "claim_token": None},
+                {"claimed_at": {"$lt": now - timedelta(seconds=STALE_CLAIM_SECONDS)}}
+            ]}
+        ).update(
+            {"$set": {"claim_token": token, "claimed_at": now}}
+        )
+
+        pipeline = [
+            {"$match": {"claim_token": token}},
+            {"$group": {"_id": "$user_id", "size": {"$sum": "$size"}, "count": {"$sum": 1}}}
+        ]
+        cursor = UploadReservation.get_pymongo_collection().aggregate(pipeline)
+        per_user = await cursor.to_list(length=None)
+
+        released = 0
+        for row in per_user:
+            if row["size"] > 0:
+                await User.get_pymongo_collection().update_one(
+                    {"_id": row["_id"]}, {"$inc": {"storage_reserved": -row["size"]}}
+                )
+            released += row["count"]
+
+        await UploadReservation.find(UploadReservation.claim_token == token).delete()
+        if released:
+            logger.info(f"Released {released} expired upload reservations for {len(per_user)} users")
+        return {"released": released}
+
+quota_service = QuotaService()
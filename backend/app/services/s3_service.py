@@ -1,20 +1,51 @@
-import boto3
-from botocore.config import Config
+from functools import cached_property, wraps
 from app.core.config import get_settings
+from app.core.metrics import timed_dependency
+from app.services.storage_backend import StorageBackend, ObjectNotFound, PreconditionFailed
 
 settings = get_settings()
 
-class S3Service:
+NOT_FOUND_CODES = ("404", "NoSuchKey", "NotFound")
+PRECONDITION_CODES = ("412", "PreconditionFailed", "ConditionalRequestConflict")
+
+def translate_errors(func):
+    """Raises the backend-neutral errors for missing objects and failed conditions."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            # botocore's ClientError, matched by shape so botocore is only
+            # imported along with the client.
+            response = getattr(e, "response", None)
+            code = response.get("Error", {}).get("Code") if isinstance(response, dict) else None
+            if code in NOT_FOUND_CODES:
+                raise ObjectNotFound(str(e)) from e
+            if code in PRECONDITION_CODES:
+                raise PreconditionFailed(str(e)) from e
+            raise
+    return wrapper
+
+class S3Service(StorageBackend):
     def __init__(self):
-        self.client = boto3.client(
+        if not settings.s3_bucket_name:
+            raise RuntimeError("S3_BUCKET_NAME is required with STORAGE_BACKEND=s3")
+        self.bucket = settings.s3_bucket_name
+
+    @cached_property
+    def client(self):
+        # Built on first use: importing boto3 and loading its service models
+        # is one of the slowest parts of worker startup.
+        import boto3
+        from botocore.config import Config
+        return boto3.client(
             's3',
             aws_access_key_id=settings.aws_access_key_id,
             aws_secret_access_key=settings.aws_secret_access_key,
             region_name=settings.aws_region,
-            endpoint_url=f'https://s3.{settings.aws_region}.amazonaws.com',
+            endpoint_url=settings.s3_endpoint_url or f'https://s3.{settings.aws_region}.amazonaws.com',
             config=Config(signature_version='s3v4',s3={'addressing_style': 'path'})
         )
-        self.bucket = settings.s3_bucket_name
 
     def generate_presigned_url(self, key: str, file_type: str, expiration=3600) -> str:
         return self.client.generate_presigned_url(
@@ -27,10 +58,20 @@ class S3Service:
             ExpiresIn=expiration
         )
 
+    @timed_dependency("s3")
+    @translate_errors
     def delete_file(self, key: str):
         if key:
             self.client.delete_object(Bucket=self.bucket, Key=key)
 
+    @timed_dependency("s3")
+    @translate_errors
+    def copy_object(self, source_key: str, key: str, if_match: str = None) -> str:
+        params = {'Bucket': self.bucket, 'Key': key, 'CopySource': {'Bucket': self.bucket, 'Key': source_key}}
+        if if_match:
+            params['CopySourceIfMatch'] = if_match
+        return self.client.copy_object(**params)['CopyObjectResult']['ETag']
+
     def generate_presigned_download_url(self, key: str, disposition: str = "attachment", expiration=3600) -> str:
         return self.client.generate_presigned_url(
             'get_object',
@@ -42,22 +83,72 @@ class S3Service:
             ExpiresIn=expiration
         )
 
-    def upload_bytes(self, key: str, data: bytes):
-        self.client.put_object(
+    @timed_dependency("s3")
+    @translate_errors
+    def upload_bytes(self, key: str, data: bytes, if_match: str = None, content_type: str = None):
+        params = {'Bucket': self.bucket, 'Key': key, 'Body': data}
+        if if_match:
+            params['IfMatch'] = if_match
+        if content_type:
+            params['ContentType'] = content_type
+        self.client.put_object(**params)
+
+    @timed_dependency("s3")
+    @translate_errors
+    def get_object_bytes(self, key: str) -> tuple:
+        response = self.client.get_object(Bucket=self.bucket, Key=key)
+        return response['Body'].read(), response['ETag']
+
+    @timed_dependency("s3")
+    @translate_errors
+    def create_multipart_upload(self, key: str) -> str:
+        response = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)
+        return response['UploadId']
+
+    @timed_dependency("s3")
+    @translate_errors
+    def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> dict:
+        response = self.client.upload_part(
             Bucket=self.bucket,
             Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
             Body=data
         )
+        return {'ETag': response['ETag'], 'PartNumber': part_number}
 
+    @timed_dependency("s3")
+    @translate_errors
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: list):
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+
+    @timed_dependency("s3")
+    @translate_errors
+    def abort_multipart_upload(self, key: str, upload_id: str):
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+
+    @timed_dependency("s3")
+    @translate_errors
     def download_file(self, key: str, destination_path: str):
         self.client.download_file(self.bucket, key, destination_path)
 
+    @timed_dependency("s3")
+    @translate_errors
     def get_object_stream(self, key: str):
         return self.client.get_object(Bucket=self.bucket, Key=key)['Body']
 
+    @timed_dependency("s3")
+    @translate_errors
     def head_object(self, key: str) -> dict:
         return self.client.head_object(Bucket=self.bucket, Key=key)
 
+    @timed_dependency("s3")
+    @translate_errors
     def list_objects(self, prefix: str = "") -> list:
         paginator = self.client.get_paginator('list_objects_v2')
         pages = paginator.paginate(Bucket=self.bucket, Prefix=prefix)
@@ -72,5 +163,3 @@ class S3Service:
                         'Size': obj['Size']
                     })
         return objects
-
-s3_service = S3Service()
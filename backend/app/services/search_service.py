@@ -0,0 +1,123 @@
+from fastapi import HTTPException
+from typing import List, Optional
+from beanie import PydanticObjectId
+from bson import ObjectId
+from bson.errors import InvalidId
+from app.models.user import User
+from app.models.resource import Resource, normalize_name, query_ngrams
+from app.services.permission_service import permission_service
+from app.services.tree_cache_service import tree_cache_service
+from app.services import serializers
+from app.core.database import read_collection
+
+SEARCH_PROJECTION = {**serializers.RESOURCE_RESPONSE_PROJECTION, "owner_id": 1}
+# Upper bound on index candidates examined for one page, so a query that
+# matches lots of inaccessible or false-positive documents still returns
+# promptly; the client continues from `next_cursor`.
+MAX_SCANNED_PER_PAGE = 5000
+
+class SearchService:
+    async def _candidate_owners(self, current_user: User) -> List[PydanticObjectId]:
+        """Owners whose resources can be visible to the user.
+
+        That is the user, everyone who shared something with them, and the
+        editors of those shares, who own whatever they uploaded into them.
+        """
+        collection = read_collection(Resource)
+        sharers = await collection.distinct(
+            "owner_id", {"shared_with.user_id": current_user.id, "is_deleted": {"$ne": True}}
+        )
+        owners = {current_user.id, *sharers}
+        editors = await collection.distinct(
+            "shared_with.user_id",
+            {"owner_id": {"$in": list(owners)}, "shared_with.type": "editor", "is_deleted": {"$ne": True}}
+        )
+        owners.update(editors)
+        return list(owners)
+
+    def _breadcrumbs(self, chain: List[dict], current_user: User) -> Optional[List[dict]]:
+        """Path from the topmost folder the user can see down to the parent.
+
+        Returns None when nothing in the chain grants access.
+        """
+        top = None
+        for index, node in enumerate(chain):
+            if permission_service.check_chain_access([node], current_user):
+                top = index
+        if top is None:
+            return None
+        return [{"id": str(node["_id"]), "name": node.get("name")} for node in reversed(chain[1:top + 1])]
+
+    async def search(self, query: str, current_user: User, prefix: bool = False, limit: int = 50, cursor: Optional[str] = None) -> dict:
+        """Name search across everything the user owns or can reach via a share.
+
+        Candidates come from the `name_ngrams` index, newest first, and are
+        confirmed against the normalized name. Results are paginated by the
+        id of the last examined document.
+        """
+        needle = normalize_name(query.strip())
+        if not needle:
+            raise HTTPException(status_code=400, detail="Query is empty")
+
+        match = {
+            "owner_id": {"$in": await self._candidate_owners(current_user)},
+            "name_ngrams": {"$all": query_ngrams(needle)},
+            "is_deleted": {"$ne": True},
+        }
+        if cursor:
+            try:
+                match["_id"] = {"$lt": ObjectId(cursor)}
+            except InvalidId:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+
+        recent_write = await tree_cache_service.recently_written(current_user.id)
+        collection = read_collection(Resource, allow_secondary=not recent_write)
+
+        results = []
+        scanned = 0
+        last_id = None
+        exhausted = False
+        page_full = False
+        batch_size = min(limit * 2, 1000)
+        while len(results) < limit and scanned < MAX_SCANNED_PER_PAGE:
+            if last_id is not None:
+                match["_id"] = {"$lt": last_id}
+            batch = await collection.find(match, SEARCH_PROJECTION).sort("_id", -1).limit(batch_size).to_list(length=None)
+            if len(batch) < batch_size:
+                exhausted = True
+
+            # Every gram being present does not mean the query is, so confirm
+            # on the name itself before paying for the ancestry lookup.
+            hits = []
+            for doc in batch:
+                name = normalize_name(doc["name"])
+                if name.startswith(needle) if prefix else needle in name:
+                    hits.append(doc)
+            chains = await permission_service.get_ancestor_chains([doc["_id"] for doc in hits])
+            hit_ids = {doc["_id"] for doc in hits}
+
+            for doc in batch:
+                scanned += 1
+                last_id = doc["_id"]
+                if doc["_id"] in hit_ids:
+                    chain = chains.get(doc["_id"], [doc])
+                    # Deleting a folder only flags the folder itself until
+                    # cleanup reaches its contents.
+                    if any(node.get("is_deleted") for node in chain):
+                        continue
+                    path = self._breadcrumbs(chain, current_user)
+                    if path is not None:
+                        results.append({**serializers.resource_doc(doc), "path": path})
+                        if len(results) == limit:
+                            page_full = doc is not batch[-1]
+                            break
+            if exhausted:
+                break
+
+        more = page_full or not exhausted
+        return {
+            "results": results,
+            "next_cursor": str(last_id) if more and last_id is not None else None
+        }
+
+search_service = SearchService()
@@ -0,0 +1,69 @@
+from typing import Iterable, List
+from app.models.resource import Resource
+from app.services.preview_service import preview_service
+
+# Fields needed to build a ResourceResponse; `_id` is always returned.
+RESOURCE_RESPONSE_PROJECTION = {
+    "name": 1,
+    "type": 1,
+    "s3_key": 1,
+    "parent_id": 1,
+    "size": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "shared_with": 1,
+    "content_version": 1,
+    "preview_type": 1,
+    "preview_s3_key": 1,
+}
+
+def resource_doc(doc: dict) -> dict:
+    """ResourceResponse-shaped dict from a raw (projected) Mongo document."""
+    parent_id = doc.get("parent_id")
+    return {
+        "id": str(doc["_id"]),
+        "name": doc["name"],
+        "type": doc["type"],
+        "s3_key": doc.get("s3_key"),
+        "parent_id": str(parent_id) if parent_id else None,
+        "size": doc.get("size", 0),
+        "created_at": doc.get("created_at"),
+        "updated_at": doc.get("updated_at"),
+        "shared_with": [
+            {"user_id": str(p["user_id"]), "username": p["username"], "type": p.get("type", "read")}
+            for p in doc.get("shared_with") or []
+        ],
+        "content_version": doc.get("content_version", 0),
+        "preview_type": doc.get("preview_type"),
+        "preview_url": preview_service.preview_url(doc.get("preview_s3_key")),
+    }
+
+def resource_model(resource: Resource) -> dict:
+    """ResourceResponse-shaped dict from an already validated Resource."""
+    return {
+        "id": str(resource.id),
+        "name": resource.name,
+        "type": resource.type.value,
+        "s3_key": resource.s3_key,
+        "parent_id": str(resource.parent_id) if resource.parent_id else None,
+        "size": resource.size,
+        "created_at": resource.created_at,
+        "updated_at": resource.updated_at,
+        "shared_with": [
+            {"user_id": str(p.user_id), "username": p.username, "type": p.type}
+            for p in resource.shared_with
+        ],
+        "content_version": resource.content_version,
+        "preview_type": resource.preview_type,
+        "preview_url": preview_service.preview_url(resource.preview_s3_key),
+    }
+
+def resources(items: Iterable) -> List[dict]:
+    return [resource_model(r) if isinstance(r, Resource) else resource_doc(r) for r in items]
+
+def tree_delta(delta: dict) -> dict:
+    return {
+        "added": resources(delta.get("added", [])),
+        "updated": resources(delta.get("updated", [])),
+        "deleted": [str(rid) for rid in delta.get("deleted", [])],
+    }
@@ -0,0 +1,123 @@
+from typing import BinaryIO, List, Optional, Tuple
+from abc import ABC, abstractmethod
+from app.core.config import get_settings
+import hashlib
+import re
+
+settings = get_settings()
+
+OBJECT_ID = re.compile(r"^[0-9a-f]{24}$")
+SHARD = re.compile(r"^[0-9a-f]{1,16}$")
+
+
+class ObjectNotFound(Exception):
+    pass
+
+
+class PreconditionFailed(Exception):
+    """A conditional write or copy found the object changed."""
+
+
+def key_shard(resource_id) -> str:
+    return hashlib.md5(str(resource_id).encode()).hexdigest()[:settings.s3_key_shard_chars]
+
+def build_s3_key(owner_id, resource_id, file_name: str) -> str:
+    """Object key for an upload under the configured S3_KEY_LAYOUT.
+
+    "flat" is `{owner_id}/{resource_id}/{file_name}`. "hashed" puts a short
+    hash of the resource id in front, so one user's objects spread over
+    many prefixes instead of sharing one prefix's request rate.
+    """
+    if settings.s3_key_layout == "hashed":
+        return f"{key_shard(resource_id)}/{owner_id}/{resource_id}/{file_name}"
+    return f"{owner_id}/{resource_id}/{file_name}"
+
+def current_layout_pattern() -> re.Pattern:
+    """Matches keys already in the configured layout."""
+    if settings.s3_key_layout == "hashed":
+        return re.compile(rf"^[0-9a-f]{{{settings.s3_key_shard_chars}}}/[0-9a-f]{{24}}/")
+    return re.compile(r"^[0-9a-f]{24}/[0-9a-f]{24}/")
+
+def parse_s3_key(key: str) -> Optional[Tuple[str, str, str]]:
+    """(owner_id, resource_id, file_name) of a key in either layout, None for other keys."""
+    parts = key.split("/", 3)
+    if len(parts) >= 3 and OBJECT_ID.match(parts[0]) and OBJECT_ID.match(parts[1]):
+        return parts[0], parts[1], "/".join(parts[2:])
+    if len(parts) == 4 and SHARD.match(parts[0]) and OBJECT_ID.match(parts[1]) and OBJECT_ID.match(parts[2]):
+        return parts[1], parts[2], parts[3]
+    return None
+
+def current_s3_key(key: str) -> str:
+    """Where `key` lives under the configured layout; unknown keys stay put."""
+    parsed = parse_s3_key(key)
+    return build_s3_key(*parsed) if parsed else key
+
+
+class StorageBackend(ABC):
+    """Object storage used for file contents and previews.
+
+    Methods block and are called through asyncio.to_thread. Metadata is
+    returned in S3's shape (`ContentLength`, `ETag`, `LastModified`, `Key`,
+    `Size`) whatever the backend. Missing objects raise ObjectNotFound and
+    failed conditions PreconditionFailed.
+    """
+
+    # Bucket storage events must name to be accepted; None if the backend
+    # has no notifications.
+    bucket: Optional[str] = None
+
+    @abstractmethod
+    def generate_presigned_url(self, key: str, file_type: str, expiration=3600) -> str:
+        """URL the browser PUTs the file to."""
+
+    @abstractmethod
+    def generate_presigned_download_url(self, key: str, disposition: str = "attachment", expiration=3600) -> str:
+        ...
+
+    @abstractmethod
+    def delete_file(self, key: str):
+        ...
+
+    @abstractmethod
+    def upload_bytes(self, key: str, data: bytes, if_match: str = None, content_type: str = None):
+        ...
+
+    @abstractmethod
+    def get_object_bytes(self, key: str) -> tuple:
+        """(body, ETag)"""
+
+    @abstractmethod
+    def copy_object(self, source_key: str, key: str, if_match: str = None) -> str:
+        ...
+
+    @abstractmethod
+    def create_multipart_upload(self, key: str) -> str:
+        ...
+
+    @abstractmethod
+    def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> dict:
+        ...
+
+    @abstractmethod
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: list):
+        ...
+
+    @abstractmethod
+    def abort_multipart_upload(self, key: str, upload_id: str):
+        ...
+
+    @abstractmethod
+    def download_file(self, key: str, destination_path: str):
+        ...
+
+    @abstractmethod
+    def get_object_stream(self, key: str) -> BinaryIO:
+        ...
+
+    @abstractmethod
+    def head_object(self, key: str) -> dict:
+        ...
+
+    @abstractmethod
+    def list_objects(self, prefix: str = "") -> List[dict]:
+        ...
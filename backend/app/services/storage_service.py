@@ -0,0 +1,13 @@
+from app.core.config import get_settings
+from app.services.storage_backend import StorageBackend
+
+def create_storage() -> StorageBackend:
+    settings = get_settings()
+    if settings.storage_backend == "filesystem":
+        from app.services.filesystem_storage import FilesystemStorage
+        return FilesystemStorage()
+    from app.services.s3_service import S3Service
+    return S3Service()
+
+# Either backend, picked by STORAGE_BACKEND.
+storage_service = create_storage()
@@ -0,0 +1,249 @@
+from typing import AsyncIterator, Iterable, List, NamedTuple, Optional
+from contextlib import asynccontextmanager
+from app.core.config import get_settings
+from app.core.redis import get_redis
+from app.services.tree_refresh_service import tree_refresh_service
+import asyncio
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+TREE_CACHE_TTL_SECONDS = 300
+# Versions start from the clock, so one that expired comes back as a new,
+# larger value; expiring them only costs clients a full response.
+VERSION_TTL_SECONDS = 24 * 3600
+# The holder renews the rebuild lock while it builds, so this only bounds
+# how long a holder that died keeps waiters from rebuilding themselves.
+TREE_REBUILD_LOCK_SECONDS = 10
+TREE_REBUILD_POLL_SECONDS = 0.05
+
+RELEASE_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+EXTEND_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+class CachedTree(NamedTuple):
+    payload: Optional[str]
+    # Version the payload was built at, and the user's current version.
+    payload_version: Optional[int]
+    version: Optional[int]
+    recent_write: bool
+    # When the payload first became outdated, in epoch seconds.
+    stale_at: Optional[float]
+
+    @property
+    def fresh(self) -> bool:
+        return self.payload is not None and self.payload_version == self.version
+
+    def stale_for(self, now: float) -> Optional[float]:
+        if self.payload is None or self.fresh or self.stale_at is None:
+            return None
+        return now - self.stale_at
+
+class TreeCacheService:
+    """Per-user tree cache and listing versions in Redis.
+
+    Every mutation bumps the version of the owner's tree and of the folders
+    whose listings changed. Versions back the ETags on /tree and
+    /folders/{id}, and a cached tree is only served while the version it
+    was built at is still current. A missing version starts at the current
+    time in milliseconds, so a flushed Redis cannot hand out a version a
+    client has already seen.
+
+    Every invalidation schedules a background refresh. Changes the user
+    made drop the cached tree, since their client reloads it right away and
+    must see the change. Background ones (finished previews) keep it,
+    marked with when it went stale, and readers get that copy under its
+    own version until the refresh lands.
+
+    Invalidation also leaves a short-lived "recent write" marker, so that
+    while secondary reads are enabled the writer's next reads go to the
+    primary and see their own change.
+    """
+
+    def __init__(self):
+        self.settings = get_settings()
+
+    @property
+    def redis_client(self):
+        return get_redis()
+
+    def _tree_key(self, user_id) -> str:
+        return f"drive:tree:{user_id}"
+
+    def _tree_version_key(self, user_id) -> str:
+        return f"drive:treever:{user_id}"
+
+    def _folder_version_key(self, folder_id) -> str:
+        return f"drive:folderver:{folder_id}"
+
+    def _write_key(self, user_id) -> str:
+        return f"drive:wrote:{user_id}"
+
+    def _lock_key(self, user_id) -> str:
+        return f"drive:treelock:{user_id}"
+
+    def _initial_version(self) -> int:
+        return int(time.time() * 1000)
+
+    async def _read_version(self, key: str) -> int:
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.set(key, self._initial_version(), nx=True, ex=VERSION_TTL_SECONDS)
+        pipe.get(key)
+        _, version = await pipe.execute()
+        return int(version)
+
+    async def tree_version(self, user_id) -> Optional[int]:
+        try:
+            return await self._read_version(self._tree_version_key(user_id))
+        except Exception as e:
+            logger.error(f"Redis get error: {e}")
+            return None
+
+    async def folder_version(self, folder_id) -> Optional[int]:
+        try:
+            return await self._read_version(self._folder_version_key(folder_id))
+        except Exception as e:
+            logger.error(f"Redis get error: {e}")
+            return None
+
+    async def get(self, user_id) -> CachedTree:
+        version_key = self._tree_version_key(user_id)
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.set(version_key, self._initial_version(), nx=True, ex=VERSION_TTL_SECONDS)
+            pipe.get(version_key)
+            pipe.hmget(self._tree_key(user_id), "version", "payload", "stale_at")
+            if self.settings.mongo_secondary_reads:
+                pipe.exists(self._write_key(user_id))
+            results = await pipe.execute()
+        except Exception as e:
+            logger.error(f"Redis get error: {e}")
+            return CachedTree(None, None, None, True, None)
+
+        payload_version, payload, stale_at = results[2]
+        return CachedTree(
+            payload=payload if payload_version is not None else None,
+            payload_version=int(payload_version) if payload_version is not None else None,
+            version=int(results[1]),
+            recent_write=bool(results[3]) if self.settings.mongo_secondary_reads else False,
+            stale_at=float(stale_at) if stale_at is not None else None
+        )
+
+    async def set(self, user_id, payload: str, version: Optional[int]):
+        if version is None:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.delete(self._tree_key(user_id))
+            pipe.hset(self._tree_key(user_id), mapping={"version": version, "payload": payload})
+            pipe.expire(self._tree_key(user_id), TREE_CACHE_TTL_SECONDS)
+            await pipe.execute()
+        except Exception as e:
+            logger.error(f"Redis set error: {e}")
+
+    async def invalidate(self, user_id, folder_ids: Iterable = (), keep_stale: bool = False):
+        """Bumps the user's tree version and the listing version of each folder."""
+        initial = self._initial_version()
+        version_keys: List[str] = [self._tree_version_key(user_id)]
+        version_keys.extend(self._folder_version_key(fid) for fid in {fid for fid in folder_ids if fid})
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            if keep_stale:
+                pipe.hsetnx(self._tree_key(user_id), "stale_at", time.time())
+                pipe.expire(self._tree_key(user_id), TREE_CACHE_TTL_SECONDS)
+            else:
+                pipe.delete(self._tree_key(user_id))
+            for key in version_keys:
+                pipe.set(key, initial, nx=True, ex=VERSION_TTL_SECONDS)
+                pipe.incr(key)
+                pipe.expire(key, VERSION_TTL_SECONDS)
+            if self.settings.mongo_secondary_reads:
+                pipe.setex(self._write_key(user_id), self.settings.mongo_max_staleness_seconds, 1)
+            await pipe.execute()
+        except Exception as e:
+            logger.error(f"Redis invalidation error: {e}")
+        tree_refresh_service.schedule(user_id)
+
+    async def acquire_rebuild_lock(self, user_id) -> Optional[str]:
+        """Returns a token if this worker should rebuild, None if another one is.
+
+        Without Redis every worker rebuilds on its own.
+        """
+        token = uuid.uuid4().hex
+        try:
+            if await self.redis_client.set(self._lock_key(user_id), token, nx=True, ex=TREE_REBUILD_LOCK_SECONDS):
+                return token
+            return None
+        except Exception as e:
+            logger.error(f"Redis lock error: {e}")
+            return token
+
+    async def release_rebuild_lock(self, user_id, token: str):
+        try:
+            await self.redis_client.eval(RELEASE_LOCK, 1, self._lock_key(user_id), token)
+        except Exception as e:
+            logger.error(f"Redis unlock error: {e}")
+
+    async def _extend_rebuild_lock(self, user_id, token: str):
+        while True:
+            await asyncio.sleep(TREE_REBUILD_LOCK_SECONDS / 3)
+            try:
+                if not await self.redis_client.eval(EXTEND_LOCK, 1, self._lock_key(user_id), token, int(TREE_REBUILD_LOCK_SECONDS * 1000)):
+                    logger.warning(f"Tree rebuild lock for {user_id} was lost")
+                    return
+            except Exception as e:
+                logger.error(f"Redis lock error: {e}")
+
+    @asynccontextmanager
+    async def holding_rebuild_lock(self, user_id, token: str) -> AsyncIterator[None]:
+        """Keeps the rebuild lock alive while the body runs, then releases it."""
+        renewal = asyncio.ensure_future(self._extend_rebuild_lock(user_id, token))
+        try:
+            yield
+        finally:
+            renewal.cancel()
+            await self.release_rebuild_lock(user_id, token)
+
+    async def wait_for_rebuild(self, user_id, version: int) -> Optional[str]:
+        """Polls until another worker caches the tree at `version` or newer.
+
+        Returns None once the lock is released or expires without that
+        happening, e.g. because the holder failed.
+        """
+        while True:
+            await asyncio.sleep(TREE_REBUILD_POLL_SECONDS)
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.hmget(self._tree_key(user_id), "version", "payload")
+                pipe.exists(self._lock_key(user_id))
+                (cached_version, payload), locked = await pipe.execute()
+            except Exception as e:
+                logger.error(f"Redis get error: {e}")
+                return None
+            if cached_version is not None and int(cached_version) >= version:
+                return payload
+            if not locked:
+                return None
+
+    async def recently_written(self, user_id) -> bool:
+        if not self.settings.mongo_secondary_reads:
+            return False
+        try:
+            return bool(await self.redis_client.exists(self._write_key(user_id)))
+        except Exception as e:
+            logger.error(f"Redis get error: {e}")
+            return True
+
+tree_cache_service = TreeCacheService()
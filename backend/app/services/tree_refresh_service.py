@@ -0,0 +1,99 @@
+from typing import Awaitable, Callable, Dict, Optional
+from app.core.config import get_settings
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+TreeRebuild = Callable[[object], Awaitable[None]]
+
+class TreeRefreshService:
+    """Rebuilds invalidated trees in the background, before anyone asks.
+
+    A refresh is scheduled TREE_REFRESH_DELAY_SECONDS after an invalidation
+    and pushed back by further ones, but never past
+    TREE_REFRESH_MAX_DELAY_SECONDS after the first, so a burst of uploads
+    costs one rebuild. TREE_REFRESH_CONCURRENCY workers per process run the
+    rebuilds, which go through the same single-flight path as requests.
+    """
+
+    def __init__(self):
+        self.settings = get_settings()
+        self.rebuild: Optional[TreeRebuild] = None
+        self.queue: asyncio.Queue = None
+        self.workers = []
+        self.timers: Dict[object, asyncio.TimerHandle] = {}
+        self.first_scheduled: Dict[object, float] = {}
+        self.queued = set()
+
+    def start(self, rebuild: TreeRebuild):
+        if self.workers or not self.settings.tree_refresh_enabled:
+            return
+        self.rebuild = rebuild
+        self.queue = asyncio.Queue()
+        self.workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.settings.tree_refresh_concurrency)
+        ]
+
+    async def stop(self):
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers.clear()
+        self.first_scheduled.clear()
+        self.queued.clear()
+        for task in self.workers:
+            task.cancel()
+        for task in self.workers:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.workers = []
+
+    def schedule(self, user_id, delay: Optional[float] = None):
+        if not self.workers:
+            return
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if delay is None:
+            delay = self.settings.tree_refresh_delay_seconds
+        first = self.first_scheduled.setdefault(user_id, now)
+        due = min(now + delay, first + self.settings.tree_refresh_max_delay_seconds)
+
+        timer = self.timers.pop(user_id, None)
+        if timer:
+            timer.cancel()
+        self.timers[user_id] = loop.call_at(due, self._enqueue, user_id)
+
+    def ensure_scheduled(self, user_id):
+        """Schedules a refresh unless one is already pending here.
+
+        Readers of a stale tree call this in case the worker that scheduled
+        the refresh went away; it never pushes a pending one back.
+        """
+        if user_id in self.timers or user_id in self.queued:
+            return
+        self.schedule(user_id)
+
+    def _enqueue(self, user_id):
+        self.timers.pop(user_id, None)
+        self.first_scheduled.pop(user_id, None)
+        if user_id in self.queued:
+            return
+        self.queued.add(user_id)
+        self.queue.put_nowait(user_id)
+
+    async def _worker(self):
+        while True:
+            user_id = await self.queue.get()
+            self.queued.discard(user_id)
+            try:
+                await self.rebuild(user_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Tree refresh failed for {user_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+tree_refresh_service = TreeRefreshService()
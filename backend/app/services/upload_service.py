@@ -1,39 +1,52 @@
-from typing import List, Dict, Optional
+from typing import Iterable, List, Dict, Optional, Set, Tuple
 from beanie import PydanticObjectId
 from app.models.user import User
 from app.models.resource import Resource, ResourceType
-from app.schemas.resource import FileUploadInit, FileUploadConfirm, BulkFileUploadInit, FileUploadResponse, FileInitItem
+from app.models.upload import UploadReservation
+from app.schemas.resource import FileUploadInit, FileUploadConfirm, BulkFileUploadInit, FileUploadResponse, FileInitItem, BulkFileUploadConfirm
+from app.schemas.storage_event import StorageEventBatch
 from app.services.permission_service import permission_service
-from app.services.s3_service import s3_service
+from app.services.storage_service import storage_service
+from app.services.storage_backend import build_s3_key, parse_s3_key
+from app.services.quota_service import quota_service
+from app.services.preview_service import preview_service
+from app.services.tree_cache_service import tree_cache_service
 from fastapi import HTTPException
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from collections import defaultdict
+from urllib.parse import unquote_plus
+import asyncio
 import logging
 import time
-import os
-import redis.asyncio as redis
 
 logger = logging.getLogger(__name__)
 
+BULK_CONFIRM_HEAD_CONCURRENCY = 32
+DUPLICATE_KEY = 11000
+
 class UploadService:
-    def __init__(self):
-        self.redis_client = redis.Redis(
-            host=os.getenv("REDIS_HOST", "localhost"),
-            port=int(os.getenv("REDIS_PORT", 6379)),
-            password=os.getenv("REDIS_PASSWORD", None),
-            decode_responses=True,
-            ssl=True
-        )
+    async def _invalidate_tree_cache(self, user_id, folder_ids: Iterable = ()):
+        folder_ids = {fid for fid in folder_ids if fid}
+        await tree_cache_service.invalidate(user_id, folder_ids)
+        # A change inside someone else's shared folder changes their tree too.
+        for owner_id in await permission_service.drive_owners(folder_ids) - {user_id}:
+            await tree_cache_service.invalidate(owner_id)
 
-    async def _invalidate_tree_cache(self, user_id):
-        try:
-            await self.redis_client.delete(f"drive:tree:{user_id}")
-        except Exception as e:
-            logger.error(f"Redis invalidation error: {e}")
+    async def _discard_folders(self, current_user: User, folders: List[Resource]):
+        """Removes folders made for an upload whose reservation was refused;
+        nothing will be uploaded into them."""
+        if not folders:
+            return
+        await Resource.find({"_id": {"$in": [f.id for f in folders]}}).delete()
+        await self._invalidate_tree_cache(current_user.id, {f.parent_id for f in folders})
 
     async def init_upload(self, upload_in: FileUploadInit, current_user: User) -> dict:
         if ".." in upload_in.file_name or (upload_in.relative_path and ".." in upload_in.relative_path):
              raise HTTPException(status_code=400, detail="Invalid file path")
         
-        if current_user.storage_used + upload_in.size > current_user.storage_limit:
+        # Fast rejection on the snapshot loaded at auth time; the authoritative
+        # check is the atomic reservation below.
+        if current_user.storage_used + current_user.storage_reserved + upload_in.size > current_user.storage_limit:
              raise HTTPException(status_code=403, detail="Storage quota exceeded. Upgrade your plan.")
         
         target_parent_id = upload_in.parent_id
@@ -45,6 +58,7 @@ class UploadService:
             else:
                  raise HTTPException(status_code=404, detail="Parent folder not found")
 
+        created_folders = []
         if upload_in.relative_path and "/" in upload_in.relative_path:
             path_segments = upload_in.relative_path.split("/")[:-1]
             
@@ -67,13 +81,27 @@ class UploadService:
                         owner_id=current_user.id
                     )
                     await new_folder.create()
+                    created_folders.append(new_folder)
+                    await self._invalidate_tree_cache(current_user.id, [target_parent_id]) # Invalidate on folder creation
                     target_parent_id = new_folder.id
-                    await self._invalidate_tree_cache(current_user.id) # Invalidate on folder creation
     
         resource_id = PydanticObjectId()
         
-        s3_key = f"{current_user.id}/{resource_id}/{upload_in.file_name}"    
-        url = s3_service.generate_presigned_url(s3_key, upload_in.file_type)
+        s3_key = build_s3_key(current_user.id, resource_id, upload_in.file_name)
+
+        try:
+            await quota_service.reserve(current_user, [{
+                "resource_id": resource_id,
+                "parent_id": target_parent_id,
+                "name": upload_in.file_name,
+                "s3_key": s3_key,
+                "size": upload_in.size
+            }])
+        except HTTPException:
+            await self._discard_folders(current_user, created_folders)
+            raise
+
+        url = storage_service.generate_presigned_url(s3_key, upload_in.file_type)
         
         return {
             "url": url,
@@ -82,12 +110,12 @@ class UploadService:
             "actual_parent_id": target_parent_id
         }
 
-    async def init_upload_bulk(self, bulk_in: BulkFileUploadInit, current_user: User) -> List[FileUploadResponse]:
+    async def init_upload_bulk(self, bulk_in: BulkFileUploadInit, current_user: User) -> dict:
         start_time = time.time()
         file_count = len(bulk_in.files)
         total_size = sum(f.size for f in bulk_in.files)
         
-        if current_user.storage_used + total_size > current_user.storage_limit:
+        if current_user.storage_used + current_user.storage_reserved + total_size > current_user.storage_limit:
              raise HTTPException(status_code=403, detail="Storage quota exceeded. Upgrade your plan.")
 
         logger.info(f"Starting bulk upload init for {file_count} files. Total size: {total_size}. User: {current_user.id}")
@@ -189,9 +217,10 @@ class UploadService:
                     resolved_ids[path] = res.id
             
         if new_folders_created > 0:
-            await self._invalidate_tree_cache(current_user.id)
+            await self._invalidate_tree_cache(current_user.id, {res.parent_id for res in all_created_resources})
 
         responses = []
+        reservations = []
         for index, file_item in enumerate(bulk_in.files):
             target_parent_id = bulk_in.parent_id
             parent_path = file_parent_map.get(index)
@@ -200,17 +229,30 @@ class UploadService:
                 target_parent_id = resolved_ids.get(parent_path, bulk_in.parent_id)
 
             resource_id = PydanticObjectId()
-            s3_key = f"{current_user.id}/{resource_id}/{file_item.file_name}"    
+            s3_key = build_s3_key(current_user.id, resource_id, file_item.file_name)
             
-            url = s3_service.generate_presigned_url(s3_key, file_item.file_type)
+            url = storage_service.generate_presigned_url(s3_key, file_item.file_type)
+            reservations.append({
+                "resource_id": resource_id,
+                "parent_id": target_parent_id,
+                "name": file_item.file_name,
+                "s3_key": s3_key,
+                "size": file_item.size
+            })
             
-            responses.append(FileUploadResponse(
-                url=url,
-                resource_id=resource_id,
-                s3_key=s3_key,
-                actual_parent_id=target_parent_id
-            ))
+            responses.append({
+                "url": url,
+                "resource_id": resource_id,
+                "s3_key": s3_key,
+                "actual_parent_id": target_parent_id
+            })
             
+        try:
+            await quota_service.reserve(current_user, reservations)
+        except HTTPException:
+            await self._discard_folders(current_user, all_created_resources)
+            raise
+
         duration = time.time() - start_time
         return {
             "files": responses,
@@ -229,13 +271,16 @@ class UploadService:
             else:
                 raise HTTPException(status_code=404, detail="Parent folder not found")
 
+        if await self._foreign_keys(current_user, [confirm_in]):
+            raise HTTPException(status_code=400, detail="Object key was not reserved for this upload")
+
         try:
-             s3_meta = s3_service.head_object(confirm_in.s3_key)
-             if s3_meta['ContentLength'] != confirm_in.size:
-                 pass
+             s3_meta = await asyncio.to_thread(storage_service.head_object, confirm_in.s3_key)
         except Exception as e:
              logger.error(f"S3 Verification Failed: {str(e)}")
              raise HTTPException(status_code=400, detail="File verification failed. File not found in storage.")
+        # Usage is charged for what was stored, not what the client declared.
+        size = s3_meta['ContentLength']
 
         new_file = Resource(
             id=confirm_in.resource_id, 
@@ -244,14 +289,238 @@ class UploadService:
             s3_key=confirm_in.s3_key,
             parent_id=confirm_in.parent_id,
             owner_id=current_user.id,
-            size=confirm_in.size
+            size=size
         )
-        await new_file.create()
-        
-        current_user.storage_used += confirm_in.size
-        await current_user.save()
-        
-        await self._invalidate_tree_cache(current_user.id)
+        try:
+            await new_file.create()
+        except DuplicateKeyError:
+            # Already confirmed, e.g. by the storage event for this upload.
+            existing = await Resource.get(confirm_in.resource_id)
+            if existing and existing.owner_id == current_user.id:
+                return existing
+            raise HTTPException(status_code=409, detail="Upload already confirmed")
+
+        token, claimed = await quota_service.claim(current_user, [confirm_in.resource_id])
+        reservation = claimed.get(confirm_in.resource_id)
+        reserved = reservation.size if reservation else 0
+        if not await quota_service.commit(current_user, size, reserved, token):
+            await new_file.delete()
+            raise HTTPException(status_code=403, detail="Storage quota exceeded. Upgrade your plan.")
+
+        await self._invalidate_tree_cache(current_user.id, [confirm_in.parent_id])
+        preview_service.enqueue(new_file)
         return new_file
 
+    async def _foreign_keys(self, current_user: User, items: List[FileUploadConfirm]) -> Set[PydanticObjectId]:
+        """Ids of items whose s3_key is not the one reserved for them.
+
+        Without a reservation (expired, or swept), the key must still be in
+        the user's own prefix under the item's resource id.
+        """
+        reservations = await UploadReservation.find(
+            {"resource_id": {"$in": [item.resource_id for item in items]}, "user_id": current_user.id}
+        ).to_list()
+        reserved_keys = {r.resource_id: r.s3_key for r in reservations}
+        foreign = set()
+        for item in items:
+            expected = reserved_keys.get(item.resource_id)
+            if expected is not None:
+                if item.s3_key != expected:
+                    foreign.add(item.resource_id)
+                continue
+            parsed = parse_s3_key(item.s3_key)
+            if parsed is None or parsed[:2] != (str(current_user.id), str(item.resource_id)):
+                foreign.add(item.resource_id)
+        return foreign
+
+    async def _insert_files(self, files: List[Resource]) -> List[Resource]:
+        """Inserts what it can; files confirmed concurrently elsewhere are dropped."""
+        try:
+            await Resource.insert_many(files, ordered=False)
+            return files
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != DUPLICATE_KEY for err in write_errors):
+                raise
+            duplicates = {files[err["index"]].id for err in write_errors}
+            return [f for f in files if f.id not in duplicates]
+
+    async def _finalize_confirmed(
+        self,
+        current_user: User,
+        files: List[Resource],
+        errors: Dict[PydanticObjectId, str],
+        claim: Optional[Tuple[str, Dict[PydanticObjectId, UploadReservation]]] = None
+    ) -> Tuple[List[Resource], List[Resource]]:
+        """Inserts confirmed files and turns their reservations into usage.
+
+        Reservations are claimed before inserting (or were by the caller), so
+        a browser confirm racing an event confirm cannot both release the
+        same reservation: whoever loses the insert still hands back the
+        reservation it holds, and whoever loses the claim commits with none.
+        Returns the files inserted here and those that already existed.
+        """
+        if not files and not claim:
+            return [], []
+        token, claimed = claim or await quota_service.claim(current_user, [f.id for f in files])
+
+        inserted = await self._insert_files(files) if files else []
+        inserted_ids = {f.id for f in inserted}
+        duplicate_ids = [f.id for f in files if f.id not in inserted_ids]
+        already = await Resource.find(
+            {"_id": {"$in": duplicate_ids}, "owner_id": current_user.id}
+        ).to_list() if duplicate_ids else []
+
+        total_size = sum(f.size for f in inserted)
+        total_reserved = sum(r.size for r in claimed.values())
+        if not await quota_service.commit(current_user, total_size, total_reserved, token):
+            await Resource.find({"_id": {"$in": list(inserted_ids)}}).delete()
+            for f in inserted:
+                errors[f.id] = "Storage quota exceeded. Upgrade your plan."
+            return [], already
+
+        if inserted:
+            await self._invalidate_tree_cache(current_user.id, {f.parent_id for f in inserted})
+            for f in inserted:
+                preview_service.enqueue(f)
+        return inserted, already
+
+    async def confirm_upload_bulk(self, bulk_in: BulkFileUploadConfirm, current_user: User) -> dict:
+        start_time = time.time()
+        errors: Dict[PydanticObjectId, str] = {}
+
+        parent_ids = list({item.parent_id for item in bulk_in.files})
+        parents = await Resource.find(
+            {"_id": {"$in": parent_ids}},
+            Resource.is_deleted != True
+        ).to_list()
+        writable = await permission_service.filter_accessible(parents, current_user, write=True)
+        found_parent_ids = {p.id for p in parents}
+        writable_parent_ids = {p.id for p in writable}
+
+        confirmed_ids = set(await Resource.distinct(
+            "_id", {"_id": {"$in": [item.resource_id for item in bulk_in.files]}}
+        ))
+
+        foreign = await self._foreign_keys(current_user, bulk_in.files)
+
+        candidates = []
+        seen = set()
+        for item in bulk_in.files:
+            if item.resource_id in foreign:
+                errors[item.resource_id] = "Object key was not reserved for this upload"
+            elif item.parent_id not in found_parent_ids:
+                errors[item.resource_id] = "Parent folder not found"
+            elif item.parent_id not in writable_parent_ids:
+                errors[item.resource_id] = "Write access denied"
+            elif item.resource_id in confirmed_ids or item.resource_id in seen:
+                errors[item.resource_id] = "Upload already confirmed"
+            else:
+                seen.add(item.resource_id)
+                candidates.append(item)
+
+        semaphore = asyncio.Semaphore(BULK_CONFIRM_HEAD_CONCURRENCY)
+
+        async def stored_size(item: FileUploadConfirm) -> Optional[int]:
+            async with semaphore:
+                try:
+                    return (await asyncio.to_thread(storage_service.head_object, item.s3_key))["ContentLength"]
+                except Exception as e:
+                    logger.error(f"S3 Verification Failed for {item.s3_key}: {str(e)}")
+                    return None
+
+        sizes = await asyncio.gather(*(stored_size(item) for item in candidates))
+
+        new_files = []
+        for item, size in zip(candidates, sizes):
+            if size is None:
+                errors[item.resource_id] = "File verification failed. File not found in storage."
+                continue
+            new_files.append(Resource(
+                id=item.resource_id,
+                name=item.name,
+                type=ResourceType.FILE,
+                s3_key=item.s3_key,
+                parent_id=item.parent_id,
+                owner_id=current_user.id,
+                size=size
+            ))
+
+        new_files, already = await self._finalize_confirmed(current_user, new_files, errors)
+
+        created = {f.id: f for f in new_files + already}
+        results = []
+        for item in bulk_in.files:
+            if item.resource_id in created:
+                results.append({"resource_id": item.resource_id, "success": True, "resource": created[item.resource_id]})
+            else:
+                results.append({"resource_id": item.resource_id, "success": False, "error": errors.get(item.resource_id)})
+
+        duration = time.time() - start_time
+        logger.info(f"Bulk confirm of {len(bulk_in.files)} files finished in {duration:.2f}s. Confirmed: {len(new_files)}")
+        return {"results": results}
+
+    async def confirm_from_events(self, batch: StorageEventBatch) -> dict:
+        """Confirms pending uploads from S3 ObjectCreated notifications.
+
+        The upload reservation recorded at init time supplies the owner,
+        parent and name; the event supplies the stored size, so no
+        head_object is needed. Keys without an unclaimed reservation
+        (already confirmed, or not an upload) are ignored, which makes
+        redelivered events harmless.
+        """
+        bucket = storage_service.bucket
+        sizes: Dict[str, int] = {}
+        for record in batch.records:
+            if record.event_name.startswith("ObjectCreated") and record.s3.bucket.name == bucket:
+                # Keys in S3 events are URL-encoded, with spaces as '+'.
+                sizes[unquote_plus(record.s3.object.key)] = record.s3.object.size
+        if not sizes:
+            return {"received": len(batch.records), "confirmed": 0}
+
+        reservations = await UploadReservation.find(
+            {"s3_key": {"$in": list(sizes)}, "claim_token": None}
+        ).to_list()
+        by_user: Dict[PydanticObjectId, List[UploadReservation]] = defaultdict(list)
+        for reservation in reservations:
+            by_user[reservation.user_id].append(reservation)
+
+        users = await User.find({"_id": {"$in": list(by_user)}}).to_list() if by_user else []
+        # Uploads initiated without a parent go to the user's root folder.
+        roots = {user.id: user.root_id for user in users}
+        parent_ids = list({r.parent_id or roots.get(r.user_id) for r in reservations} - {None})
+        live_parents = set(await Resource.distinct(
+            "_id", {"_id": {"$in": parent_ids}, "is_deleted": {"$ne": True}}
+        )) if parent_ids else set()
+
+        confirmed = 0
+        for user in users:
+            token, claimed = await quota_service.claim(user, [r.resource_id for r in by_user[user.id]])
+            if not claimed:
+                continue
+            existing = set(await Resource.distinct("_id", {"_id": {"$in": list(claimed)}}))
+            files = [
+                Resource(
+                    id=r.resource_id,
+                    name=r.name,
+                    type=ResourceType.FILE,
+                    s3_key=r.s3_key,
+                    parent_id=r.parent_id or user.root_id,
+                    owner_id=user.id,
+                    size=sizes[r.s3_key]
+                )
+                for r in claimed.values()
+                if r.resource_id not in existing and (r.parent_id or user.root_id) in live_parents
+            ]
+            # Reservations that are not turned into files (parent deleted,
+            # already confirmed) are released by the same commit.
+            errors: Dict[PydanticObjectId, str] = {}
+            inserted, _ = await self._finalize_confirmed(user, files, errors, claim=(token, claimed))
+            confirmed += len(inserted)
+            for resource_id, error in errors.items():
+                logger.warning(f"Event confirm of {resource_id} failed: {error}")
+
+        logger.info(f"Storage events: {len(batch.records)} records, {confirmed} uploads confirmed")
+        return {"received": len(batch.records), "confirmed": confirmed}
+
 upload_service = UploadService()
@@ -0,0 +1,48 @@
+"""Compare two benchmark reports produced by ``benchmarks.run``.
+
+    python -m benchmarks.compare before.json after.json
+"""
+import json
+import sys
+
+METRICS = ("p50_ms", "p99_ms", "throughput_rps")
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def change(old: float, new: float) -> str:
+    if not old:
+        return "n/a"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print(__doc__.strip(), file=sys.stderr)
+        return 2
+
+    before, after = load(argv[0]), load(argv[1])
+    print(f"before: {before['meta']['git']['commit']}  after: {after['meta']['git']['commit']}")
+    if before["meta"]["config"] != after["meta"]["config"]:
+        print("warning: runs used different configurations")
+
+    header = f"{'scenario':<18}" + "".join(f"{m:>33}" for m in METRICS)
+    print(header)
+    for name, new in after["results"].items():
+        old = before["results"].get(name)
+        if not old:
+            continue
+        cells = "".join(
+            " " + f"{old[m]} -> {new[m]} ({change(old[m], new[m])})".rjust(32)
+            for m in METRICS
+        )
+        print(f"{name:<18}{cells}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,486 @@
+"""Benchmark the Drive API against local stand-ins.
+
+Run from the ``backend`` directory:
+
+    python -m benchmarks.run --depth 3 --fanout 5 --files-per-folder 10 -o before.json
+
+Every scenario drives the real FastAPI app in-process through httpx's ASGI
+transport, so routing, auth, validation and serialization are all part of
+the measured latency. Results are written as JSON; compare two runs with
+``python -m benchmarks.compare before.json after.json``.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+from benchmarks import standins
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+standins.use_bench_env()
+
+SCENARIOS = [
+    "tree_cold",
+    "tree_warm",
+    "folder_contents",
+    "zip_download",
+    "file_download",
+    "download_links",
+    "file_content",
+    "init_upload_bulk",
+    "confirm_upload",
+    "confirm_events",
+    "move",
+    "copy",
+    "cleanup",
+]
+
+API = "/api/v1"
+
+
+@dataclass
+class Scenario:
+    run: Callable[[int], Awaitable[None]]
+    setup: Optional[Callable[[int], Awaitable[None]]] = None
+    iterations: Optional[int] = None
+    extra: Dict = field(default_factory=dict)
+
+
+@dataclass
+class Drive:
+    user: object
+    token: str
+    levels: List[List] = field(default_factory=list)
+    file_count: int = 0
+    file_ids: List = field(default_factory=list)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--depth", type=int, default=3, help="folder levels below the root")
+    parser.add_argument("--fanout", type=int, default=5, help="sub-folders per folder")
+    parser.add_argument("--files-per-folder", type=int, default=10)
+    parser.add_argument("--file-size", type=int, default=1024, help="bytes per seeded file")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--bulk-files", type=int, default=10000, help="files per init_upload_bulk request")
+    parser.add_argument("--bulk-iterations", type=int, default=5)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated subset, run in the listed order")
+    parser.add_argument("--mongo-url", help="use a real MongoDB instead of mongomock")
+    parser.add_argument("--mongo-db", default="drive_bench", help="dropped and recreated when --mongo-url is set")
+    parser.add_argument("--redis-url", help="use a real Redis instead of fakeredis")
+    parser.add_argument("--storage-root", help="store objects on disk here with the filesystem backend instead of the in-memory S3")
+    parser.add_argument("-o", "--output", help="write JSON here instead of stdout")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.depth < 2 or args.fanout < 2:
+        parser.error("--depth and --fanout must be at least 2")
+    return args
+
+
+async def bootstrap(args):
+    """Wire the stand-ins in before any service module grabs its clients."""
+    if args.storage_root:
+        os.environ["STORAGE_BACKEND"] = "filesystem"
+        os.environ["STORAGE_ROOT"] = args.storage_root
+    import app.core.redis as core_redis
+
+    if args.redis_url:
+        redis_client = standins.real_redis(args.redis_url)
+        binary_redis_client = standins.real_redis(args.redis_url, decode_responses=False)
+    else:
+        redis_client = standins.fake_redis()
+        # Same fake server, so both clients see the same keys.
+        binary_redis_client = standins.fake_redis(
+            decode_responses=False,
+            server=redis_client.connection_pool.connection_kwargs["server"]
+        )
+    core_redis.get_redis = lambda: redis_client
+    core_redis.get_binary_redis = lambda: binary_redis_client
+
+    from app.services.storage_service import storage_service
+    if args.storage_root:
+        s3_client = standins.StorageWriter(storage_service)
+    else:
+        s3_client = standins.MemoryS3Client()
+        storage_service.client = s3_client
+
+    from beanie import init_beanie
+    from app.core.database import DOCUMENT_MODELS
+
+    if args.mongo_url:
+        db = standins.motor_database(args.mongo_url, args.mongo_db)
+        await db.client.drop_database(args.mongo_db)
+    else:
+        db = standins.mongomock_database(args.mongo_db)
+    await init_beanie(database=db, document_models=DOCUMENT_MODELS)
+
+    from app.main import app
+    logging.getLogger().setLevel(args.log_level)
+    return app, s3_client, redis_client
+
+
+async def seed_drive(args, s3_client, username: str = "bench") -> Drive:
+    from app.core.security import create_access_token
+    from app.models.user import User, UserPlan
+    from app.models.resource import Resource, ResourceType
+    from app.services.storage_backend import build_s3_key
+    from beanie import PydanticObjectId
+
+    user_id = PydanticObjectId()
+    root = Resource(name="My Drive", type=ResourceType.FOLDER, owner_id=user_id)
+    await root.create()
+
+    drive = Drive(user=None, token=create_access_token(username), levels=[[root.id]])
+    payload = b"x" * args.file_size
+
+    for level in range(1, args.depth + 1):
+        folders, files = [], []
+        for parent_id in drive.levels[-1]:
+            for i in range(args.fanout):
+                folders.append(Resource(
+                    id=PydanticObjectId(),
+                    name=f"folder-{level}-{i}",
+                    type=ResourceType.FOLDER,
+                    parent_id=parent_id,
+                    owner_id=user_id
+                ))
+        for folder in folders:
+            for i in range(args.files_per_folder):
+                file_id = PydanticObjectId()
+                s3_key = build_s3_key(user_id, file_id, f"file-{i}.txt")
+                s3_client.put(s3_key, payload)
+                files.append(Resource(
+                    id=file_id,
+                    name=f"file-{i}.txt",
+                    type=ResourceType.FILE,
+                    parent_id=folder.id,
+                    owner_id=user_id,
+                    size=args.file_size,
+                    s3_key=s3_key
+                ))
+        await Resource.insert_many(folders)
+        if files:
+            await Resource.insert_many(files)
+            drive.file_ids.extend(f.id for f in files)
+        drive.levels.append([f.id for f in folders])
+        drive.file_count += len(files)
+
+    drive.user = User(
+        id=user_id,
+        username=username,
+        hashed_password="!",
+        root_id=root.id,
+        plan=UserPlan.PRO,
+        is_admin=True,
+        storage_used=drive.file_count * args.file_size
+    )
+    await drive.user.create()
+    return drive
+
+
+class Client:
+    def __init__(self, http, token: str):
+        self.http = http
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    async def request(self, method: str, url: str, expect: int = 200, **kwargs):
+        response = await self.http.request(method, url, headers=self.headers, **kwargs)
+        if response.status_code != expect:
+            raise RuntimeError(f"{method} {url} returned {response.status_code}: {response.text[:200]}")
+        return response
+
+
+def build_scenarios(args, client: Client, drive: Drive, s3_client) -> Dict[str, Scenario]:
+    from app.services.metadata_service import metadata_service
+
+    user = drive.user
+    root_id = drive.levels[0][0]
+    browse_folders = drive.levels[2]
+    leaf_folders = drive.levels[-1]
+    state = {}
+
+    async def invalidate(_):
+        await metadata_service._invalidate_tree_cache(user.id)
+
+    async def tree(_):
+        await client.request("GET", f"{API}/tree")
+
+    async def folder_contents(i):
+        await client.request("GET", f"{API}/folders/{browse_folders[i % len(browse_folders)]}")
+
+    async def zip_download(i):
+        folder_id = leaf_folders[i % len(leaf_folders)]
+        response = await client.request("GET", f"{API}/download/zip/{folder_id}", params={"token": client.headers["Authorization"][7:]})
+        state["zip_bytes"] = len(response.content)
+
+    async def file_download(i):
+        file_id = drive.file_ids[i % len(drive.file_ids)]
+        response = await client.request("GET", f"{API}/download/{file_id}")
+        url = response.json()["url"]
+        # Only the filesystem backend's URLs point back at the app.
+        if url.startswith("/"):
+            body = await client.http.get(url)
+            if body.status_code != 200:
+                raise RuntimeError(f"GET {url} returned {body.status_code}")
+            state["download_bytes"] = len(body.content)
+
+    async def download_links(i):
+        start = i * args.bulk_files % len(drive.file_ids)
+        ids = [str(file_id) for file_id in (drive.file_ids[start:] + drive.file_ids)[:args.bulk_files]]
+        response = await client.request("POST", f"{API}/download/links", json={"resource_ids": ids})
+        state["links"] = sum(1 for link in response.json()["links"] if link["url"])
+
+    async def file_content(i):
+        file_id = drive.file_ids[i % len(drive.file_ids)]
+        response = await client.request("GET", f"{API}/resources/{file_id}/content")
+        state["content_bytes"] = len(response.content)
+
+    async def create_folder(name: str, parent_id) -> str:
+        response = await client.request("POST", f"{API}/folders", json={"name": name, "parent_id": str(parent_id)})
+        return response.json()["id"]
+
+    async def init_upload_bulk(i):
+        if "bulk_parent" not in state:
+            state["bulk_parent"] = await create_folder("bulk", root_id)
+        files = [
+            {
+                "file_name": f"f{j}.txt",
+                "file_type": "text/plain",
+                "relative_path": f"upload-{i}/d{j // 100}/f{j}.txt",
+                "size": args.file_size
+            }
+            for j in range(args.bulk_files)
+        ]
+        await client.request("POST", f"{API}/upload/bulk", json={"parent_id": state["bulk_parent"], "files": files})
+
+    async def confirm_setup(i):
+        response = await client.request("POST", f"{API}/upload/init", json={
+            "parent_id": str(root_id),
+            "file_name": f"confirm-{i}.txt",
+            "file_type": "text/plain",
+            "size": args.file_size
+        })
+        init = response.json()
+        s3_client.put(init["s3_key"], b"x" * args.file_size)
+        state.setdefault("pending", {})[i] = init
+
+    async def confirm_upload(i):
+        init = state["pending"].pop(i)
+        await client.request("POST", f"{API}/upload/confirm", json={
+            "resource_id": init["resource_id"],
+            "parent_id": init["actual_parent_id"],
+            "name": f"confirm-{i}.txt",
+            "size": args.file_size,
+            "s3_key": init["s3_key"]
+        })
+
+    poster = standins.S3EventPoster(s3_client, os.environ["S3_BUCKET_NAME"], os.environ["STORAGE_EVENT_SECRET"])
+
+    async def confirm_events_setup(i):
+        response = await client.request("POST", f"{API}/upload/init", json={
+            "parent_id": str(root_id),
+            "file_name": f"event-{i}.txt",
+            "file_type": "text/plain",
+            "size": args.file_size
+        })
+        s3_key = response.json()["s3_key"]
+        s3_client.put(s3_key, b"x" * args.file_size)
+        state.setdefault("events", {})[i] = poster.take(s3_key)
+
+    async def confirm_events(i):
+        result = await poster.post(client.http, state["events"].pop(i))
+        if result["confirmed"] != 1:
+            raise RuntimeError(f"storage event confirmed {result['confirmed']} uploads")
+
+    async def move_setup(i):
+        if "move_targets" not in state:
+            state["move_targets"] = [await create_folder("move-a", root_id), await create_folder("move-b", root_id)]
+
+    async def move(i):
+        target = state["move_targets"][i % 2]
+        await client.request("POST", f"{API}/resources/move", json={
+            "resource_ids": [str(drive.levels[1][0])],
+            "target_parent_id": target
+        })
+
+    async def copy_setup(i):
+        if "copy_target" not in state:
+            state["copy_target"] = await create_folder("copies", root_id)
+
+    async def copy(i):
+        await client.request("POST", f"{API}/resources/copy", json={
+            "resource_ids": [str(drive.levels[-2][i % len(drive.levels[-2])])],
+            "target_parent_id": state["copy_target"]
+        })
+
+    async def cleanup_setup(i):
+        folder_id = await create_folder(f"trash-{i}", root_id)
+        for j in range(args.files_per_folder):
+            response = await client.request("POST", f"{API}/upload/init", json={
+                "parent_id": folder_id,
+                "file_name": f"t{j}.txt",
+                "file_type": "text/plain",
+                "size": args.file_size
+            })
+            init = response.json()
+            s3_client.put(init["s3_key"], b"x" * args.file_size)
+            await client.request("POST", f"{API}/upload/confirm", json={
+                "resource_id": init["resource_id"],
+                "parent_id": folder_id,
+                "name": f"t{j}.txt",
+                "size": args.file_size,
+                "s3_key": init["s3_key"]
+            })
+        await client.request("DELETE", f"{API}/resources/{folder_id}")
+
+    async def cleanup(i):
+        await client.request("POST", f"{API}/cleanup")
+
+    return {
+        "tree_cold": Scenario(run=tree, setup=invalidate),
+        "tree_warm": Scenario(run=tree, setup=None, extra={"warmup": 1}),
+        "folder_contents": Scenario(run=folder_contents),
+        "zip_download": Scenario(run=zip_download, extra={"state_key": "zip_bytes"}),
+        "file_download": Scenario(run=file_download, extra={"state_key": "download_bytes"}),
+        "download_links": Scenario(run=download_links, extra={"state_key": "links"}),
+        "file_content": Scenario(run=file_content, extra={"state_key": "content_bytes"}),
+        "init_upload_bulk": Scenario(run=init_upload_bulk, iterations=args.bulk_iterations, extra={"files_per_request": args.bulk_files}),
+        "confirm_upload": Scenario(run=confirm_upload, setup=confirm_setup),
+        "confirm_events": Scenario(run=confirm_events, setup=confirm_events_setup),
+        "move": Scenario(run=move, setup=move_setup),
+        "copy": Scenario(run=copy, setup=copy_setup),
+        "cleanup": Scenario(run=cleanup, setup=cleanup_setup),
+    }, state
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+async def run_scenario(scenario: Scenario, iterations: int, concurrency: int) -> dict:
+    for i in range(scenario.extra.get("warmup", 0)):
+        await scenario.run(-1 - i)
+
+    pending = iter(range(iterations))
+    latencies, errors = [], {}
+
+    async def worker():
+        for i in pending:
+            try:
+                if scenario.setup:
+                    await scenario.setup(i)
+                start = time.perf_counter()
+                await scenario.run(i)
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                message = str(e).splitlines()[0][:200] if str(e) else type(e).__name__
+                errors[message] = errors.get(message, 0) + 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    values = sorted(latencies)
+    mean = sum(values) / len(values) if values else 0.0
+    return {
+        "iterations": iterations,
+        "completed": len(values),
+        "concurrency": concurrency,
+        "errors": errors,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p90_ms": round(percentile(values, 90) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "mean_ms": round(mean * 1000, 3),
+        "min_ms": round(values[0] * 1000, 3) if values else 0.0,
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+        # Little's law: with every worker kept busy, throughput is
+        # concurrency / mean latency. Untimed setup steps are excluded.
+        "throughput_rps": round(concurrency / mean, 3) if mean else 0.0,
+    }
+
+
+def git_revision() -> dict:
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=here, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--", ".."], cwd=here, capture_output=True, text=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+async def main(argv=None) -> dict:
+    args = parse_args(argv)
+    from httpx import AsyncClient, ASGITransport
+
+    app, s3_client, _ = await bootstrap(args)
+
+    seed_start = time.perf_counter()
+    drive = await seed_drive(args, s3_client)
+    folder_count = sum(len(level) for level in drive.levels)
+    seed = {
+        "folders": folder_count,
+        "files": drive.file_count,
+        "nodes": folder_count + drive.file_count,
+        "seconds": round(time.perf_counter() - seed_start, 3)
+    }
+    print(f"seeded {seed['nodes']} nodes in {seed['seconds']}s", file=sys.stderr)
+
+    results = {}
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench", timeout=None) as http:
+        client = Client(http, drive.token)
+        scenarios, state = build_scenarios(args, client, drive, s3_client)
+        for name in args.scenarios.split(","):
+            if name == "confirm_events" and args.storage_root:
+                print("skipping confirm_events: the filesystem backend sends no storage events", file=sys.stderr)
+                continue
+            scenario = scenarios[name]
+            iterations = scenario.iterations or args.iterations
+            print(f"running {name} x{iterations}", file=sys.stderr)
+            result = await run_scenario(scenario, iterations, args.concurrency)
+            for key in ("files_per_request",):
+                if key in scenario.extra:
+                    result[key] = scenario.extra[key]
+            if scenario.extra.get("state_key") in state:
+                result[scenario.extra["state_key"]] = state[scenario.extra["state_key"]]
+            results[name] = result
+            print(f"  p50 {result['p50_ms']}ms  p99 {result['p99_ms']}ms  errors {sum(result['errors'].values())}", file=sys.stderr)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backends": {
+                "mongo": "mongodb" if args.mongo_url else "mongomock",
+                "redis": "redis" if args.redis_url else "fakeredis",
+                "storage": "filesystem" if args.storage_root else "memory-s3"
+            },
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "mongo_url", "redis_url", "log_level")},
+            "seed": seed
+        },
+        "results": results
+    }
+
+
+if __name__ == "__main__":
+    output_path = parse_args().output
+    report = json.dumps(asyncio.run(main()), indent=2)
+    if output_path:
+        with open(output_path, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
@@ -0,0 +1,247 @@
+"""In-process stand-ins for the services the backend talks to.
+
+Mongo and Redis default to mongomock and fakeredis so a run needs nothing
+but pip packages; both can be pointed at real local servers instead. S3 is
+always replaced by an in-memory client that speaks the subset of the boto3
+API used by ``S3Service``; ``S3EventPoster`` plays the part of the bucket's
+event notifications.
+"""
+from botocore.exceptions import ClientError
+from datetime import datetime, timezone
+from urllib.parse import quote_plus
+import hashlib
+import io
+import os
+import threading
+import uuid
+
+# Settings are read at import time; give the required ones harmless values.
+BENCH_ENV = {
+    "AWS_ACCESS_KEY_ID": "bench",
+    "AWS_SECRET_ACCESS_KEY": "bench",
+    "AWS_REGION": "us-east-1",
+    "S3_BUCKET_NAME": "bench",
+    "DATABASE_URL": "mongodb://localhost:27017",
+    "SECRET_KEY": "bench-secret",
+    "JOB_BACKEND": "local",
+    "STORAGE_EVENT_SECRET": "bench-events",
+    # Scenarios hammer the expensive endpoints on purpose.
+    "ADMISSION_ENABLED": "false",
+}
+
+
+def use_bench_env():
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+
+
+def _not_found(operation: str) -> ClientError:
+    return ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, operation)
+
+
+class _Paginator:
+    def __init__(self, client, page_size: int = 1000):
+        self.client = client
+        self.page_size = page_size
+
+    def paginate(self, Bucket: str, Prefix: str = ""):
+        with self.client.lock:
+            keys = sorted(k for k in self.client.objects if k.startswith(Prefix))
+            objects = [(k, self.client.objects[k]) for k in keys]
+        for i in range(0, len(objects), self.page_size):
+            yield {
+                "Contents": [
+                    {"Key": key, "LastModified": obj["last_modified"], "Size": len(obj["body"])}
+                    for key, obj in objects[i:i + self.page_size]
+                ]
+            }
+
+
+class MemoryS3Client:
+    """Thread-safe in-memory replacement for ``boto3.client('s3')``."""
+
+    def __init__(self):
+        self.objects = {}
+        self.multipart = {}
+        self.lock = threading.Lock()
+        # Called with (key, size) whenever an object is written.
+        self.listeners = []
+
+    def _store(self, key: str, body: bytes, content_type: str = None, last_modified: datetime = None) -> str:
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        self.objects[key] = {
+            "body": body,
+            "etag": etag,
+            "content_type": content_type,
+            "last_modified": last_modified or datetime.now(timezone.utc)
+        }
+        for listener in self.listeners:
+            listener(key, len(body))
+        return etag
+
+    def put(self, key: str, body: bytes, last_modified: datetime = None):
+        with self.lock:
+            self._store(key, body, last_modified=last_modified)
+
+    def generate_presigned_url(self, ClientMethod: str, Params: dict, ExpiresIn: int = 3600) -> str:
+        return f"http://s3.local/{Params['Bucket']}/{Params['Key']}?op={ClientMethod}&expires={ExpiresIn}"
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, IfMatch: str = None, ContentType: str = None):
+        with self.lock:
+            if IfMatch is not None:
+                current = self.objects.get(Key)
+                if not current or current["etag"] != IfMatch:
+                    raise ClientError({"Error": {"Code": "PreconditionFailed", "Message": "At least one of the pre-conditions you specified did not hold"}}, "PutObject")
+            return {"ETag": self._store(Key, bytes(Body), ContentType)}
+
+    def get_object(self, Bucket: str, Key: str):
+        with self.lock:
+            obj = self.objects.get(Key)
+        if not obj:
+            raise _not_found("GetObject")
+        return {"Body": io.BytesIO(obj["body"]), "ETag": obj["etag"], "ContentLength": len(obj["body"])}
+
+    def head_object(self, Bucket: str, Key: str):
+        with self.lock:
+            obj = self.objects.get(Key)
+        if not obj:
+            raise _not_found("HeadObject")
+        return {"ContentLength": len(obj["body"]), "ETag": obj["etag"], "LastModified": obj["last_modified"]}
+
+    def copy_object(self, Bucket: str, Key: str, CopySource: dict, CopySourceIfMatch: str = None):
+        with self.lock:
+            source = self.objects.get(CopySource["Key"])
+            if not source:
+                raise _not_found("CopyObject")
+            if CopySourceIfMatch is not None and source["etag"] != CopySourceIfMatch:
+                raise ClientError({"Error": {"Code": "PreconditionFailed", "Message": "At least one of the pre-conditions you specified did not hold"}}, "CopyObject")
+            return {"CopyObjectResult": {"ETag": self._store(Key, source["body"], source["content_type"])}}
+
+    def delete_object(self, Bucket: str, Key: str):
+        with self.lock:
+            self.objects.pop(Key, None)
+
+    def download_file(self, Bucket: str, Key: str, Filename: str):
+        with open(Filename, "wb") as f:
+            f.write(self.get_object(Bucket, Key)["Body"].read())
+
+    def create_multipart_upload(self, Bucket: str, Key: str):
+        upload_id = uuid.uuid4().hex
+        with self.lock:
+            self.multipart[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body: bytes):
+        with self.lock:
+            self.multipart[UploadId][PartNumber] = bytes(Body)
+        return {"ETag": f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict):
+        with self.lock:
+            parts = self.multipart.pop(UploadId)
+            body = b"".join(parts[p["PartNumber"]] for p in MultipartUpload["Parts"])
+            self._store(Key, body)
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str):
+        with self.lock:
+            self.multipart.pop(UploadId, None)
+
+    def get_paginator(self, operation: str):
+        return _Paginator(self)
+
+
+class StorageWriter:
+    """Puts objects through a real storage backend for the scenarios that
+    would otherwise write to ``MemoryS3Client`` directly."""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.listeners = []
+
+    def put(self, key: str, body: bytes, last_modified: datetime = None):
+        self.storage.upload_bytes(key, body)
+        if last_modified:
+            timestamp = last_modified.timestamp()
+            os.utime(self.storage.path(key), (timestamp, timestamp))
+
+
+def s3_event_record(bucket: str, key: str, size: int, event_name: str = "ObjectCreated:Put") -> dict:
+    """One record in the shape S3 event notifications use; keys are URL-encoded."""
+    return {
+        "eventVersion": "2.1",
+        "eventSource": "aws:s3",
+        "eventTime": datetime.now(timezone.utc).isoformat(),
+        "eventName": event_name,
+        "s3": {
+            "bucket": {"name": bucket},
+            "object": {"key": quote_plus(key), "size": size}
+        }
+    }
+
+
+class S3EventPoster:
+    """Collects ObjectCreated events from a ``MemoryS3Client`` and posts them
+    to the ingestion endpoint in batches, like a notification forwarder."""
+
+    def __init__(self, s3_client: MemoryS3Client, bucket: str, secret: str, url: str = "/api/v1/storage/events"):
+        self.bucket = bucket
+        self.secret = secret
+        self.url = url
+        self.pending = []
+        self.lock = threading.Lock()
+        s3_client.listeners.append(self._object_created)
+
+    def _object_created(self, key: str, size: int):
+        with self.lock:
+            self.pending.append(s3_event_record(self.bucket, key, size))
+
+    def take(self, key: str) -> list:
+        """Removes and returns the pending records for one key."""
+        encoded = quote_plus(key)
+        with self.lock:
+            taken = [r for r in self.pending if r["s3"]["object"]["key"] == encoded]
+            self.pending = [r for r in self.pending if r["s3"]["object"]["key"] != encoded]
+        return taken
+
+    async def post(self, http, records: list) -> dict:
+        response = await http.post(self.url, json={"Records": records}, headers={"X-Drive-Event-Secret": self.secret})
+        response.raise_for_status()
+        return response.json()
+
+    async def flush(self, http) -> dict:
+        """Posts every pending record in one delivery, returning the response body."""
+        with self.lock:
+            records, self.pending = self.pending, []
+        return await self.post(http, records)
+
+
+def mongomock_client(*args, **kwargs):
+    """Drop-in for ``AsyncIOMotorClient``; connection arguments are ignored."""
+    import mongomock
+    from mongomock_motor import AsyncMongoMockClient
+
+    # Beanie passes keyword arguments mongomock does not accept.
+    if not getattr(mongomock.database.Database, "_bench_patched", False):
+        original = mongomock.database.Database.list_collection_names
+        mongomock.database.Database.list_collection_names = lambda self, *args, **kwargs: original(self, kwargs.get("filter"))
+        mongomock.database.Database._bench_patched = True
+    return AsyncMongoMockClient()
+
+
+def mongomock_database(name: str):
+    return mongomock_client()[name]
+
+
+def motor_database(url: str, name: str):
+    from motor.motor_asyncio import AsyncIOMotorClient
+    return AsyncIOMotorClient(url)[name]
+
+
+def fake_redis(decode_responses: bool = True, server=None):
+    import fakeredis.aioredis
+    return fakeredis.aioredis.FakeRedis(server=server, decode_responses=decode_responses)
+
+
+def real_redis(url: str, decode_responses: bool = True):
+    from app.core.metrics import InstrumentedRedis
+    return InstrumentedRedis.from_url(url, decode_responses=decode_responses)
@@ -0,0 +1,134 @@
+"""Measure worker cold start: importing ``app.main`` and running the lifespan.
+
+    python -m benchmarks.startup -o startup.json
+
+Imports are timed in fresh interpreters, with socket.connect and getaddrinfo
+patched to record any network access an import triggers. The lifespan is
+timed in-process against the same stand-ins as ``benchmarks.run``, with and
+without index syncing.
+"""
+from datetime import datetime, timezone
+from benchmarks import standins
+from benchmarks.run import git_revision, percentile
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+
+standins.use_bench_env()
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = """
+import json, socket, time
+attempts = []
+_connect, _getaddrinfo = socket.socket.connect, socket.getaddrinfo
+def connect(self, address):
+    attempts.append(["connect", repr(address)])
+    return _connect(self, address)
+def getaddrinfo(host, *args, **kwargs):
+    attempts.append(["getaddrinfo", str(host)])
+    return _getaddrinfo(host, *args, **kwargs)
+socket.socket.connect, socket.getaddrinfo = connect, getaddrinfo
+start = time.perf_counter()
+import app.main
+print(json.dumps({"seconds": time.perf_counter() - start, "network": attempts}))
+"""
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--import-runs", type=int, default=5)
+    parser.add_argument("--lifespan-runs", type=int, default=5)
+    parser.add_argument("--mongo-url", help="use a real MongoDB instead of mongomock")
+    parser.add_argument("-o", "--output", help="write JSON here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def summarize(samples) -> dict:
+    values = sorted(samples)
+    return {
+        "runs": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "min_ms": round(values[0] * 1000, 3) if values else 0.0,
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+def measure_import(runs: int) -> dict:
+    samples, network = [], []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROBE],
+            cwd=BACKEND_DIR,
+            env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        samples.append(probe["seconds"])
+        network = probe["network"]
+    return {**summarize(samples), "network_calls": network}
+
+
+async def measure_lifespan(args, sync_indexes: bool) -> dict:
+    import app.core.database as database
+    import app.core.redis as core_redis
+
+    fake_redis = standins.fake_redis()
+    core_redis.get_redis = lambda: fake_redis
+    if not args.mongo_url:
+        database.AsyncIOMotorClient = standins.mongomock_client
+    else:
+        database.settings.database_url = args.mongo_url
+    database.settings.database_sync_indexes = sync_indexes
+
+    from app.main import app
+    logging.getLogger().setLevel(logging.WARNING)
+
+    startup, shutdown = [], []
+    for _ in range(args.lifespan_runs):
+        start = time.perf_counter()
+        async with app.router.lifespan_context(app):
+            startup.append(time.perf_counter() - start)
+            start = time.perf_counter()
+        shutdown.append(time.perf_counter() - start)
+    return {"startup": summarize(startup), "shutdown": summarize(shutdown)}
+
+
+async def main(argv=None) -> dict:
+    args = parse_args(argv)
+    print("timing imports", file=sys.stderr)
+    import_result = measure_import(args.import_runs)
+    print("timing lifespan", file=sys.stderr)
+    lifespan = {
+        "sync_indexes": await measure_lifespan(args, True),
+        "skip_indexes": await measure_lifespan(args, False),
+    }
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backends": {"mongo": "mongodb" if args.mongo_url else "mongomock", "redis": "fakeredis"},
+            "config": {"import_runs": args.import_runs, "lifespan_runs": args.lifespan_runs}
+        },
+        "results": {"import": import_result, "lifespan": lifespan}
+    }
+
+
+if __name__ == "__main__":
+    output_path = parse_args().output
+    report = json.dumps(asyncio.run(main()), indent=2)
+    if output_path:
+        with open(output_path, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)